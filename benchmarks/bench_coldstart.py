@@ -0,0 +1,101 @@
+"""Cold start of `cdiapi serve`: time from process start to the first
+answered search, the latency of the first searches and the time until
+/readyz reports the worker warmed up (needs a MongoDB on CDIAPI_MONGO_URI):
+
+    python -m benchmarks.bench_coldstart --runs 5
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Optional
+import httpx
+
+from benchmarks.common import free_port, start_server, stop_server
+from benchmarks.bench_search import run_stub_meili
+
+
+def import_time() -> float:
+    """Seconds a fresh interpreter takes to import the app module."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import cdiapi.app"], check=True)
+    return time.perf_counter() - start
+
+
+def wait_for(client: httpx.Client, url: str, timeout: float) -> Optional[float]:
+    """Poll `url` until it answers 200, return the latency of that request."""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if client.get(url).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def cold_start(meili_url: str, ready_timeout: float) -> Dict[str, Optional[float]]:
+    port = free_port()
+    env = dict(
+        os.environ,
+        CDIAPI_MEILISEARCH_URL=meili_url,
+        CDIAPI_MEILISEARCH_INDEX="fulldb",
+        CDIAPI_DEBUG="false",
+        CDIAPI_SEARCH_CACHE_TTL="0",
+    )
+    cmd = [sys.executable, "-m", "cdiapi.cli", "serve", "--host", "127.0.0.1"]
+    cmd += ["--port", str(port), "--workers", "1"]
+    base = "http://127.0.0.1:%d" % port
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(timeout=30) as client:
+            first = wait_for(client, base + "/index/0.1/query?q=water", 60)
+            answered = time.perf_counter() - start
+            second = wait_for(client, base + "/index/0.1/query?q=land", 60)
+            ready = None
+            if wait_for(client, base + "/readyz", ready_timeout) is not None:
+                ready = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait(30)
+    return {"answered": answered, "first": first, "second": second, "ready": ready}
+
+
+def _median(values: List[Optional[float]]) -> str:
+    found = [v for v in values if v is not None]
+    if len(found) < len(values):
+        return "%10s" % "-"
+    return "%10.1f" % (statistics.median(found) * 1000)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ready-timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    stub, stub_port = start_server(run_stub_meili, 0.0)
+    meili_url = "http://127.0.0.1:%d" % stub_port
+    imports: List[Optional[float]] = []
+    runs: List[Dict[str, Optional[float]]] = []
+    try:
+        for _ in range(args.runs):
+            imports.append(import_time())
+            runs.append(cold_start(meili_url, args.ready_timeout))
+    finally:
+        stop_server(stub)
+    print("median of %d runs, ms" % args.runs)
+    print("%-32s %s" % ("import cdiapi.app", _median(imports)))
+    print("%-32s %s" % ("start to first search answered", _median([r["answered"] for r in runs])))
+    print("%-32s %s" % ("first search latency", _median([r["first"] for r in runs])))
+    print("%-32s %s" % ("second search latency", _median([r["second"] for r in runs])))
+    print("%-32s %s" % ("start to /readyz", _median([r["ready"] for r in runs])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Load benchmark for /index/0.1/query against a local stub Meilisearch.
+
+Compares the former request path (a new blocking `meilisearch.Client` per call,
+needs the `meilisearch` package) with the shared asynchronous client, without
+and with the search result cache:
+
+    python -m benchmarks.bench_search --requests 2000 --concurrency 50
+"""
+import os
+import asyncio
+import argparse
+from typing import Any, Dict
+
+from benchmarks.common import start_server, stop_server, run_load, print_report
+
+STUB_RESULT: Dict[str, Any] = {
+    "hits": [{"id": "cdi00000002-%d" % i, "dataset": {"title": "Dataset %d" % i}} for i in range(20)],
+    "query": "",
+    "processingTimeMs": 1,
+    "hitsPerPage": 20,
+    "page": 1,
+    "totalPages": 50,
+    "totalHits": 1000,
+    "facetDistribution": {},
+}
+
+
+def run_stub_meili(port: int, latency: float) -> None:
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    async def search(request: Request) -> JSONResponse:
+        await request.body()
+        await asyncio.sleep(latency)
+        return JSONResponse(STUB_RESULT)
+
+    async def index(request: Request) -> JSONResponse:
+        return JSONResponse({"uid": request.path_params["index"], "updatedAt": "2024-01-01T00:00:00Z"})
+
+    app = Starlette(
+        routes=[
+            Route("/indexes/{index}/search", search, methods=["POST"]),
+            Route("/indexes/{index}", index),
+        ]
+    )
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="error")
+
+
+def run_legacy_api(port: int, meili_url: str) -> None:
+    import uvicorn
+    import meilisearch
+    from fastapi import FastAPI, Query
+    from fastapi.responses import JSONResponse
+
+    app = FastAPI()
+
+    @app.get("/index/0.1/query")
+    async def search_entries(q: str = Query("")) -> JSONResponse:
+        client = meilisearch.Client(meili_url, None)
+        params = {"offset": 0, "limit": 1000, "filter": [], "hitsPerPage": 20, "page": 1}
+        return JSONResponse(client.index("fulldb").search(q, params))
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="error")
+
+
+def run_api(port: int, meili_url: str, cache: bool = False) -> None:
+    os.environ["CDIAPI_MEILISEARCH_URL"] = meili_url
+    os.environ["CDIAPI_MEILISEARCH_INDEX"] = "fulldb"
+    os.environ["CDIAPI_SEARCH_CACHE_TTL"] = "60" if cache else "0"
+    # All requests come from one client:
+    os.environ["CDIAPI_RATE_LIMITS"] = "off"
+    import uvicorn
+    from cdiapi.app import create_app
+
+    uvicorn.run(create_app(), host="127.0.0.1", port=port, log_level="error")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="stub search time, seconds")
+    args = parser.parse_args()
+
+    stub, stub_port = start_server(run_stub_meili, args.latency)
+    meili_url = "http://127.0.0.1:%d" % stub_port
+    rows = []
+    try:
+        targets = (
+            ("before (blocking client)", run_legacy_api, ()),
+            ("after (shared async)", run_api, ()),
+            ("after (result cache)", run_api, (True,)),
+        )
+        for name, target, extra in targets:
+            try:
+                proc, port = start_server(target, meili_url, *extra)
+            except RuntimeError as exc:
+                print("%s: %s" % (name, exc))
+                continue
+            try:
+                url = "http://127.0.0.1:%d/index/0.1/query?q=water" % port
+                run_load(url, requests=min(100, args.requests), concurrency=args.concurrency)
+                rows.append((name, run_load(url, args.requests, args.concurrency)))
+            finally:
+                stop_server(proc)
+    finally:
+        stop_server(stub)
+    print_report(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""CPU cost of encoding store documents per endpoint: FastAPI response_model
+validation and serialization versus the direct orjson path.
+
+    python -m benchmarks.bench_serialization --number 20
+"""
+import json
+import timeit
+import argparse
+from typing import Any, Callable, Dict, List, Tuple, Type
+from pydantic import BaseModel
+
+from cdiapi.data.common import DataCatalogResponse, DataCatalogSearchResponse
+from cdiapi.data.common import SearchIndexEntryResponse, SearchIndexSearchResponse
+from cdiapi.data.common import SearchIndexSummarySearchResponse
+from cdiapi.data.search import SearchIndexEntrySummary
+from cdiapi.data.projection import model_projection
+from cdiapi.responses import dump_json
+
+LOCATION = {"country": {"id": "AE", "name": "United Arab Emirates"}, "level": 1}
+
+
+def make_catalog(num: int) -> Dict[str, Any]:
+    return {
+        "id": "databayanatae%d" % num,
+        "uid": "cdi%08d" % num,
+        "name": "UAE Open Data Portal",
+        "link": "https://data.bayanat.ae",
+        "catalog_type": "Open data portal",
+        "api": True,
+        "api_status": "active",
+        "access_mode": ["open"],
+        "langs": [{"id": "EN", "name": "English"}, {"id": "AR", "name": "Arabic"}],
+        "tags": ["government", "statistics"],
+        "content_types": ["dataset"],
+        "coverage": [{"location": LOCATION}],
+        "endpoints": [{"type": "ckanapi", "url": "https://data.bayanat.ae/api/3", "version": "3"}],
+        "identifiers": [{"id": "wikidata", "url": None, "value": "Q123"}],
+        "owner": {"name": "Government of UAE", "link": None, "type": "Central government", "location": LOCATION},
+        "software": {"id": "ckan", "name": "CKAN"},
+        "status": "active",
+        "topics": [{"id": "GOVE", "name": "Government", "type": "eudatatheme"}],
+    }
+
+
+def make_entry(num: int) -> Dict[str, Any]:
+    return {
+        "id": "cdi00000002-%d" % num,
+        "int_id": str(num),
+        "source": {
+            "uid": "cdi00000002",
+            "name": "UAE Open Data Portal",
+            "url": "https://data.bayanat.ae",
+            "catalog_type": "Open data portal",
+            "langs": [{"id": "EN", "name": "English"}],
+            "owner_name": "Government of UAE",
+            "owner_type": "Central government",
+            "software": {"id": "ckan", "name": "CKAN"},
+            "countries": [{"id": "AE", "name": "United Arab Emirates"}],
+            "macroregions": [{"id": "145", "name": "Western Asia"}],
+            "subregions": [],
+        },
+        "dataset": {
+            "id": str(num),
+            "title": "Open Field Vegetable Crops %d" % num,
+            "num_resources": 2,
+            "url": "https://data.bayanat.ae/dataset/open-field-%d" % num,
+            "description": "The dataset show the area and distribution of crops. " * 10,
+            "has_archive": False,
+            "tags": ["Farms", "Vegetable Crops", "agriculture"],
+            "formats": ["XLSX", "CSV"],
+            "responsible": [{"id": "adafsa", "title": "Abu Dhabi Agriculture", "role": "Publisher"}],
+            "license_id": "cc-by",
+            "license_name": "Creative Commons Attribution",
+        },
+        "resources": [
+            {"id": "r%d-%d" % (num, i), "name": "Crops", "format": "XLSX", "url": "https://data.bayanat.ae/r/%d" % i}
+            for i in range(2)
+        ],
+    }
+
+
+def make_page(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    meta = {"offset": 0, "limit": len(items), "num": len(items), "total": 100000}
+    return {"meta": meta, "data": items}
+
+
+def project(doc: Any, projection: Dict[str, int]) -> Any:
+    """Rough in-memory stand-in for the MongoDB projection of a summary."""
+    out: Dict[str, Any] = {}
+    for path in projection:
+        src, dst = doc, out
+        parts = path.split(".")
+        for part in parts[:-1]:
+            src = src.get(part, {})
+            dst = dst.setdefault(part, {})
+        if parts[-1] in src:
+            dst[parts[-1]] = src[parts[-1]]
+    return out
+
+
+def validated(model: Type[BaseModel], content: Any) -> Callable[[], bytes]:
+    def run() -> bytes:
+        data = model.model_validate(content).model_dump(mode="json")
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    return run
+
+
+def direct(content: Any) -> Callable[[], bytes]:
+    return lambda: dump_json(content)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=500)
+    args = parser.parse_args()
+
+    entries = [make_entry(i) for i in range(args.limit)]
+    catalogs = [make_catalog(i) for i in range(args.limit)]
+    summary = model_projection(SearchIndexEntrySummary)
+    cases: List[Tuple[str, Type[BaseModel], Any]] = [
+        ("/registry/catalog/{id}", DataCatalogResponse, catalogs[0]),
+        ("/registry/search/catalogs/", DataCatalogSearchResponse,
+         make_page([{k: c[k] for k in ("uid", "name", "link")} for c in catalogs])),
+        ("/raw/0.1/entry/{id}", SearchIndexEntryResponse, entries[0]),
+        ("/raw/0.1/search", SearchIndexSearchResponse, make_page(entries)),
+        ("/raw/0.1/search?view=summary", SearchIndexSummarySearchResponse,
+         make_page([project(e, summary) for e in entries])),
+    ]
+    print("%-32s %14s %14s %8s" % ("endpoint", "validate ms", "direct ms", "saved"))
+    for name, model, content in cases:
+        slow = timeit.timeit(validated(model, content), number=args.number) / args.number
+        fast = timeit.timeit(direct(content), number=args.number) / args.number
+        print("%-32s %14.3f %14.3f %7.0f%%" % (name, slow * 1000, fast * 1000, 100 * (1 - fast / slow)))
+
+
+if __name__ == "__main__":
+    main()
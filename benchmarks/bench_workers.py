@@ -0,0 +1,80 @@
+"""Throughput of `cdiapi serve` with a growing number of worker processes.
+
+Each request to /index/0.1/query decodes, hashes and re-encodes a large stub
+Meilisearch response, which keeps a single process CPU bound:
+
+    python -m benchmarks.bench_workers --workers 1,2,4 --requests 3000
+"""
+import os
+import sys
+import argparse
+import subprocess
+from typing import Any, Dict
+
+from benchmarks.common import free_port, wait_for_port, start_server, stop_server
+from benchmarks.common import run_load, print_report
+from benchmarks.bench_search import run_stub_meili
+import benchmarks.bench_search as bench_search
+
+STUB_RESULT: Dict[str, Any] = {
+    **bench_search.STUB_RESULT,
+    "hits": [
+        {
+            "id": "cdi00000002-%d" % i,
+            "dataset": {"title": "Dataset %d" % i, "description": "Lorem ipsum " * 20},
+            "source": {"uid": "cdi00000002", "countries": [{"id": "AE", "name": "UAE"}]},
+        }
+        for i in range(200)
+    ],
+}
+
+
+def run_workers(workers: int, meili_url: str) -> "subprocess.Popen[bytes]":
+    port = free_port()
+    env = dict(
+        os.environ,
+        CDIAPI_MEILISEARCH_URL=meili_url,
+        CDIAPI_MEILISEARCH_INDEX="fulldb",
+        CDIAPI_DEBUG="false",
+        CDIAPI_MAX_REQUESTS="0",
+        # Every request is the same search, measure the work behind it:
+        CDIAPI_SEARCH_CACHE_TTL="0",
+        CDIAPI_RATE_LIMITS="off",
+    )
+    cmd = [sys.executable, "-m", "cdiapi.cli", "serve", "--host", "127.0.0.1"]
+    cmd += ["--port", str(port), "--workers", str(workers)]
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    proc.port = port  # type: ignore
+    wait_for_port(port)
+    return proc
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    bench_search.STUB_RESULT = STUB_RESULT
+    stub, stub_port = start_server(run_stub_meili, 0.0)
+    meili_url = "http://127.0.0.1:%d" % stub_port
+    rows = []
+    try:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            proc = run_workers(workers, meili_url)
+            try:
+                url = "http://127.0.0.1:%d/index/0.1/query?q=water&limit=20" % proc.port  # type: ignore
+                run_load(url, requests=min(200, args.requests), concurrency=args.concurrency)
+                rows.append(("%d worker(s)" % workers, run_load(url, args.requests, args.concurrency)))
+            finally:
+                proc.terminate()
+                proc.wait(30)
+    finally:
+        stop_server(stub)
+    print("CPUs: %d" % (os.cpu_count() or 1))
+    print_report(rows)
+
+
+if __name__ == "__main__":
+    main()
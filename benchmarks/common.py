@@ -0,0 +1,98 @@
+"""Helpers shared by the load benchmarks in this directory."""
+import time
+import socket
+import asyncio
+import statistics
+import multiprocessing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import httpx
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def wait_for_port(port: int, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server on port %d did not start" % port)
+
+
+def start_server(
+    target: Callable[..., None], *args: Any
+) -> Tuple[multiprocessing.Process, int]:
+    """Run `target(port, *args)` in a child process and wait until it listens."""
+    port = free_port()
+    proc = multiprocessing.Process(target=target, args=(port, *args), daemon=True)
+    proc.start()
+    wait_for_port(port)
+    return proc, port
+
+
+def stop_server(proc: multiprocessing.Process) -> None:
+    proc.terminate()
+    proc.join(10)
+
+
+async def _load(
+    url: str, requests: int, concurrency: int, method: str, json: Any
+) -> Tuple[List[float], int, float]:
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+
+        async def worker() -> None:
+            nonlocal errors
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    resp = await client.request(method, url, json=json)
+                    if resp.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def run_load(
+    url: str,
+    requests: int = 1000,
+    concurrency: int = 50,
+    method: str = "GET",
+    json: Optional[Any] = None,
+) -> Dict[str, float]:
+    """Fire `requests` calls at `url` from `concurrency` clients and summarize."""
+    latencies, errors, elapsed = asyncio.run(
+        _load(url, requests, concurrency, method, json)
+    )
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": quantiles[49] * 1000,
+        "p99": quantiles[98] * 1000,
+        "errors": errors,
+    }
+
+
+def print_report(rows: List[Tuple[str, Dict[str, float]]]) -> None:
+    print("%-24s %10s %10s %10s %8s" % ("mode", "req/s", "p50 ms", "p99 ms", "errors"))
+    for name, stats in rows:
+        print(
+            "%-24s %10.1f %10.1f %10.1f %8d"
+            % (name, stats["rps"], stats["p50"], stats["p99"], stats["errors"])
+        )
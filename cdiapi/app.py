@@ -1,4 +1,9 @@
+import math
 import time
+import random
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable
 from uuid import uuid4
 from fastapi import FastAPI
 from fastapi import Request, Response
@@ -8,11 +13,53 @@ from structlog.contextvars import clear_contextvars, bind_contextvars
 
 from cdiapi import settings
 from cdiapi.logs import get_logger
-from cdiapi.routers import catalog, search, raw
+from cdiapi.db import Store
+from cdiapi.cache import RedisBackend, search_cache
+from cdiapi.compression import CompressionMiddleware
+from cdiapi.limits import Rejection, RedisLimitBackend, current_route, limiter, route_class
+from cdiapi.metrics import REQUEST_LATENCY, REQUESTS_IN_FLIGHT, REQUESTS_REJECTED
+from cdiapi.metrics import CommandMetrics, PoolMetrics, route_label
+from cdiapi.profiling import profile_requested, save_profile, start_profile
+from cdiapi.timing import Timings, current_timings
+from cdiapi.meili import MeiliClient, ApiError, TransportError
+from cdiapi.warmup import WarmUp
 
 log = get_logger("cdiapi")
 
 
+# Health checks polled by the orchestrator, logged only when they fail:
+PROBE_PATHS = ("/healthz", "/readyz")
+
+
+def log_request(status: int, took: float, path: str = "", rejected: bool = False) -> bool:
+    """Failed and slow requests are always logged, others are sampled. So are
+    rejected requests, which come in floods."""
+    if rejected:
+        return random.random() < settings.LOG_SAMPLE_RATE
+    if status >= 400 or took >= settings.LOG_SLOW_REQUEST:
+        return True
+    if path in PROBE_PATHS:
+        return False
+    return random.random() < settings.LOG_SAMPLE_RATE
+
+
+async def release_after(
+    body: AsyncIterator[Any], release: Callable[[], None]
+) -> AsyncIterator[Any]:
+    """Pass the body of a response through, then give its slot back."""
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        release()
+
+
+def rejected_response(rejection: Rejection) -> Response:
+    headers = {"Retry-After": str(max(1, math.ceil(rejection.retry_after)))}
+    content = {"detail": rejection.detail}
+    return JSONResponse(status_code=rejection.status, content=content, headers=headers)
+
+
 async def request_middleware(
     request: Request, call_next: RequestResponseEndpoint
 ) -> Response:
@@ -25,39 +72,101 @@ async def request_middleware(
         trace_id=trace_id,
         client_ip=client_ip,
     )
+    timings = Timings()
+    timings_token = current_timings.set(timings)
+    profiler = start_profile() if profile_requested(request) else None
+    route_token = current_route.set(route_class(request.url.path)[0])
+    rejection = await limiter.admit(request.url.path, request.query_params, client_ip)
+    REQUESTS_IN_FLIGHT.inc()
     try:
-        response = await call_next(request)
+        if rejection is not None:
+            REQUESTS_REJECTED.labels(rejection.reason).inc()
+            response = rejected_response(rejection)
+        else:
+            release = limiter.releaser()
+            try:
+                response = await call_next(request)
+            except BaseException:
+                release()
+                raise
+            body = getattr(response, "body_iterator", None)
+            if body is None:
+                release()
+            else:
+                # A streamed body, e.g. an export, keeps its slot until it
+                # was sent. Or until the response is dropped unsent:
+                response.body_iterator = release_after(body, release)  # type: ignore[attr-defined]
+                weakref.finalize(response, release)
     except Exception as exc:
         log.exception("Exception during request: %s" % type(exc))
         response = JSONResponse(status_code=500, content={"status": "error"})
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        current_timings.reset(timings_token)
+        current_route.reset(route_token)
     time_delta = time.time() - start_time
+    if profiler is not None:
+        response.headers["x-profile"] = save_profile(profiler, trace_id)
+    if settings.SERVER_TIMING:
+        timings.add("total", time_delta)
+        response.headers["server-timing"] = timings.header()
+    REQUEST_LATENCY.labels(
+        route_label(request), request.method, str(response.status_code)
+    ).observe(time_delta)
     response.headers["x-trace-id"] = trace_id
-    log.info(
-        str(request.url.path),
-        action="request",
-        method=request.method,
-        path=request.url.path,
-        query=request.url.query,
-        agent=request.headers.get("user-agent"),
-        referer=request.headers.get("referer"),
-        code=response.status_code,
-        took=time_delta,
-    )
+    if log_request(response.status_code, time_delta, request.url.path, rejection is not None):
+        log.info(
+            str(request.url.path),
+            action="request",
+            method=request.method,
+            path=request.url.path,
+            query=request.url.query,
+            agent=request.headers.get("user-agent"),
+            referer=request.headers.get("referer"),
+            code=response.status_code,
+            took=time_delta,
+        )
     clear_contextvars()
     return response
 
 
-#async def api_error_handler(request: Request, exc: ApiError) -> Response:
-#    log.error(f"Search error {exc.status_code}: {exc.message}")
-#    return JSONResponse(status_code=exc.status_code, content={"detail": exc.message})
+async def api_error_handler(request: Request, exc: ApiError) -> Response:
+    log.error(f"Search error {exc.status_code}: {exc.message}")
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.message})
 
 
-#async def transport_error_handler(request: Request, exc: TransportError) -> Response:
-#    log.error(f"Transport: {exc.message}")
-#    return JSONResponse(status_code=500, content={"detail": exc.message})
+async def transport_error_handler(request: Request, exc: TransportError) -> Response:
+    log.error(f"Transport: {exc.message}")
+    return JSONResponse(status_code=500, content={"detail": exc.message})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    app.state.store = Store.from_settings([CommandMetrics(), PoolMetrics()])
+    app.state.meili = MeiliClient.from_settings()
+    if settings.SEARCH_CACHE_URL:
+        search_cache.backend = RedisBackend(
+            settings.SEARCH_CACHE_URL, settings.SEARCH_CACHE_TTL + settings.SEARCH_CACHE_STALE
+        )
+    if settings.RATE_LIMIT_URL:
+        limiter.backend = RedisLimitBackend(settings.RATE_LIMIT_URL)
+    app.state.warmup = WarmUp(app)
+    app.state.warmup.start()
+    try:
+        yield
+    finally:
+        await app.state.warmup.stop()
+        await search_cache.backend.close()
+        await limiter.backend.close()
+        await app.state.meili.close()
+        app.state.store.close()
 
 
 def create_app() -> FastAPI:
+    """Build the app. Nothing is created at import time, servers load it
+    with `create_app()` (e.g. `hypercorn "cdiapi.app:create_app()"`)."""
+    from cdiapi.routers import catalog, search, raw, system
+
     app = FastAPI(
         title=settings.TITLE,
         description=settings.DESCRIPTION,
@@ -65,14 +174,18 @@ def create_app() -> FastAPI:
         contact=settings.CONTACT,
         openapi_tags=settings.TAGS,
         redoc_url="/",
+        lifespan=lifespan,
     )
+    # Added first, so that it runs inside the request middleware and sees
+    # the responses of the endpoints as they are sent:
+    app.add_middleware(CompressionMiddleware)
     app.middleware("http")(request_middleware)
     app.include_router(catalog.router)
     app.include_router(raw.router)
     app.include_router(search.router)
+    app.include_router(system.router)
 
-#    app.add_exception_handler(ApiError, api_error_handler)
-#    app.add_exception_handler(TransportError, transport_error_handler)
+    # Starlette types handlers as taking any exception:
+    app.add_exception_handler(ApiError, api_error_handler)  # type: ignore[arg-type]
+    app.add_exception_handler(TransportError, transport_error_handler)  # type: ignore[arg-type]
     return app
-
-app = create_app()
\ No newline at end of file
@@ -0,0 +1,357 @@
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+import orjson
+
+from cdiapi import settings
+from cdiapi.logs import get_logger
+from cdiapi.responses import CachedBody
+
+log = get_logger(__name__)
+
+# Called with the cache name, the result of lookups and their number:
+CacheListener = Callable[[str, str, int], None]
+K = TypeVar("K", bound=Hashable)
+
+
+class TTLCache:
+    """Bounded in-memory mapping, least recently used entries are evicted
+    first and every entry expires `ttl` seconds after it was set."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        entry = self.data.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.data[key]
+            return default
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.data[key] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self) -> None:
+        self.data.clear()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class ResponseCache:
+    """Serialized response bodies kept in a `TTLCache`. Concurrent misses for
+    the same key wait for a single load instead of each querying the store."""
+
+    def __init__(self, name: str, maxsize: int, ttl: float) -> None:
+        self.name = name
+        self.entries = TTLCache(maxsize, ttl)
+        self.pending: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.listeners: List[CacheListener] = []
+
+    def _count(self, result: str, count: int = 1) -> None:
+        setattr(self, result, getattr(self, result) + count)
+        for listener in self.listeners:
+            listener(self.name, result, count)
+
+    async def get_or_load(
+        self, key: Hashable, loader: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Optional[Any]:
+        """Return the cached value for `key`, or run `loader` to produce it.
+        A `None` result (e.g. object not found) is passed on but not cached."""
+        value = self.entries.get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+        pending = self.pending.get(key)
+        if pending is not None:
+            self._count("coalesced")
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                return await self.get_or_load(key, loader)
+        self._count("misses")
+        future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            value = await loader()
+        except Exception as exc:
+            future.set_exception(exc)
+            # Mark the exception as retrieved in case nobody was waiting:
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self.pending.pop(key, None)
+        if value is not None:
+            self.entries.set(key, value)
+        future.set_result(value)
+        return value
+
+    async def get_or_load_many(
+        self,
+        keys: List[K],
+        loader: Callable[[List[K]], Awaitable[Dict[K, Any]]],
+    ) -> Dict[K, Any]:
+        """Cached values for `keys`, with all the misses fetched by a single
+        `loader` call. Keys the loader doesn't return are left out."""
+        found: Dict[K, Any] = {}
+        missing: List[K] = []
+        for key in keys:
+            value = self.entries.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        self._count("hits", len(found))
+        self._count("misses", len(missing))
+        if missing:
+            for key, value in (await loader(missing)).items():
+                self.entries.set(key, value)
+                found[key] = value
+        return found
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+class MemoryBackend:
+    """Search cache entries kept by the worker process."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.entries = TTLCache(maxsize, ttl)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value: Optional[bytes] = self.entries.get(key)
+        return value
+
+    async def set(self, key: str, value: bytes) -> None:
+        self.entries.set(key, value)
+
+    async def clear(self) -> None:
+        self.entries.clear()
+
+    def size(self) -> Optional[int]:
+        return len(self.entries)
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisBackend:
+    """Search cache entries shared by all workers through Redis. Entries of
+    an outdated index epoch are left to expire."""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "cdiapi:search:") -> None:
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise RuntimeError("A shared search cache needs redis: pip install redis")
+        self.redis = redis.from_url(url)
+        self.ttl = max(1, int(ttl))
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value: Optional[bytes] = await self.redis.get(self.prefix + key)
+        return value
+
+    async def set(self, key: str, value: bytes) -> None:
+        await self.redis.set(self.prefix + key, value, ex=self.ttl)
+
+    async def clear(self) -> None:
+        pass
+
+    def size(self) -> Optional[int]:
+        return None
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+class SearchCache:
+    """Encoded search responses keyed by the canonical search parameters and
+    the epoch of the index. Entries are fresh for `ttl` seconds and are then
+    served for up to `stale` more seconds while a single background search
+    refreshes them. Concurrent misses wait for a single search."""
+
+    def __init__(self, name: str, maxsize: int, ttl: float, stale: float) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.stale = stale
+        self.backend: Any = MemoryBackend(maxsize, ttl + stale)
+        self.epoch = ""
+        self.epoch_checked = 0.0
+        self.epoch_lock = asyncio.Lock()
+        self.pending: Dict[str, "asyncio.Future[CachedBody]"] = {}
+        # Background refreshes by key, stale hits of a key start only one:
+        self.refreshing: Dict[str, "asyncio.Task[Any]"] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+        self.listeners: List[CacheListener] = []
+
+    def _count(self, result: str, count: int = 1) -> None:
+        attr = "stale_hits" if result == "stale" else result
+        setattr(self, attr, getattr(self, attr) + count)
+        for listener in self.listeners:
+            listener(self.name, result, count)
+
+    def key(self, params: Dict[str, Any]) -> str:
+        raw = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+        return "%s:%s" % (self.epoch, hashlib.blake2b(raw, digest_size=16).hexdigest())
+
+    async def refresh_epoch(self, fetch: Callable[[], Awaitable[str]]) -> None:
+        """Re-read the index epoch, e.g. the last index swapped in, at most
+        every `SEARCH_CACHE_EPOCH_REFRESH` seconds. A new epoch empties the
+        cache."""
+        if time.monotonic() - self.epoch_checked < settings.SEARCH_CACHE_EPOCH_REFRESH:
+            return
+        async with self.epoch_lock:
+            if time.monotonic() - self.epoch_checked < settings.SEARCH_CACHE_EPOCH_REFRESH:
+                return
+            try:
+                epoch = await fetch()
+            except Exception as exc:
+                log.warning("Cannot read the search index epoch: %s" % exc, action="searchcache")
+                epoch = self.epoch
+            self.epoch_checked = time.monotonic()
+            if epoch != self.epoch:
+                log.info("Search index epoch %s" % epoch, action="searchcache")
+                self.epoch = epoch
+                await self.backend.clear()
+
+    async def _get(self, key: str) -> Optional[Tuple[float, CachedBody]]:
+        try:
+            raw = await self.backend.get(key)
+        except Exception as exc:
+            log.warning("Search cache unavailable: %s" % exc, action="searchcache")
+            return None
+        if raw is None:
+            return None
+        head, _, data = raw.partition(b"\n")
+        meta = orjson.loads(head)
+        # The body is followed by its compressed variants:
+        sizes = meta.get("variants", {})
+        end = len(data) - sum(sizes.values())
+        body, variants = data[:end], {}
+        for encoding, size in sizes.items():
+            variants[encoding] = data[end : end + size]
+            end += size
+        return meta["fresh"], CachedBody(body, etag=meta["etag"], variants=variants)
+
+    async def _set(self, key: str, value: CachedBody) -> None:
+        sizes = {encoding: len(variant) for encoding, variant in value.variants.items()}
+        meta = {"fresh": time.time() + self.ttl, "etag": value.etag, "variants": sizes}
+        data = b"".join([orjson.dumps(meta), b"\n", value.body, *value.variants.values()])
+        try:
+            await self.backend.set(key, data)
+        except Exception as exc:
+            log.warning("Search cache unavailable: %s" % exc, action="searchcache")
+
+    async def get_or_load(
+        self, params: Dict[str, Any], loader: Callable[[], Awaitable[CachedBody]]
+    ) -> CachedBody:
+        """Return the cached response for `params`, or run `loader` to
+        produce it."""
+        if self.ttl <= 0:
+            return await loader()
+        key = self.key(params)
+        entry = await self._get(key)
+        if entry is None:
+            return await self._load(key, loader)
+        fresh, value = entry
+        if time.time() < fresh:
+            self._count("hits")
+        else:
+            self._count("stale")
+            if key not in self.pending and key not in self.refreshing:
+                task = asyncio.ensure_future(self._refresh(key, loader))
+                self.refreshing[key] = task
+                task.add_done_callback(lambda _: self.refreshing.pop(key, None))
+        return value
+
+    async def _refresh(self, key: str, loader: Callable[[], Awaitable[CachedBody]]) -> None:
+        try:
+            await self._load(key, loader, count=False)
+        except Exception as exc:
+            log.warning("Cannot refresh a cached search: %s" % exc, action="searchcache")
+
+    async def _load(
+        self, key: str, loader: Callable[[], Awaitable[CachedBody]], count: bool = True
+    ) -> CachedBody:
+        pending = self.pending.get(key)
+        if pending is not None:
+            self._count("coalesced")
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                return await self._load(key, loader)
+        if count:
+            self._count("misses")
+        future: "asyncio.Future[CachedBody]" = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            value = await loader()
+        except Exception as exc:
+            future.set_exception(exc)
+            # Mark the exception as retrieved in case nobody was waiting:
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self.pending.pop(key, None)
+        await self._set(key, value)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        return {
+            "size": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "stale": self.stale_hits,
+        }
+
+
+catalog_cache = ResponseCache(
+    "catalogs", settings.CATALOG_CACHE_SIZE, settings.CATALOG_CACHE_TTL
+)
+entry_cache = ResponseCache("entries", settings.ENTRY_CACHE_SIZE, settings.ENTRY_CACHE_TTL)
+search_cache = SearchCache(
+    "searches",
+    settings.SEARCH_CACHE_SIZE,
+    settings.SEARCH_CACHE_TTL,
+    settings.SEARCH_CACHE_STALE,
+)
+RESPONSE_CACHES: List[Any] = [catalog_cache, entry_cache, search_cache]
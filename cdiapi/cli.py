@@ -1,33 +1,52 @@
 import click
 import asyncio
-from typing import Any
+from typing import Any, List
 from uvicorn import Config, Server
 
 from cdiapi import settings
-from cdiapi.app import create_app
 from cdiapi.logs import configure_logging, get_logger
 
 
 log = get_logger("cdiapi")
 
 
-async def update_registry()  -> None:
-    pass
-
-
 @click.group(help="Common Data Index API server")
 def cli() -> None:
     pass
 
 
 @cli.command("serve", help="Run uvicorn and serve requests")
-def serve() -> None:
+@click.option("--host", default="0.0.0.0", show_default=True)
+@click.option("--port", type=int, default=settings.PORT, show_default=True)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=settings.WORKERS,
+    show_default=True,
+    help="Worker processes, 0 for one per CPU. More than one runs the "
+    "production server without reload",
+)
+def serve(host: str, port: int, workers: int) -> None:
+    configure_logging()
+    if workers != 1:
+        from cdiapi.workers import MetricsDirError, run_server
+
+        try:
+            run_server(host, port, workers)
+        except MetricsDirError as exc:
+            raise click.ClickException(exc.message)
+        return
+    from cdiapi.app import create_app
+    from cdiapi.warmup import prepare
+
     app = create_app()
+    prepare(app)
     server = Server(
         Config(
             app,
-            host="0.0.0.0",
-            port=settings.PORT,
+            host=host,
+            port=port,
             proxy_headers=True,
             reload=settings.DEBUG,
             # reload_dirs=[code_dir],
@@ -36,32 +55,108 @@ def serve() -> None:
             server_header=False,
         ),
     )
-    configure_logging()
     server.run()
 
 
 @cli.command("registry-update", help="Re-index the data if newer data is available")
 @click.option("-f", "--force", is_flag=True, default=False)
-def registry_update(force: bool) -> None:
+@click.option(
+    "-r",
+    "--rebuild",
+    is_flag=True,
+    default=False,
+    help="Load into a new generation and swap it in once complete",
+)
+def registry_update(force: bool, rebuild: bool) -> None:
+    # The loaders and index tools are imported by the commands using them,
+    # which keeps them out of `serve`:
+    from cdiapi.loader import ManifestError, update_registry
+
     configure_logging()
-    asyncio.run(update_registry(force=force))
+    try:
+        asyncio.run(update_registry(force=force, rebuild=rebuild))
+    except ManifestError as exc:
+        raise click.ClickException(exc.message)
+
 
+@cli.command("registry-clear", help="Delete everything in Registry")
+def registry_clear() -> None:
+    from cdiapi.loader import clear_registry
+
+    configure_logging()
+    asyncio.run(clear_registry())
+
+
+@cli.command("search-sync", help="Push the search index entries from MongoDB to Meilisearch")
+@click.option("--full", is_flag=True, default=False, help="Reload the whole index")
+@click.option("--follow", is_flag=True, default=False, help="Keep pushing changes")
+@click.option(
+    "--mode",
+    type=click.Choice(["auto", "changes", "poll"]),
+    default="auto",
+    show_default=True,
+    help="Find changes with change streams (needs a replica set) or by store timestamp",
+)
+def search_sync(full: bool, follow: bool, mode: str) -> None:
+    configure_logging()
+    # Imported here, the Meilisearch client loads the metrics which must not
+    # be set up before `serve` configured them:
+    from cdiapi.meili import ApiError, TaskError, TransportError
+    from cdiapi.sync import sync_search
 
-async def _clear_registry() -> None:
+    try:
+        asyncio.run(sync_search(full=full, follow=follow, mode=mode))
+    except (ApiError, TaskError, TransportError) as exc:
+        raise click.ClickException(exc.message)
+
+
+@cli.group("indexes", help="Manage the MongoDB indexes")
+def indexes() -> None:
     pass
-#    es = await get_es()
-#    indices: Any = await es.cat.indices(format="json")
-#    for index in indices:
-#        index_name: str = index.get("index")
-#        log.info("Delete index", index=index_name)
-#        await es.indices.delete(index=index_name)
-#    await es.close()
 
 
-@cli.command("registry-clear", help="Delete everything in Registry")
-def registry_clear() -> None:
+async def _sync_indexes(drop: bool) -> None:
+    from cdiapi.db import create_client
+    from cdiapi.indexes import sync_all
+
+    client = create_client(read_preference="primary")
+    try:
+        await sync_all(client, drop=drop)
+    finally:
+        client.close()
+
+
+@indexes.command("sync", help="Create the indexes missing from the spec")
+@click.option("--drop", is_flag=True, default=False, help="Also drop indexes not in the spec")
+def indexes_sync(drop: bool) -> None:
+    configure_logging()
+    asyncio.run(_sync_indexes(drop))
+
+
+async def _check_indexes(db_name: str) -> List[str]:
+    from cdiapi.db import create_client
+    from cdiapi.indexes import check_indexes
+
+    client = create_client(read_preference="primary")
+    try:
+        return await check_indexes(client, db_name)
+    finally:
+        client.close()
+
+
+@indexes.command(
+    "check",
+    help="Explain every search filter combination against the index spec, "
+    "fail if any of them scans a whole collection",
+)
+@click.option("--db", "db_name", default="cdiapi_indexcheck", help="Scratch database, dropped afterwards")
+def indexes_check(db_name: str) -> None:
     configure_logging()
-    asyncio.run(_clear_registry())
+    failures = asyncio.run(_check_indexes(db_name))
+    for failure in failures:
+        log.error("COLLSCAN: %s" % failure, action="indexes")
+    if failures:
+        raise click.ClickException("%d queries fall back to a COLLSCAN" % len(failures))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+import zlib
+from typing import Any, Dict, List, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from cdiapi import settings
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+AVAILABLE = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+# Encodings offered to clients, in order of preference:
+ENCODINGS: List[str] = [
+    name.strip()
+    for name in settings.COMPRESSION_ENCODINGS.split(",")
+    if AVAILABLE.get(name.strip())
+]
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The preferred encoding among those the client accepts, `None` if it
+    accepts none of them."""
+    if not accept_encoding or not ENCODINGS:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for name in ENCODINGS:
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = name, weight
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    compressed: bytes
+    if encoding == "gzip":
+        compressed = zlib.compress(body, settings.GZIP_LEVEL, wbits=31)
+    elif encoding == "br":
+        compressed = brotli.compress(body, quality=settings.BROTLI_LEVEL)
+    elif encoding == "zstd":
+        compressed = zstandard.ZstdCompressor(level=settings.ZSTD_LEVEL).compress(body)
+    else:
+        raise ValueError("Unknown encoding: %s" % encoding)
+    return compressed
+
+
+class StreamCompressor:
+    """Compress a response chunk by chunk, every chunk is flushed so that a
+    slow stream reaches the client as it is produced."""
+
+    def __init__(self, encoding: str) -> None:
+        self.encoding = encoding
+        self.obj: Any
+        if encoding == "gzip":
+            self.obj = zlib.compressobj(settings.GZIP_LEVEL, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self.obj = brotli.Compressor(quality=settings.BROTLI_LEVEL)
+        elif encoding == "zstd":
+            self.obj = zstandard.ZstdCompressor(level=settings.ZSTD_LEVEL).compressobj()
+        else:
+            raise ValueError("Unknown encoding: %s" % encoding)
+
+    def compress(self, data: bytes) -> bytes:
+        chunk: bytes
+        if self.encoding == "gzip":
+            chunk = self.obj.compress(data) + self.obj.flush(zlib.Z_SYNC_FLUSH)
+        elif self.encoding == "br":
+            chunk = self.obj.process(data) + self.obj.flush()
+        else:
+            chunk = self.obj.compress(data) + self.obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return chunk
+
+    def finish(self) -> bytes:
+        chunk: bytes = self.obj.finish() if self.encoding == "br" else self.obj.flush()
+        return chunk
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Entity tag of the `encoding` variant of a body, e.g. `"abc-gzip"`."""
+    return '%s-%s"' % (etag[:-1], encoding)
+
+
+def identity_etag(etag: str) -> str:
+    """Reverse `encoded_etag`."""
+    for name in AVAILABLE:
+        suffix = '-%s"' % name
+        if etag.endswith(suffix):
+            return etag[: -len(suffix)] + '"'
+    return etag
+
+
+def compressible(headers: Headers) -> bool:
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES) and "content-encoding" not in headers
+
+
+class CompressionMiddleware:
+    """Compress responses that weren't sent precompressed, when the client
+    accepts one of `ENCODINGS` and the body has at least
+    `COMPRESSION_MIN_SIZE` bytes. Streaming responses are compressed as they
+    stream."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        responder = _CompressingResponder(send, encoding)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingResponder:
+    def __init__(self, send: Send, encoding: Optional[str]) -> None:
+        self._send = send
+        self.encoding = encoding
+        self.start: Optional[Message] = None
+        self.compressor: Optional[StreamCompressor] = None
+        self.passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+        if self.compressor is not None:
+            body = self.compressor.compress(message.get("body", b""))
+            if not message.get("more_body", False):
+                body += self.compressor.finish()
+            await self._send({**message, "body": body})
+            return
+
+        # First body chunk, decide how to send the response:
+        assert self.start is not None
+        headers = MutableHeaders(raw=self.start["headers"])
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if compressible(headers) and "accept-encoding" not in headers.get("vary", "").lower():
+            headers.add_vary_header("Accept-Encoding")
+        if (
+            self.encoding is None
+            or not compressible(headers)
+            or (not more_body and len(body) < settings.COMPRESSION_MIN_SIZE)
+        ):
+            self.passthrough = True
+            await self._send(self.start)
+            await self._send(message)
+            return
+        headers["Content-Encoding"] = self.encoding
+        etag = headers.get("etag")
+        if etag is not None and not etag.startswith("W/"):
+            headers["ETag"] = encoded_etag(etag, self.encoding)
+        if more_body:
+            del headers["Content-Length"]
+            self.compressor = StreamCompressor(self.encoding)
+            body = self.compressor.compress(body)
+        else:
+            body = compress(body, self.encoding)
+            headers["Content-Length"] = str(len(body))
+        await self._send(self.start)
+        await self._send({**message, "body": body})
@@ -1,10 +1,13 @@
 from datetime import datetime
+from enum import Enum
 from typing import Dict, List, Union, Optional
 from pydantic import BaseModel, Field
 
 from cdiapi import settings
 from .datacatalog import DataCatalog
-from .search import SearchIndexEntry
+from .search import SearchIndexEntry, SearchIndexEntrySummary
+from .search import SearchIndexEntryRef, SearchIndexSourceRecord
+from .projection import partial_model
 
 class ErrorResponse(BaseModel):
     detail: str = Field(..., examples=["Detailed error message"])
@@ -13,22 +16,96 @@ DataCatalogResponse = DataCatalog
 
 SearchIndexEntryResponse = SearchIndexEntry
 
+SearchIndexEntryPartial = partial_model(SearchIndexEntry)
+
+class EntryView(str, Enum):
+    full = "full"
+    summary = "summary"
+
+class SourceShape(str, Enum):
+    full = "full"
+    ref = "ref"
+
+class BatchRequest(BaseModel):
+    ids: List[str] = Field(..., max_length=settings.MAX_BATCH, examples=[["cdi00000002", "cdi00000006"]])
+
 class SearchMeta(BaseModel):
-    offset: int = Field(..., examples=['0'])
+    offset: Optional[int] = Field(None, examples=['0'])
     limit: int = Field(..., examples=['100'])
     num: int = Field(..., examples=['15'])
-    total: int = Field(..., examples=['1520'])
+    total: Optional[int] = Field(..., examples=['1520'])
+    total_relation: Optional[str] = Field(None, examples=['eq', 'gte', 'approx'])
+    next_cursor: Optional[str] = Field(None, examples=['W251bGwsIHsiJG9pZCI6ICI2NDk1YWIwNDE4MGQyMjJkMDM3YzA2NDkifV0'])
 
 class DataCatalogSearchItem(BaseModel):
     uid: str = Field(..., examples=["cdi00001616"])
     name: str = Field(..., examples=["Data.gov portal"])
     link: str = Field(..., examples=["https://catalog.data.gov"])
 
+class FacetCount(BaseModel):
+    value: str = Field(..., examples=["ckan"])
+    name: Optional[str] = Field(None, examples=["CKAN"])
+    count: int = Field(..., examples=[1520])
+
 class DataCatalogSearchResponse(BaseModel):
     meta: SearchMeta = Field(..., examples=[])
     data: List[DataCatalogSearchItem] = Field(..., examples=[])
+    facets: Optional[Dict[str, List[FacetCount]]] = Field(None, examples=[])
 
 
 class SearchIndexSearchResponse(BaseModel):
     meta: SearchMeta = Field(..., examples=[])
     data: List[SearchIndexEntry] = Field(..., examples=[])
+
+
+class DataCatalogBatchResponse(BaseModel):
+    data: List[DataCatalog] = Field(..., examples=[])
+    missing: List[str] = Field([], examples=[["cdi99999999"]])
+
+
+class SearchIndexBatchResponse(BaseModel):
+    data: List[SearchIndexEntry] = Field(..., examples=[])
+    missing: List[str] = Field([], examples=[["cdi00000002-unknown"]])
+
+
+class SearchIndexSummarySearchResponse(BaseModel):
+    meta: SearchMeta = Field(..., examples=[])
+    data: List[SearchIndexEntrySummary] = Field(..., examples=[])
+
+
+class SearchIndexPartialSearchResponse(BaseModel):
+    meta: SearchMeta = Field(..., examples=[])
+    data: List[SearchIndexEntryPartial] = Field(..., examples=[])  # type: ignore
+
+
+class SearchIndexRefSearchResponse(BaseModel):
+    meta: SearchMeta = Field(..., examples=[])
+    data: List[SearchIndexEntryRef] = Field(..., examples=[])
+    sources: Dict[str, SearchIndexSourceRecord] = Field(..., examples=[])
+
+
+class SearchIndexSummaryRefSearchResponse(BaseModel):
+    meta: SearchMeta = Field(..., examples=[])
+    data: List[SearchIndexEntrySummary] = Field(..., examples=[])
+    sources: Dict[str, SearchIndexSourceRecord] = Field(..., examples=[])
+
+
+class SearchIndexPartialRefSearchResponse(BaseModel):
+    meta: SearchMeta = Field(..., examples=[])
+    data: List[SearchIndexEntryPartial] = Field(..., examples=[])  # type: ignore
+    sources: Dict[str, SearchIndexSourceRecord] = Field(..., examples=[])
+
+
+class CacheStats(BaseModel):
+    size: Optional[int] = Field(..., examples=['1520'])
+    hits: int = Field(..., examples=['10412'])
+    misses: int = Field(..., examples=['1733'])
+    coalesced: int = Field(..., examples=['12'])
+    stale: int = Field(0, examples=['40'])
+
+CacheStatsResponse = Dict[str, CacheStats]
+
+
+class ReadinessResponse(BaseModel):
+    status: str = Field(..., examples=["ready", "starting"])
+    checks: Dict[str, str] = Field(..., examples=[{"schema": "ok", "mongodb": "pending"}])
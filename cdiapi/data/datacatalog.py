@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Dict, List, Union, Optional
+from typing import Any, Dict, List, Union, Optional
 from pydantic import BaseModel, Field
 
 from .shared import SpokenLanguage, Location, Topic, Endpoint, Identifier, Organization, Software
@@ -10,7 +10,7 @@ class DataCatalog(BaseModel):
     name: str = Field(..., examples=["Data.gov portal"])
     link: str = Field(..., examples=["https://catalog.data.gov"])
     catalog_type: str = Field(..., examples=["Open data portal"])
-    properties: Optional[Dict] = Field(None, examples=[{"transferable_topics" : True}])
+    properties: Optional[Dict[str, Any]] = Field(None, examples=[{"transferable_topics" : True}])
     api: bool = Field(False)
     api_status: str = Field(..., examples=["uncertain"])
     access_mode: List[str] = Field([], examples=[["dataset"]])
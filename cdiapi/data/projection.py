@@ -0,0 +1,83 @@
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type, Union
+from typing import get_args, get_origin
+from pydantic import BaseModel, create_model
+
+# Documents written by the loader carry the time they last changed:
+STORE_TIMESTAMP = "updated_at"
+
+
+def _nested_model(annotation: Any) -> Optional[Type[BaseModel]]:
+    """Model class wrapped in `annotation`, looking through Optional and List."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in get_args(annotation):
+        model = _nested_model(arg)
+        if model is not None:
+            return model
+    return None
+
+
+@lru_cache(maxsize=None)
+def model_paths(model: Type[BaseModel], prefix: str = "") -> Tuple[str, ...]:
+    """Dotted paths of all the leaf fields of `model`."""
+    paths: List[str] = []
+    for name, field in model.model_fields.items():
+        nested = _nested_model(field.annotation)
+        if nested is None:
+            paths.append(prefix + name)
+        else:
+            paths.extend(model_paths(nested, prefix + name + "."))
+    return tuple(paths)
+
+
+def model_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """MongoDB projection returning only the fields defined on `model`."""
+    return {path: 1 for path in model_paths(model)}
+
+
+def store_projection(projection: Dict[str, int]) -> Dict[str, int]:
+    """Extend `projection` with the store timestamp used for Last-Modified."""
+    return {**projection, STORE_TIMESTAMP: 1}
+
+
+def field_projection(model: Type[BaseModel], fields: Iterable[str]) -> Dict[str, int]:
+    """MongoDB projection for a list of (comma separated) dotted field names,
+    which must be fields or sub-objects of `model`."""
+    paths = model_paths(model)
+    selected = set()
+    for field in fields:
+        for name in field.split(","):
+            name = name.strip()
+            if not name:
+                continue
+            if not any(p == name or p.startswith(name + ".") for p in paths):
+                raise ValueError("Unknown field: %s" % name)
+            selected.add(name)
+    return {
+        path: 1
+        for path in selected
+        if not any(path.startswith(other + ".") for other in selected)
+    }
+
+
+def _partial_annotation(annotation: Any) -> Any:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return partial_model(annotation)
+    args = get_args(annotation)
+    origin = get_origin(annotation)
+    if origin is Union:
+        return Union[tuple(_partial_annotation(arg) for arg in args)]
+    if origin is list and args:
+        return List[_partial_annotation(args[0])]  # type: ignore
+    return annotation
+
+
+@lru_cache(maxsize=None)
+def partial_model(model: Type[BaseModel]) -> Type[BaseModel]:
+    """Variant of `model` in which every field, nested ones included, may be
+    missing. Dump it with `exclude_unset` to echo back only projected fields."""
+    fields: Dict[str, Any] = {}
+    for name, field in model.model_fields.items():
+        fields[name] = (Optional[_partial_annotation(field.annotation)], None)
+    return create_model(model.__name__ + "Partial", **fields)
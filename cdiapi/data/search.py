@@ -29,7 +29,7 @@ class SearchIndexParty(BaseModel):
 
 class SearchIndexDatasetRecord(BaseModel):
     id: Union[str,int] = Field(..., examples=[""])
-    title: str = Field(None, examples=["Name of the dataset"])
+    title: Optional[str] = Field(None, examples=["Name of the dataset"])
     num_resources: int = Field(..., examples=["1"])
     url: str = Field(..., examples=["https://data.bayanat.ae/dataset/open-field-exposed-vegetable-crops"])
     short_text: Optional[str] = Field(None, examples=["Short plain text, extracted from description"])
@@ -39,7 +39,7 @@ class SearchIndexDatasetRecord(BaseModel):
     formats: Optional[List[str]] = Field([], examples=['XLSX', "CSV"])
     datatypes: Optional[List[str]] = Field([], examples=['data', "geodata"])
     topics_original: Optional[List[str]] = Field(None, examples=['Farm', "Crops"])
-    responsible: List[SearchIndexParty] = Field(None, examples=[])
+    responsible: Optional[List[SearchIndexParty]] = Field(None, examples=[])
     license_id: Optional[str] = Field(None, examples=["cc-by"])
     license_name: Optional[str] = Field(None, examples=["Creative Commons Attribution"])
     license_url: Optional[str] = Field(None, examples=[])
@@ -47,7 +47,7 @@ class SearchIndexDatasetRecord(BaseModel):
 #    year_range: Optional[YearRange] = Field(..., examples=[])
 
 class SearchIndexResourceRecord(BaseModel):
-    id: Union[str, int] = Field(None, examples=["f7ddcec7-5f5a-4458-8b10-ec8fd2d4a93b"])
+    id: Union[str, int, None] = Field(None, examples=["f7ddcec7-5f5a-4458-8b10-ec8fd2d4a93b"])
     name: Optional[str] = Field(None, examples=["Data.gov portal"])
     datasize: Union[str, int, None] = Field(None, examples=["100000"])
     format: Optional[str] = Field(None, examples=["XLSX"])
@@ -63,6 +63,28 @@ class SearchIndexEntry(BaseModel):
     dataset: SearchIndexDatasetRecord = Field(..., examples=[])
     resources: List[SearchIndexResourceRecord] = Field(..., examples=[])
 
+
+class SearchIndexSourceRef(BaseModel):
+    uid: str = Field(..., examples=["cdi00001616"])
+
+class SearchIndexEntryRef(BaseModel):
+    """Entry whose source catalog is listed once in the `sources` of the response"""
+    id: str = Field(..., examples=["cdi00000002-c4a88574-7a2a-4048-bc9f-07de0559e7b7"])
+    int_id: Optional[str] = Field(..., examples=["c4a88574-7a2a-4048-bc9f-07de0559e7b7"])
+    source: SearchIndexSourceRef = Field(..., examples=[])
+    dataset: SearchIndexDatasetRecord = Field(..., examples=[])
+    resources: List[SearchIndexResourceRecord] = Field(..., examples=[])
+
+class SearchIndexDatasetSummary(BaseModel):
+    title: Optional[str] = Field(None, examples=["Name of the dataset"])
+    url: str = Field(..., examples=["https://data.bayanat.ae/dataset/open-field-exposed-vegetable-crops"])
+
+class SearchIndexEntrySummary(BaseModel):
+    """Compact entry for list views: identifier, title, link and source catalog"""
+    id: str = Field(..., examples=["cdi00000002-c4a88574-7a2a-4048-bc9f-07de0559e7b7"])
+    source: SearchIndexSourceRef = Field(..., examples=[])
+    dataset: SearchIndexDatasetSummary = Field(..., examples=[])
+
 EXAMPLE_SEARCH_ENTRY = """{
   "_id": {
     "$oid": "6495ab04180d222d037c0649"
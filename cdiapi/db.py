@@ -0,0 +1,55 @@
+from typing import Any, List, Optional
+from fastapi import Request
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from cdiapi import settings
+from cdiapi.cache import catalog_cache, entry_cache
+from cdiapi.generations import GenerationPointer
+from cdiapi.sources import source_registry
+
+
+def _catalogs_swapped() -> None:
+    catalog_cache.clear()
+    source_registry.expire()
+
+
+def create_client(
+    read_preference: Optional[str] = None, event_listeners: Optional[List[Any]] = None
+) -> "AsyncIOMotorClient[Any]":
+    """MongoDB client configured from the settings. Pass `read_preference`
+    to override `CDIAPI_MONGO_READ_PREFERENCE`, e.g. "primary" for loaders."""
+    return AsyncIOMotorClient(
+        settings.MONGO_URI,
+        maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+        minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=int(settings.MONGO_SERVER_SELECTION_TIMEOUT * 1000),
+        connectTimeoutMS=int(settings.MONGO_CONNECT_TIMEOUT * 1000),
+        socketTimeoutMS=int(settings.MONGO_SOCKET_TIMEOUT * 1000),
+        readPreference=read_preference or settings.MONGO_READ_PREFERENCE,
+        appname="cdiapi",
+        event_listeners=event_listeners or [],
+    )
+
+
+class Store:
+    """The MongoDB client shared by all requests of a worker, together with
+    the collections the routers read from."""
+
+    def __init__(self, client: "AsyncIOMotorClient[Any]") -> None:
+        self.client = client
+        self.registry = client[settings.REGISTRY_DB]
+        self.search = client[settings.SEARCH_DB]
+        self.catalogs = GenerationPointer(self.registry, "catalogs", on_swap=_catalogs_swapped)
+        self.entries = GenerationPointer(self.search, "fulldb", on_swap=entry_cache.clear)
+
+    @classmethod
+    def from_settings(cls, event_listeners: Optional[List[Any]] = None) -> "Store":
+        return cls(create_client(event_listeners=event_listeners))
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def get_store(request: Request) -> Store:
+    store: Store = request.app.state.store
+    return store
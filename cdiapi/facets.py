@@ -0,0 +1,123 @@
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+
+from cdiapi import settings
+from cdiapi.logs import get_logger
+from cdiapi.generations import list_generations
+
+log = get_logger(__name__)
+
+# Facet counts of whole catalog generations, one document per generation:
+CATALOG_SUMMARY = "catalog_facets"
+
+
+class Facet(NamedTuple):
+    # Field holding the value, or the list of values, of each catalog:
+    field: str
+    # Counted value and display name below `field`, for object values:
+    key: Optional[str] = None
+    name: Optional[str] = None
+    many: bool = False
+
+
+# Facets of the registry search, named after the filter parameter that
+# selects their values:
+CATALOG_FACETS: Dict[str, Facet] = {
+    "software": Facet("software", "id", "name"),
+    "owner_type": Facet("owner.type"),
+    "catalog_type": Facet("catalog_type"),
+    "owner_country": Facet("owner.location.country", "id", "name"),
+    "coverage_country": Facet("coverage.location.country", "id", "name", many=True),
+}
+
+
+def check_facets(names: List[str]) -> List[str]:
+    unknown = [n for n in names if n not in CATALOG_FACETS]
+    if unknown:
+        raise HTTPException(400, detail="Unknown facets: %s" % ", ".join(unknown))
+    return list(dict.fromkeys(names))
+
+
+def _facet_stages(facet: Facet, limit: Optional[int]) -> List[Dict[str, Any]]:
+    """Count the catalogs per value of `facet`, most frequent first."""
+    if facet.many:
+        # A catalog covering a country twice is counted once:
+        values = {"$setUnion": [{"$ifNull": ["$" + facet.field, []]}, []]}
+        stages: List[Dict[str, Any]] = [{"$project": {"v": values}}, {"$unwind": "$v"}]
+        field = "$v"
+    else:
+        stages = []
+        field = "$" + facet.field
+    group: Dict[str, Any] = {
+        "_id": "%s.%s" % (field, facet.key) if facet.key else field,
+        "count": {"$sum": 1},
+    }
+    if facet.name:
+        group["name"] = {"$first": "%s.%s" % (field, facet.name)}
+    stages += [
+        {"$group": group},
+        {"$match": {"_id": {"$ne": None}}},
+        {"$sort": {"count": -1, "_id": 1}},
+    ]
+    if limit is not None:
+        stages.append({"$limit": limit})
+    return stages
+
+
+def facet_pipeline(
+    query: Dict[str, Any], names: List[str], limit: Optional[int]
+) -> List[Dict[str, Any]]:
+    """All requested facets in a single `$facet` aggregation."""
+    facets = {name: _facet_stages(CATALOG_FACETS[name], limit) for name in names}
+    return [{"$match": query}, {"$facet": facets}]
+
+
+def _values(buckets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{"value": b["_id"], "name": b.get("name"), "count": b["count"]} for b in buckets]
+
+
+async def count_facets(
+    collection: "AsyncIOMotorCollection[Any]",
+    query: Dict[str, Any],
+    names: List[str],
+    limit: Optional[int] = settings.FACET_SIZE,
+) -> Dict[str, List[Dict[str, Any]]]:
+    if not names:
+        return {}
+    pipeline = facet_pipeline(query, names, limit)
+    results = await collection.aggregate(pipeline).to_list(1)
+    result = results[0] if results else {}
+    return {name: _values(result.get(name, [])) for name in names}
+
+
+async def catalog_facets(
+    collection: "AsyncIOMotorCollection[Any]", query: Dict[str, Any], names: List[str]
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Facet counts of the catalogs matching `query`. Counts over all catalogs
+    are read from the summary `refresh_summary` stored for the generation."""
+    if not names:
+        return {}
+    if not query:
+        summary = await collection.database[CATALOG_SUMMARY].find_one({"_id": collection.name})
+        if summary is not None:
+            facets = summary.get("facets", {})
+            if all(name in facets for name in names):
+                return {name: facets[name][: settings.FACET_SIZE] for name in names}
+        log.warning("No facet summary for %s" % collection.name, action="facets")
+    return await count_facets(collection, query, names)
+
+
+async def refresh_summary(db: "AsyncIOMotorDatabase[Any]", collection: str) -> None:
+    """Store the counts of every facet over all catalogs in `collection`, a
+    generation of the catalogs, and remove those of dropped generations."""
+    facets = await count_facets(db[collection], {}, list(CATALOG_FACETS), limit=None)
+    await db[CATALOG_SUMMARY].replace_one(
+        {"_id": collection},
+        {"_id": collection, "facets": facets, "updated_at": datetime.utcnow()},
+        upsert=True,
+    )
+    generations = await list_generations(db, "catalogs")
+    await db[CATALOG_SUMMARY].delete_many({"_id": {"$nin": generations + [collection]}})
+    log.info("Refreshed facet summary of %s" % collection, action="facets")
@@ -0,0 +1,143 @@
+import re
+import time
+from datetime import datetime
+from typing import Any, Callable, List, Optional
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+
+from cdiapi import settings
+from cdiapi.logs import get_logger
+
+log = get_logger(__name__)
+
+# Collection holding, per logical collection, the name of the generation that
+# is currently served:
+GENERATIONS = "generations"
+
+
+class GenerationPointer:
+    """Resolve a logical collection name (e.g. `fulldb`) to the generation
+    that is live right now. The pointer is re-read every few seconds, so a
+    rebuild is picked up by all workers without a restart."""
+
+    def __init__(
+        self,
+        db: "AsyncIOMotorDatabase[Any]",
+        name: str,
+        on_swap: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.db = db
+        self.name = name
+        self.on_swap = on_swap
+        self.current = name
+        self.expires = 0.0
+
+    async def collection(self) -> "AsyncIOMotorCollection[Any]":
+        now = time.monotonic()
+        if now >= self.expires:
+            self.expires = now + settings.GENERATION_REFRESH
+            target = await live_generation(self.db, self.name)
+            if target != self.current:
+                log.info("Serving %s from %s" % (self.name, target), action="swap")
+                self.current = target
+                if self.on_swap is not None:
+                    self.on_swap()
+        return self.db[self.current]
+
+
+async def live_generation(db: "AsyncIOMotorDatabase[Any]", name: str) -> str:
+    """Collection currently served for `name`, the plain name before the
+    first rebuild."""
+    pointer = await db[GENERATIONS].find_one({"_id": name})
+    return pointer["collection"] if pointer else name
+
+
+def new_generation(name: str) -> str:
+    return "%s_%s" % (name, datetime.utcnow().strftime("%Y%m%d%H%M%S"))
+
+
+async def check_generation(
+    db: "AsyncIOMotorDatabase[Any]", name: str, shadow: str, invalid: int
+) -> bool:
+    """Sanity check a loaded generation before it goes live: it must hold
+    data, few invalid records and not shrink a lot against the live one."""
+    count = await db[shadow].estimated_document_count()
+    live = await db[await live_generation(db, name)].estimated_document_count()
+    if count == 0:
+        log.error("Generation %s is empty" % shadow, action="swap")
+        return False
+    if invalid > count * settings.GENERATION_MAX_INVALID:
+        log.error("Generation %s has %d invalid records" % (shadow, invalid), action="swap")
+        return False
+    if count < live * settings.GENERATION_MIN_RATIO:
+        log.error(
+            "Generation %s has %d records, live has %d" % (shadow, count, live),
+            action="swap",
+        )
+        return False
+    return True
+
+
+async def swap_generation(db: "AsyncIOMotorDatabase[Any]", name: str, shadow: str) -> None:
+    """Point `name` at `shadow` with a single atomic update and drop all but
+    the most recent generations."""
+    previous = await live_generation(db, name)
+    await db[GENERATIONS].update_one(
+        {"_id": name},
+        {
+            "$set": {"collection": shadow, "swapped_at": datetime.utcnow()},
+            "$push": {"history": {"$each": [previous], "$slice": -settings.GENERATIONS_KEEP}},
+        },
+        upsert=True,
+    )
+    log.info("Swapped %s from %s to %s" % (name, previous, shadow), action="swap")
+    await drop_old_generations(db, name, shadow)
+
+
+async def list_generations(db: "AsyncIOMotorDatabase[Any]", name: str) -> List[str]:
+    pattern = re.compile(r"^%s(_\d{14})?$" % re.escape(name))
+    names = await db.list_collection_names()
+    return sorted(n for n in names if pattern.match(n))
+
+
+async def drop_old_generations(db: "AsyncIOMotorDatabase[Any]", name: str, live: str) -> None:
+    """Drop generations of `name` except the live one and the ones before it
+    that are kept for a rollback (workers may still read the previous one
+    until they refresh their pointer)."""
+    keep = settings.GENERATIONS_KEEP
+    older = [n for n in await list_generations(db, name) if n != live]
+    pointer = await db[GENERATIONS].find_one({"_id": name}) or {}
+    recent = pointer.get("history", [])[-(keep - 1):] if keep > 1 else []
+    for generation in older:
+        if generation not in recent:
+            log.info("Dropping generation %s" % generation, action="swap")
+            await db.drop_collection(generation)
+
+
+def _index_pointer(index: str) -> str:
+    return "meili:%s" % index
+
+
+async def set_live_index(db: "AsyncIOMotorDatabase[Any]", index: str, shadow: str) -> None:
+    """Record that the Meilisearch index `index` now holds the documents
+    loaded into `shadow`."""
+    await db[GENERATIONS].update_one(
+        {"_id": _index_pointer(index)},
+        {"$set": {"index": shadow, "swapped_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+async def live_index(db: "AsyncIOMotorDatabase[Any]", index: str) -> str:
+    """Name of the index last swapped into `index`, empty before the first
+    full search sync. Unlike the update time of the index, it doesn't change
+    with each batch of changed documents."""
+    pointer = await db[GENERATIONS].find_one({"_id": _index_pointer(index)})
+    return str(pointer["index"]) if pointer else ""
+
+
+async def clear_generations(db: "AsyncIOMotorDatabase[Any]", name: str) -> None:
+    """Drop every generation of `name` together with its pointer."""
+    for generation in await list_generations(db, name):
+        log.info("Dropping generation %s" % generation, action="clear")
+        await db.drop_collection(generation)
+    await db[GENERATIONS].delete_one({"_id": name})
@@ -0,0 +1,237 @@
+import inspect
+import itertools
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ASCENDING, TEXT, IndexModel
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+
+from cdiapi import settings
+from cdiapi.logs import get_logger
+from cdiapi.generations import live_generation
+from cdiapi.data.projection import STORE_TIMESTAMP
+from cdiapi.facets import CATALOG_FACETS, facet_pipeline
+from cdiapi.pagination import encode_cursor, keyset_query, keyset_sort, text_sort
+
+log = get_logger(__name__)
+
+
+def _filter_index(field: str, *sort: str) -> IndexModel:
+    """Index for a search filter, followed by the keyset sort order so that
+    filtered pages come out of the index already sorted."""
+    keys = [(field, ASCENDING)] + [(s, ASCENDING) for s in sort]
+    return IndexModel(keys)
+
+
+def _text_index(weights: Dict[str, int]) -> IndexModel:
+    # Records are in many languages, don't stem them as English. Documents may
+    # have a `language` field that isn't a MongoDB language name:
+    return IndexModel(
+        [(field, TEXT) for field in weights],
+        weights=weights,
+        default_language="none",
+        language_override="text_language",
+        name="text",
+    )
+
+
+ENTRY_FILTERS = [
+    "source.software.id",
+    "source.owner_type",
+    "source.catalog_type",
+    "source.countries",
+    "source.langs.id",
+    "dataset.tags",
+    "dataset.topics",
+    "dataset.geotopics",
+]
+CATALOG_FILTERS = [
+    "software.id",
+    "owner.type",
+    "catalog_type",
+    "owner.location.country.id",
+    "coverage.location.country.id",
+]
+
+# Indexes per database and (logical) collection, the names of the key
+# indexes match those `registry-update --rebuild` creates before loading:
+INDEXES: Dict[Tuple[str, str], List[IndexModel]] = {
+    (settings.SEARCH_DB, "fulldb"): [
+        IndexModel([("id", ASCENDING)], unique=True),
+        *[_filter_index(field, "_id") for field in ENTRY_FILTERS],
+        # Changed entries, for `search-sync` without change streams:
+        IndexModel([(STORE_TIMESTAMP, ASCENDING), ("_id", ASCENDING)]),
+        _text_index({"dataset.title": 10, "dataset.tags": 5, "dataset.description": 1}),
+    ],
+    (settings.REGISTRY_DB, "catalogs"): [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("uid", ASCENDING), ("_id", ASCENDING)]),
+        *[_filter_index(field, "uid", "_id") for field in CATALOG_FILTERS],
+        _text_index({"name": 10, "tags": 5, "owner.name": 5}),
+    ],
+}
+
+
+async def sync_indexes(
+    collection: "AsyncIOMotorCollection[Any]", models: List[IndexModel], drop: bool = False
+) -> None:
+    """Create the indexes in `models` that `collection` doesn't have yet. With
+    `drop`, remove the ones that aren't part of the spec."""
+    existing = await collection.index_information()
+    missing = [m for m in models if m.document["name"] not in existing]
+    if missing:
+        names = [m.document["name"] for m in missing]
+        log.info("Creating indexes on %s" % collection.full_name, action="indexes", indexes=names)
+        await collection.create_indexes(missing)
+    if drop:
+        wanted = {m.document["name"] for m in models}
+        for name in existing:
+            if name != "_id_" and name not in wanted:
+                log.info("Dropping index %s on %s" % (name, collection.full_name), action="indexes")
+                await collection.drop_index(name)
+
+
+async def sync_all(client: "AsyncIOMotorClient[Any]", drop: bool = False) -> None:
+    """Bring the live generation of every collection in line with the spec."""
+    for (db_name, name), models in INDEXES.items():
+        db = client[db_name]
+        collection = db[await live_generation(db, name)]
+        await sync_indexes(collection, models, drop=drop)
+
+
+def _sample_value(param: inspect.Parameter) -> Any:
+    return ["x"] if isinstance(param.default.default, list) else "x"
+
+
+def filter_combinations(filters: Callable[..., Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Every query a filter dependency (e.g. `entry_filters`) can produce,
+    with a sample value for each parameter that is set."""
+    params = list(inspect.signature(filters).parameters.values())
+    for enabled in itertools.product((False, True), repeat=len(params)):
+        kwargs = {}
+        for param, on in zip(params, enabled):
+            kwargs[param.name] = _sample_value(param) if on else param.default.default
+        yield filters(**kwargs)
+
+
+def _stages(plan: Any) -> Iterator[str]:
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+def _winning_plans(explain: Any) -> Iterator[Any]:
+    """Winning plans of an explain output, an aggregation has one per stage
+    that reads the collection."""
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield value
+            else:
+                yield from _winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from _winning_plans(value)
+
+
+async def _plan_stages(
+    collection: "AsyncIOMotorCollection[Any]",
+    query: Dict[str, Any],
+    sort: Optional[List[Tuple[str, Any]]] = None,
+) -> List[str]:
+    cursor = collection.find(query).limit(10)
+    if sort is not None:
+        cursor = cursor.sort(sort)
+    plan = await cursor.explain()
+    return list(_stages(plan["queryPlanner"]["winningPlan"]))
+
+
+async def _pipeline_stages(
+    db: "AsyncIOMotorDatabase[Any]", collection: str, pipeline: List[Dict[str, Any]]
+) -> List[str]:
+    command = {"aggregate": collection, "pipeline": pipeline, "cursor": {}}
+    explain = await db.command("explain", command, verbosity="queryPlanner")
+    return [stage for plan in _winning_plans(explain) for stage in _stages(plan)]
+
+
+def _queries(
+    filters: Callable[..., Dict[str, Any]], key_field: str, sort_field: Optional[str]
+) -> Iterator[Tuple[Dict[str, Any], Optional[List[Tuple[str, Any]]]]]:
+    """Queries issued by the endpoints of a collection: key lookups, then each
+    filter combination as an offset page, a cursor page and an export. Text
+    searches (`q`) are offset pages in relevance order only."""
+    yield {key_field: "x"}, None
+    yield {key_field: {"$in": ["x", "y"]}}, None
+    cursor = encode_cursor({"_id": ObjectId(), key_field: "x"}, sort_field)
+    export_cursor = encode_cursor({"_id": ObjectId()})
+    for query in filter_combinations(filters):
+        if "$text" in query:
+            yield query, text_sort()
+        else:
+            yield query, keyset_sort(sort_field)
+            yield keyset_query(query, cursor, sort_field), keyset_sort(sort_field)
+        yield keyset_query(query, export_cursor), keyset_sort()
+
+
+def count_pipeline(query: Dict[str, Any], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """The aggregation `count_documents` runs for `count_total`."""
+    pipeline: List[Dict[str, Any]] = [{"$match": query}]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$group": {"_id": 1, "n": {"$sum": 1}}})
+    return pipeline
+
+
+def _pipelines(
+    filters: Callable[..., Dict[str, Any]], facets: bool
+) -> Iterator[List[Dict[str, Any]]]:
+    """Aggregations issued by the search endpoints: the exact and estimated
+    counts of the total, and the facet counts. Unfiltered totals and facets
+    are left out, they come from the collection metadata, the count cache and
+    the facet summary."""
+    for query in filter_combinations(filters):
+        if not query:
+            continue
+        yield count_pipeline(query)
+        yield count_pipeline(query, settings.COUNT_ESTIMATE_LIMIT)
+        if facets:
+            yield facet_pipeline(query, list(CATALOG_FACETS), settings.FACET_SIZE)
+
+
+async def check_indexes(client: "AsyncIOMotorClient[Any]", db_name: str) -> List[str]:
+    """Explain every query and aggregation the endpoints can produce against
+    empty collections indexed as specified, in the scratch database
+    `db_name`. Returns the ones that would scan a whole collection."""
+    from cdiapi.routers.raw import entry_filters
+    from cdiapi.routers.catalog import catalog_filters
+
+    Check = Tuple[Callable[..., Dict[str, Any]], str, Optional[str], bool]
+    checks: Dict[Tuple[str, str], Check] = {
+        (settings.SEARCH_DB, "fulldb"): (entry_filters, "id", None, False),
+        (settings.REGISTRY_DB, "catalogs"): (catalog_filters, "uid", "uid", True),
+    }
+    failures: List[str] = []
+    await client.drop_database(db_name)
+    try:
+        for key, (filters, key_field, sort_field, facets) in checks.items():
+            collection = client[db_name][key[1]]
+            await sync_indexes(collection, INDEXES[key])
+            checked = 0
+            for query, sort in _queries(filters, key_field, sort_field):
+                stages = await _plan_stages(collection, query, sort)
+                checked += 1
+                if "COLLSCAN" in stages:
+                    failures.append("%s: %r sort=%r" % (key[1], query, sort))
+            for pipeline in _pipelines(filters, facets):
+                stages = await _pipeline_stages(client[db_name], key[1], pipeline)
+                checked += 1
+                if "COLLSCAN" in stages:
+                    failures.append("%s: aggregate %r" % (key[1], pipeline))
+            log.info("Checked %d queries on %s" % (checked, key[1]), action="indexes")
+    finally:
+        await client.drop_database(db_name)
+    return failures
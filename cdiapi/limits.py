@@ -0,0 +1,243 @@
+import time
+import random
+import threading
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from cdiapi import settings
+from cdiapi.cache import TTLCache
+from cdiapi.logs import get_logger
+
+log = get_logger(__name__)
+
+# Path prefix, route class and the backend the routes depend on. Paths not
+# listed are in the `default` class and depend on MongoDB:
+ROUTE_CLASSES: List[Tuple[str, str, str]] = [
+    ("/index/0.1/query", "search", "meili"),
+    ("/raw/0.1/search", "search", "mongo"),
+    ("/registry/search/", "search", "mongo"),
+    ("/raw/0.1/export", "export", "mongo"),
+    ("/registry/export", "export", "mongo"),
+    ("/raw/0.1/entries/batch", "batch", "mongo"),
+    ("/registry/catalogs/batch", "batch", "mongo"),
+]
+# Health checks and metrics are never limited:
+EXEMPT_PATHS = ("/healthz", "/readyz", "/metrics")
+# Route classes turned away first while a backend is slow:
+SHED_CLASSES = ("search", "export", "batch")
+# Route classes whose backend calls don't feed the latency averages, the
+# cursor batches of a long export are slow without the backend being slow:
+UNTIMED_CLASSES = ("export",)
+
+# Route class of the request being answered:
+current_route: ContextVar[Optional[str]] = ContextVar("current_route", default=None)
+
+# Redis script taking `cost` tokens from a bucket, returns the seconds to
+# wait for them or 0 if they were taken:
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+def parse_rates(value: Optional[str]) -> Dict[str, Tuple[float, float]]:
+    """Parse `class=rate/burst,...` into requests per second and bucket
+    size by route class, e.g. `search=10/30`. `off` disables the limits."""
+    rates: Dict[str, Tuple[float, float]] = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        name, _, spec = item.partition("=")
+        rate, _, burst = spec.partition("/")
+        rates[name.strip()] = (float(rate), float(burst or rate))
+    return rates
+
+
+def route_class(path: str) -> Tuple[str, str]:
+    """Route class of `path` and the backend it depends on."""
+    for prefix, name, backend in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            return name, backend
+    return "default", "mongo"
+
+
+def request_cost(query_params: Mapping[str, str]) -> float:
+    """Pages of more than `RATE_LIMIT_PAGE_SIZE` results count as several
+    requests. A limit of 0 (e.g. a facets-only search) counts as one, a
+    negative or non-numeric limit is charged as the largest page."""
+    largest = max(1.0, settings.MAX_PAGE / settings.RATE_LIMIT_PAGE_SIZE)
+    value = query_params.get("limit")
+    if value is None:
+        return 1.0
+    try:
+        limit = int(value)
+    except ValueError:
+        return largest
+    if limit < 0:
+        return largest
+    return min(largest, max(1.0, limit / settings.RATE_LIMIT_PAGE_SIZE))
+
+
+class MemoryLimitBackend:
+    """Token buckets kept by the worker process, each worker allows the
+    full rate."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        # A bucket unused for `ttl` seconds is full again, it can be evicted:
+        self.buckets = TTLCache(maxsize, ttl)
+
+    async def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self.buckets.set(key, (tokens, now))
+        return wait
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisLimitBackend:
+    """Token buckets shared by all workers through Redis."""
+
+    def __init__(self, url: str, prefix: str = "cdiapi:limit:") -> None:
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise RuntimeError("Shared rate limits need redis: pip install redis")
+        self.redis = redis.from_url(url)
+        self.script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.prefix = prefix
+
+    async def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        wait = await self.script(keys=[self.prefix + key], args=[rate, burst, cost])
+        return float(wait)
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+class LatencyTracker:
+    """Moving average of the latency of each backend, fed from the MongoDB
+    command listener (in Motor's threads) and the Meilisearch client.
+    Averages not updated for `SHED_WINDOW` seconds are forgotten, calls made
+    for `UNTIMED_CLASSES` routes are left out."""
+
+    def __init__(self, weight: float = 0.1) -> None:
+        self.weight = weight
+        self.averages: Dict[str, Tuple[float, float]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, backend: str, seconds: float) -> None:
+        if current_route.get() in UNTIMED_CLASSES:
+            return
+        now = time.monotonic()
+        with self.lock:
+            average, updated = self.averages.get(backend, (seconds, now))
+            if now - updated > settings.SHED_WINDOW:
+                average = seconds
+            self.averages[backend] = (average + self.weight * (seconds - average), now)
+
+    def average(self, backend: str) -> float:
+        average, updated = self.averages.get(backend, (0.0, 0.0))
+        if time.monotonic() - updated > settings.SHED_WINDOW:
+            return 0.0
+        return average
+
+
+class Rejection(NamedTuple):
+    status: int
+    reason: str
+    detail: str
+    retry_after: float
+
+
+class Limiter:
+    """Admission control in front of every request: a cap on the requests in
+    flight in the worker, load shedding while MongoDB or Meilisearch is
+    slower than its target latency, and token bucket rate limits per client
+    and route class."""
+
+    def __init__(self) -> None:
+        self.rates = parse_rates(settings.RATE_LIMITS)
+        ttl = max([burst / rate for rate, burst in self.rates.values()] or [1.0])
+        self.backend: Any = MemoryLimitBackend(settings.RATE_LIMIT_CLIENTS, ttl)
+        self.latency = LatencyTracker()
+        self.targets = {"mongo": settings.SHED_MONGO_LATENCY, "meili": settings.SHED_MEILI_LATENCY}
+        self.in_flight = 0
+
+    def shed_probability(self, backend: str) -> float:
+        """Share of requests to turn away, growing with the overshoot of the
+        target latency. Some still pass, they tell when the backend is back."""
+        target = self.targets.get(backend) or 0.0
+        if target <= 0:
+            return 0.0
+        overshoot = self.latency.average(backend) / target - 1.0
+        return min(settings.SHED_MAX_RATE, max(0.0, overshoot))
+
+    async def admit(
+        self, path: str, query_params: Mapping[str, str], client: str
+    ) -> Optional[Rejection]:
+        """Decide whether to serve a request, a `None` result must be paired
+        with a call to `release` once the response was sent."""
+        if path in EXEMPT_PATHS:
+            self.in_flight += 1
+            return None
+        if settings.MAX_IN_FLIGHT and self.in_flight >= settings.MAX_IN_FLIGHT:
+            return Rejection(503, "in_flight", "Server busy, try again later", settings.RETRY_AFTER)
+        name, backend = route_class(path)
+        if name in SHED_CLASSES and random.random() < self.shed_probability(backend):
+            return Rejection(503, "shed", "Server overloaded, try again later", settings.RETRY_AFTER)
+        limit = self.rates.get(name)
+        if limit is not None:
+            rate, burst = limit
+            cost = min(burst, request_cost(query_params))
+            try:
+                wait = await self.backend.take("%s:%s" % (name, client), rate, burst, cost)
+            except Exception as exc:
+                log.warning("Rate limit backend unavailable: %s" % exc, action="limits")
+                wait = 0.0
+            if wait > 0:
+                return Rejection(429, "rate", "Too many requests", wait)
+        self.in_flight += 1
+        return None
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def releaser(self) -> Callable[[], None]:
+        """`release`, for callers that may end a request in several places,
+        only the first call counts."""
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.release()
+
+        return release
+
+
+limiter = Limiter()
@@ -0,0 +1,312 @@
+import gzip
+import time
+import asyncio
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+import orjson
+import yaml
+from pydantic import ValidationError
+from pymongo import ReplaceOne
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+try:
+    from yaml import CSafeLoader as Loader
+except ImportError:
+    from yaml import SafeLoader as Loader  # type: ignore[assignment]
+
+from cdiapi import settings
+from cdiapi.db import create_client
+from cdiapi.logs import get_logger
+from cdiapi.data.datacatalog import DataCatalog
+from cdiapi.data.search import SearchIndexEntry
+from cdiapi.data.projection import STORE_TIMESTAMP
+from cdiapi.facets import CATALOG_SUMMARY, refresh_summary
+from cdiapi.generations import check_generation, clear_generations
+from cdiapi.generations import live_generation, new_generation, swap_generation
+from cdiapi.indexes import INDEXES, sync_indexes
+
+log = get_logger(__name__)
+
+HASH_FIELD = "_hash"
+# (key, content hash, JSON encoded document)
+Record = Tuple[str, str, bytes]
+Parsed = Tuple[List[Record], List[str]]
+
+
+def _record(key: str, data: Dict[str, Any]) -> Record:
+    data.pop("_id", None)
+    data.pop(HASH_FIELD, None)
+    data.pop(STORE_TIMESTAMP, None)
+    raw = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+    return key, hashlib.blake2b(raw, digest_size=16).hexdigest(), raw
+
+
+def parse_catalog_files(paths: List[Path]) -> Parsed:
+    """Read and validate data catalog YAML files, runs in a worker process."""
+    records: List[Record] = []
+    errors: List[str] = []
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                data = yaml.load(fh, Loader=Loader)
+            DataCatalog.model_validate(data)
+        except (OSError, yaml.YAMLError, ValidationError) as exc:
+            errors.append("%s: %s" % (path, exc))
+            continue
+        records.append(_record(data["uid"], data))
+    return records, errors
+
+
+def parse_entry_lines(lines: List[bytes]) -> Parsed:
+    """Decode and validate search index dump lines, runs in a worker process."""
+    records: List[Record] = []
+    errors: List[str] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            data = orjson.loads(line)
+            SearchIndexEntry.model_validate(data)
+        except (orjson.JSONDecodeError, ValidationError) as exc:
+            errors.append(str(exc))
+            continue
+        records.append(_record(data["id"], data))
+    return records, errors
+
+
+def _resolve(path: str) -> Path:
+    return settings.DATA_PATH.joinpath(path)
+
+
+def catalog_chunks(sources: List[Dict[str, str]], size: int) -> Iterator[List[Path]]:
+    for source in sources:
+        base = _resolve(source["path"])
+        paths = sorted(p for p in base.rglob("*") if p.suffix in (".yaml", ".yml"))
+        for i in range(0, len(paths), size):
+            yield paths[i : i + size]
+
+
+def entry_chunks(sources: List[Dict[str, str]], size: int) -> Iterator[List[bytes]]:
+    for source in sources:
+        path = _resolve(source["path"])
+        opener: Callable[..., Any] = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rb") as fh:
+            chunk: List[bytes] = []
+            for line in fh:
+                chunk.append(line)
+                if len(chunk) >= size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+
+class LoadStats:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = time.time()
+        self.valid = 0
+        self.invalid = 0
+        self.unchanged = 0
+        self.written = 0
+
+    def report(self) -> None:
+        took = time.time() - self.start
+        total = self.valid + self.invalid
+        log.info(
+            "Loaded %s" % self.name,
+            action="load",
+            records=total,
+            written=self.written,
+            unchanged=self.unchanged,
+            invalid=self.invalid,
+            took=took,
+            rate=total / took if took else total,
+        )
+
+
+async def write_records(
+    collection: "AsyncIOMotorCollection[Any]",
+    key_field: str,
+    records: List[Record],
+    force: bool,
+    stats: LoadStats,
+) -> None:
+    """Upsert the records that changed since the last load in one unordered
+    bulk write."""
+    latest = {key: (digest, raw) for key, digest, raw in records}
+    if not force:
+        query = {key_field: {"$in": list(latest)}}
+        async for doc in collection.find(query, {key_field: 1, HASH_FIELD: 1}):
+            key = doc.get(key_field)
+            if key in latest and latest[key][0] == doc.get(HASH_FIELD):
+                del latest[key]
+                stats.unchanged += 1
+    if not latest:
+        return
+    now = datetime.utcnow()
+    ops = []
+    for key, (digest, raw) in latest.items():
+        doc = orjson.loads(raw)
+        doc[HASH_FIELD] = digest
+        doc[STORE_TIMESTAMP] = now
+        ops.append(ReplaceOne({key_field: key}, doc, upsert=True))
+    await collection.bulk_write(ops, ordered=False)
+    stats.written += len(ops)
+
+
+async def load_collection(
+    name: str,
+    chunks: Iterator[Any],
+    parse: Callable[[Any], Parsed],
+    collection: "AsyncIOMotorCollection[Any]",
+    key_field: str,
+    pool: ProcessPoolExecutor,
+    force: bool = False,
+) -> LoadStats:
+    """Parse `chunks` in the process pool and write them as they complete,
+    keeping a bounded number of batches in flight."""
+    loop = asyncio.get_running_loop()
+    stats = LoadStats(name)
+    max_pending = settings.LOADER_WORKERS * 2
+
+    async def process(chunk: Any) -> None:
+        records, errors = await loop.run_in_executor(pool, parse, chunk)
+        stats.valid += len(records)
+        stats.invalid += len(errors)
+        for error in errors[:3]:
+            log.warning("Invalid record: %s" % error, action="load", source=name)
+        if records:
+            await write_records(collection, key_field, records, force, stats)
+
+    pending: Set["asyncio.Future[None]"] = set()
+    done: Set["asyncio.Future[None]"] = set()
+    try:
+        for chunk in chunks:
+            if len(pending) >= max_pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            pending.add(asyncio.ensure_future(process(chunk)))
+        await asyncio.gather(*pending)
+    except BaseException:
+        # Don't leave batches writing after the load failed, wait for them to
+        # be cancelled and collect their errors:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, *done, return_exceptions=True)
+        raise
+    stats.report()
+    return stats
+
+
+class ManifestError(Exception):
+    """The manifest listing the data to load is missing or unreadable."""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+def read_manifest() -> Dict[str, Any]:
+    try:
+        with open(settings.MANIFEST, "r", encoding="utf-8") as fh:
+            manifest = yaml.load(fh, Loader=Loader) or {}
+    except FileNotFoundError:
+        raise ManifestError("Manifest not found: %s (set CDIAPI_MANIFEST)" % settings.MANIFEST)
+    except (OSError, yaml.YAMLError) as exc:
+        raise ManifestError("Cannot read the manifest %s: %s" % (settings.MANIFEST, exc))
+    if not isinstance(manifest, dict):
+        raise ManifestError("Invalid manifest %s: expected a mapping" % settings.MANIFEST)
+    return manifest
+
+
+async def rebuild_collection(
+    name: str,
+    chunks: Iterator[Any],
+    parse: Callable[[Any], Parsed],
+    db: "AsyncIOMotorDatabase[Any]",
+    collection: str,
+    key_field: str,
+    pool: ProcessPoolExecutor,
+    before_swap: Optional[Callable[["AsyncIOMotorDatabase[Any]", str], Awaitable[None]]] = None,
+) -> None:
+    """Load everything into a new generation of `collection` while the live
+    one keeps serving, then swap it in if it passes the sanity checks.
+
+    Only the key index exists during the load, the other indexes in the spec
+    are built once all records are written. `before_swap` is called with the
+    new generation once it passed the checks."""
+    shadow = new_generation(collection)
+    target = db[shadow]
+    await target.create_index(key_field, unique=True)
+    stats = await load_collection(name, chunks, parse, target, key_field, pool, force=True)
+    await sync_indexes(target, INDEXES[(db.name, collection)])
+    if not await check_generation(db, collection, shadow, stats.invalid):
+        log.error("Keeping the live %s, dropping %s" % (collection, shadow), action="swap")
+        await db.drop_collection(shadow)
+        return
+    if before_swap is not None:
+        await before_swap(db, shadow)
+    await swap_generation(db, collection, shadow)
+
+
+async def update_registry(force: bool = False, rebuild: bool = False) -> None:
+    """Load the data catalogs and search index dumps listed in the manifest,
+    skipping records whose content didn't change unless `force` is set. With
+    `rebuild` the collections are loaded from scratch into a new generation
+    that replaces the live one in a single step."""
+    manifest = read_manifest()
+    size = settings.LOADER_BATCH_SIZE
+    client: "AsyncIOMotorClient[Any]" = create_client(read_preference="primary")
+    try:
+        with ProcessPoolExecutor(settings.LOADER_WORKERS) as pool:
+            catalogs = manifest.get("catalogs", [])
+            if catalogs:
+                # Catalog files are small, hand them out in smaller chunks:
+                chunks = catalog_chunks(catalogs, max(1, size // 10))
+                db = client[settings.REGISTRY_DB]
+                if rebuild:
+                    await rebuild_collection(
+                        "catalogs", chunks, parse_catalog_files, db, "catalogs", "uid", pool,
+                        before_swap=refresh_summary,
+                    )
+                else:
+                    collection = db[await live_generation(db, "catalogs")]
+                    await load_collection(
+                        "catalogs", chunks, parse_catalog_files, collection, "uid", pool, force
+                    )
+                    await refresh_summary(db, collection.name)
+            entries = manifest.get("entries", [])
+            if entries:
+                lines = entry_chunks(entries, size)
+                db = client[settings.SEARCH_DB]
+                if rebuild:
+                    await rebuild_collection(
+                        "entries", lines, parse_entry_lines, db, "fulldb", "id", pool
+                    )
+                else:
+                    collection = db[await live_generation(db, "fulldb")]
+                    await load_collection(
+                        "entries", lines, parse_entry_lines, collection, "id", pool, force
+                    )
+    finally:
+        client.close()
+
+
+async def clear_registry() -> None:
+    """Drop all generations of the catalog and search index collections."""
+    client: "AsyncIOMotorClient[Any]" = create_client(read_preference="primary")
+    try:
+        for db_name, collection in (
+            (settings.REGISTRY_DB, "catalogs"),
+            (settings.SEARCH_DB, "fulldb"),
+        ):
+            await clear_generations(client[db_name], collection)
+        await client[settings.REGISTRY_DB].drop_collection(CATALOG_SUMMARY)
+    finally:
+        client.close()
@@ -1,19 +1,26 @@
+import os
 import sys
+import queue
+import atexit
 import logging
+import threading
+import orjson
 import structlog
-from logging import Filter, LogRecord
-from typing import Any, Dict, List
+from logging import Formatter, Handler, LogRecord
+from typing import Any, Dict, List, MutableMapping, Optional, TextIO
 from structlog.dev import ConsoleRenderer, set_exc_info
 from structlog.contextvars import merge_contextvars
 from structlog.processors import UnicodeDecoder, TimeStamper
 from structlog.processors import format_exc_info, add_log_level
-from structlog.processors import JSONRenderer
 from structlog.stdlib import ProcessorFormatter, add_logger_name
 from structlog.stdlib import BoundLogger, LoggerFactory
 from structlog.stdlib import get_logger as get_raw_logger
 
 from cdiapi import settings
 
+# Stops the writer thread once the records before it are written:
+_STOP = LogRecord("cdiapi.logs", logging.INFO, __file__, 0, "stop", None, None)
+
 
 def get_logger(name: str) -> BoundLogger:
     return get_raw_logger(name)
@@ -38,9 +45,12 @@ def configure_logging(level: int = logging.INFO) -> None:
         shared_processors.append(format_json)
         formatter = ProcessorFormatter(
             foreign_pre_chain=shared_processors,
-            processor=JSONRenderer(),
+            processor=render_json,
         )
     else:
+        # Records are rendered on the writer thread, the exception has to be
+        # picked up while it is still being handled:
+        shared_processors.append(capture_exc_info)
         formatter = ProcessorFormatter(
             foreign_pre_chain=shared_processors,
             processor=ConsoleRenderer(
@@ -73,20 +83,21 @@ def configure_logging(level: int = logging.INFO) -> None:
     uv_access.setLevel(logging.WARNING)
     uv_access.propagate = True
 
-    # handler for low level logs that should be sent to STDOUT
-    out_handler = logging.StreamHandler(sys.stdout)
-    out_handler.setLevel(level)
-    out_handler.addFilter(_MaxLevelFilter(logging.WARNING))
-    out_handler.setFormatter(formatter)
-    # handler for high level logs that should be sent to STDERR
-    error_handler = logging.StreamHandler(sys.stderr)
-    error_handler.setLevel(logging.ERROR)
-    error_handler.setFormatter(formatter)
+    # low level logs are sent to STDOUT, high level logs to STDERR. Both are
+    # written by a background thread so that a slow pipe doesn't hold up the
+    # event loop:
+    writer = LogWriter(formatter, sys.stdout, sys.stderr)
+    queue_handler = QueueHandler(writer)
+    queue_handler.setLevel(level)
 
     root_logger = logging.getLogger()
     root_logger.setLevel(settings.LOG_LEVEL)
-    root_logger.addHandler(out_handler)
-    root_logger.addHandler(error_handler)
+    for handler in list(root_logger.handlers):
+        if isinstance(handler, QueueHandler):
+            root_logger.removeHandler(handler)
+            handler.writer.stop()
+    root_logger.addHandler(queue_handler)
+    writer.start()
 
 
 def format_json(_: Any, __: Any, ed: Dict[str, str]) -> Dict[str, str]:
@@ -96,9 +107,105 @@ def format_json(_: Any, __: Any, ed: Dict[str, str]) -> Dict[str, str]:
     return ed
 
 
-class _MaxLevelFilter(Filter):
-    def __init__(self, highest_log_level: int) -> None:
-        self._highest_log_level = highest_log_level
+def render_json(_: Any, __: Any, ed: MutableMapping[str, Any]) -> str:
+    """Like `JSONRenderer`, using orjson."""
+    return orjson.dumps(ed, default=repr, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+
+def capture_exc_info(_: Any, __: Any, ed: Dict[str, Any]) -> Dict[str, Any]:
+    if ed.get("exc_info") is True:
+        ed["exc_info"] = sys.exc_info()
+    return ed
+
 
-    def filter(self, log_record: LogRecord) -> bool:
-        return log_record.levelno <= self._highest_log_level
+class LogWriter:
+    """Format queued log records on a background thread and write them in
+    batches, records up to WARNING to `out` and the others to `err`."""
+
+    def __init__(self, formatter: Formatter, out: TextIO, err: TextIO) -> None:
+        self.formatter = formatter
+        self.out = out
+        self.err = err
+        self.queue: "queue.Queue[LogRecord]" = queue.Queue(settings.LOG_QUEUE_SIZE)
+        self.dropped = 0
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+        # The thread doesn't survive a fork, e.g. into the server workers:
+        os.register_at_fork(after_in_child=self.restart)
+
+    def restart(self) -> None:
+        if self.thread is not None:
+            self.queue = queue.Queue(settings.LOG_QUEUE_SIZE)
+            self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """Write out the queued records."""
+        thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.queue.put(_STOP)
+            thread.join(5)
+
+    def run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < settings.LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            self.write([r for r in batch if r is not _STOP])
+            if stop:
+                return
+
+    def write(self, batch: List[LogRecord]) -> None:
+        out: List[str] = []
+        err: List[str] = []
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            out.append(self.format(self.dropped_record(dropped)))
+        for record in batch:
+            line = self.format(record)
+            if line:
+                (out if record.levelno <= logging.WARNING else err).append(line)
+        for stream, lines in ((self.out, out), (self.err, err)):
+            if lines:
+                try:
+                    stream.write("\n".join(lines) + "\n")
+                    stream.flush()
+                except Exception:
+                    pass
+
+    def format(self, record: LogRecord) -> str:
+        try:
+            return self.formatter.format(record)
+        except Exception:
+            return ""
+
+    def dropped_record(self, dropped: int) -> LogRecord:
+        msg = "Log queue full, dropped %d records" % dropped
+        return LogRecord("cdiapi.logs", logging.WARNING, __file__, 0, msg, None, None)
+
+
+class QueueHandler(Handler):
+    """Hand log records over to a `LogWriter`, never blocks: records that
+    don't fit into the queue are dropped and counted."""
+
+    def __init__(self, writer: LogWriter) -> None:
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record: LogRecord) -> None:
+        if not isinstance(record.msg, dict) and record.args:
+            # The arguments may change before the record is written:
+            record.msg = record.getMessage()
+            record.args = None
+        try:
+            self.writer.queue.put_nowait(record)
+        except queue.Full:
+            self.writer.dropped += 1
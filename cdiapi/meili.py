@@ -0,0 +1,199 @@
+import time
+import asyncio
+from typing import Any, Dict, List, Optional
+import httpx
+import orjson
+from fastapi import Request
+
+from cdiapi import settings
+from cdiapi.logs import get_logger
+from cdiapi.metrics import MEILI_SEARCHES, timed
+
+log = get_logger(__name__)
+
+
+class ApiError(Exception):
+    """Meilisearch answered the call with an error status."""
+
+    def __init__(self, status_code: int, message: str) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class TransportError(Exception):
+    """Meilisearch could not be reached in time."""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+class TaskError(Exception):
+    """An asynchronous Meilisearch task failed or didn't finish in time."""
+
+    def __init__(self, task: Dict[str, Any], message: str) -> None:
+        super().__init__(message)
+        self.task = task
+        self.message = message
+
+
+class MeiliClient:
+    """Asynchronous Meilisearch client shared by all requests of a worker. It
+    keeps a pool of keep-alive connections and caps the number of searches in
+    flight, so a slow search backend can't pile up unbounded work."""
+
+    def __init__(
+        self,
+        url: str,
+        key: Optional[str],
+        index_name: str,
+        timeout: float = settings.MEILI_TIMEOUT,
+        max_connections: int = settings.MEILI_MAX_CONNECTIONS,
+        max_concurrency: int = settings.MEILI_MAX_CONCURRENCY,
+    ) -> None:
+        headers = {}
+        if key:
+            headers["Authorization"] = f"Bearer {key}"
+        self.index_name = index_name
+        self.timeout = timeout
+        self.http = httpx.AsyncClient(
+            base_url=url,
+            headers=headers,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        self.slots = asyncio.Semaphore(max_concurrency)
+
+    @classmethod
+    def from_settings(cls) -> "MeiliClient":
+        return cls(settings.MEILI_URL, settings.MEILI_KEY, settings.MEILI_INDEX)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        json: Any = None,
+        timeout: Optional[float] = None,
+        operation: str = "request",
+        content: Optional[bytes] = None,
+    ) -> Any:
+        timeout = self.timeout if timeout is None else timeout
+        MEILI_SEARCHES.labels("waiting").inc()
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise TransportError("Too many concurrent search requests")
+        finally:
+            MEILI_SEARCHES.labels("waiting").dec()
+        MEILI_SEARCHES.labels("running").inc()
+        try:
+            with timed("meili", operation):
+                if content is not None:
+                    headers = {"Content-Type": "application/json"}
+                    resp = await self.http.request(
+                        method, path, content=content, headers=headers, timeout=timeout
+                    )
+                else:
+                    resp = await self.http.request(method, path, json=json, timeout=timeout)
+        except httpx.TimeoutException:
+            raise TransportError("Search backend timed out")
+        except httpx.TransportError as exc:
+            raise TransportError(f"Search backend unavailable: {exc}")
+        finally:
+            MEILI_SEARCHES.labels("running").dec()
+            self.slots.release()
+        if resp.status_code >= 400:
+            raise ApiError(resp.status_code, resp.text)
+        return orjson.loads(resp.content)
+
+    async def search(
+        self, q: str, params: Dict[str, Any], timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        body = dict(params)
+        body["q"] = q
+        path = f"/indexes/{self.index_name}/search"
+        result: Dict[str, Any] = await self.request(
+            "POST", path, json=body, timeout=timeout, operation="search"
+        )
+        return result
+
+    async def add_documents(
+        self, body: bytes, index: Optional[str] = None, timeout: Optional[float] = None
+    ) -> int:
+        """Enqueue adding or replacing the documents in `body`, a JSON array,
+        returns the task uid."""
+        path = f"/indexes/{index or self.index_name}/documents?primaryKey=id"
+        task = await self.request(
+            "POST", path, content=body, timeout=timeout, operation="add_documents"
+        )
+        return int(task["taskUid"])
+
+    async def delete_documents(self, ids: List[str], index: Optional[str] = None) -> int:
+        path = f"/indexes/{index or self.index_name}/documents/delete-batch"
+        task = await self.request("POST", path, json=ids, operation="delete_documents")
+        return int(task["taskUid"])
+
+    async def wait_for_task(
+        self, uid: int, timeout: float = settings.SEARCH_SYNC_TASK_TIMEOUT, interval: float = 0.5
+    ) -> Dict[str, Any]:
+        """Poll task `uid` until it is processed, raise `TaskError` if it
+        didn't succeed."""
+        deadline = time.monotonic() + timeout
+        while True:
+            task: Dict[str, Any] = await self.request("GET", f"/tasks/{uid}", operation="task")
+            status = task.get("status")
+            if status == "succeeded":
+                return task
+            if status in ("failed", "canceled"):
+                raise TaskError(task, "Task %s %s: %s" % (uid, status, task.get("error")))
+            if time.monotonic() > deadline:
+                raise TaskError(task, "Task %s still %s after %ds" % (uid, status, timeout))
+            await asyncio.sleep(interval)
+
+    async def get_index(self, index: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        try:
+            info: Dict[str, Any] = await self.request(
+                "GET", f"/indexes/{index or self.index_name}", operation="index"
+            )
+        except ApiError as exc:
+            if exc.status_code == 404:
+                return None
+            raise
+        return info
+
+    async def create_index(self, index: str) -> int:
+        body = {"uid": index, "primaryKey": "id"}
+        task = await self.request("POST", "/indexes", json=body, operation="create_index")
+        return int(task["taskUid"])
+
+    async def delete_index(self, index: str) -> int:
+        task = await self.request("DELETE", f"/indexes/{index}", operation="delete_index")
+        return int(task["taskUid"])
+
+    async def get_settings(self, index: Optional[str] = None) -> Dict[str, Any]:
+        path = f"/indexes/{index or self.index_name}/settings"
+        index_settings: Dict[str, Any] = await self.request("GET", path, operation="settings")
+        return index_settings
+
+    async def update_settings(self, index: str, index_settings: Dict[str, Any]) -> int:
+        path = f"/indexes/{index}/settings"
+        task = await self.request("PATCH", path, json=index_settings, operation="settings")
+        return int(task["taskUid"])
+
+    async def swap_indexes(self, first: str, second: str) -> int:
+        body = [{"indexes": [first, second]}]
+        task = await self.request("POST", "/swap-indexes", json=body, operation="swap_indexes")
+        return int(task["taskUid"])
+
+    async def close(self) -> None:
+        await self.http.aclose()
+
+
+def get_meili(request: Request) -> MeiliClient:
+    """Dependency returning the client opened by the application lifespan."""
+    meili: MeiliClient = request.app.state.meili
+    return meili
@@ -0,0 +1,162 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+from fastapi import Request
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from pymongo import monitoring
+
+from cdiapi.cache import RESPONSE_CACHES
+from cdiapi.limits import limiter
+from cdiapi.timing import record
+
+# Set by `cdiapi serve --workers`, metrics of all workers are then written to
+# files in this directory and summed up when scraped:
+MULTIPROC_DIR = "PROMETHEUS_MULTIPROC_DIR"
+# Requests that didn't match any route are counted under this label, rather
+# than under their path, to keep the number of series bounded:
+UNMATCHED = "<unmatched>"
+
+REQUEST_LATENCY = Histogram(
+    "cdiapi_request_duration_seconds",
+    "Time spent answering requests",
+    ["route", "method", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "cdiapi_requests_in_flight",
+    "Requests being answered",
+    multiprocess_mode="livesum",
+)
+BACKEND_LATENCY = Histogram(
+    "cdiapi_backend_duration_seconds",
+    "Time spent waiting for MongoDB and Meilisearch calls",
+    ["backend", "operation"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10),
+)
+MONGO_CONNECTIONS = Gauge(
+    "cdiapi_mongo_connections",
+    "MongoDB connections by state: open, in use, or requests waiting for one",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+MONGO_CHECKOUT_FAILURES = Counter(
+    "cdiapi_mongo_checkout_failures_total",
+    "Requests that could not get a MongoDB connection",
+    ["reason"],
+)
+MEILI_SEARCHES = Gauge(
+    "cdiapi_meili_searches",
+    "Meilisearch calls by state: running or waiting for a free slot",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+REQUESTS_REJECTED = Counter(
+    "cdiapi_requests_rejected_total",
+    "Requests turned away by reason: rate limit, in-flight cap or load shedding",
+    ["reason"],
+)
+CACHE_REQUESTS = Counter(
+    "cdiapi_cache_requests_total",
+    "Response cache lookups by result: hits, misses, coalesced or stale",
+    ["cache", "result"],
+)
+
+
+@contextmanager
+def timed(backend: str, operation: str) -> Iterator[None]:
+    """Record the time spent in the block as a call to `backend`, also as a
+    phase of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        took = time.perf_counter() - start
+        BACKEND_LATENCY.labels(backend, operation).observe(took)
+        limiter.latency.observe(backend, took)
+        record("%s-%s" % (backend, operation), took)
+
+
+def route_label(request: Request) -> str:
+    """Path template of the route that answered `request`."""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Time MongoDB commands: `find` and `getMore` for queries, `aggregate`
+    for `count_documents`."""
+
+    def started(self, event: Any) -> None:
+        pass
+
+    def observe(self, event: Any) -> None:
+        took = event.duration_micros / 1e6
+        BACKEND_LATENCY.labels("mongo", event.command_name).observe(took)
+        limiter.latency.observe("mongo", took)
+        record("mongo-%s" % event.command_name, took)
+
+    def succeeded(self, event: Any) -> None:
+        self.observe(event)
+
+    def failed(self, event: Any) -> None:
+        self.observe(event)
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Track the MongoDB connection pool of a worker."""
+
+    def pool_created(self, event: Any) -> None:
+        pass
+
+    def pool_ready(self, event: Any) -> None:
+        pass
+
+    def pool_cleared(self, event: Any) -> None:
+        pass
+
+    def pool_closed(self, event: Any) -> None:
+        pass
+
+    def connection_created(self, event: Any) -> None:
+        MONGO_CONNECTIONS.labels("open").inc()
+
+    def connection_ready(self, event: Any) -> None:
+        pass
+
+    def connection_closed(self, event: Any) -> None:
+        MONGO_CONNECTIONS.labels("open").dec()
+
+    def connection_check_out_started(self, event: Any) -> None:
+        MONGO_CONNECTIONS.labels("waiting").inc()
+
+    def connection_check_out_failed(self, event: Any) -> None:
+        MONGO_CONNECTIONS.labels("waiting").dec()
+        MONGO_CHECKOUT_FAILURES.labels(str(event.reason)).inc()
+
+    def connection_checked_out(self, event: Any) -> None:
+        MONGO_CONNECTIONS.labels("waiting").dec()
+        MONGO_CONNECTIONS.labels("in_use").inc()
+
+    def connection_checked_in(self, event: Any) -> None:
+        MONGO_CONNECTIONS.labels("in_use").dec()
+
+
+def _count_cache(cache: str, result: str, count: int) -> None:
+    CACHE_REQUESTS.labels(cache, result).inc(count)
+
+
+for _cache in RESPONSE_CACHES:
+    _cache.listeners.append(_count_cache)
+
+
+def render_metrics() -> bytes:
+    """Metrics in the Prometheus text format, of all worker processes when
+    running with several."""
+    registry: CollectorRegistry = REGISTRY
+    if os.environ.get(MULTIPROC_DIR):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)  # type: ignore[no-untyped-call]
+    return generate_latest(registry)
@@ -0,0 +1,148 @@
+import base64
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId, json_util
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from cdiapi import settings
+from cdiapi.cache import TTLCache
+
+count_cache = TTLCache(settings.COUNT_CACHE_SIZE, settings.COUNT_CACHE_TTL)
+
+
+class TotalMode(str, Enum):
+    exact = "exact"
+    estimate = "estimate"
+    none = "none"
+
+
+def keyset_sort(sort_field: Optional[str] = None) -> List[Tuple[str, int]]:
+    """Sort order that keyset cursors resume from, `_id` breaks ties."""
+    if sort_field is None:
+        return [("_id", 1)]
+    return [(sort_field, 1), ("_id", 1)]
+
+
+def text_sort() -> List[Tuple[str, Any]]:
+    """Sort order of text searches, best matches first. They are paged by
+    offset only, `_id` keeps the order of equal scores stable."""
+    return [("score", {"$meta": "textScore"}), ("_id", 1)]
+
+
+def check_cursor(query: Dict[str, Any], cursor: Optional[str]) -> None:
+    """Relevance order can't be resumed from a cursor, text searches must be
+    paged by offset."""
+    if cursor and "$text" in query:
+        raise HTTPException(400, detail="Text searches (q) are paged by offset, not by cursor")
+
+
+def encode_cursor(item: Dict[str, Any], sort_field: Optional[str] = None) -> str:
+    """Build an opaque cursor pointing right after `item`."""
+    value = None
+    if sort_field is not None:
+        value = item
+        for part in sort_field.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+    raw = json_util.dumps([value, item["_id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+# Types a sort value can have in a cursor, anything else (e.g. a document
+# with query operators) is rejected:
+CURSOR_VALUE_TYPES = (str, int, float, datetime, type(None))
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, ObjectId]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, last_id = json_util.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(400, detail="Invalid cursor")
+    if not isinstance(value, CURSOR_VALUE_TYPES) or not isinstance(last_id, ObjectId):
+        raise HTTPException(400, detail="Invalid cursor")
+    return value, last_id
+
+
+def page_items(
+    items: List[Dict[str, Any]], limit: int, sort_field: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Split the `limit + 1` items fetched for a page into the page and the
+    cursor of the next one, `None` when there is no next page."""
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor(items[-1], sort_field)
+
+
+def keyset_query(
+    query: Dict[str, Any], cursor: str, sort_field: Optional[str] = None
+) -> Dict[str, Any]:
+    """Add the range predicate that resumes `query` after `cursor`."""
+    value, last_id = decode_cursor(cursor)
+    if sort_field is None:
+        return after_id_query(query, last_id)
+    after = {
+        "$or": [
+            {sort_field: {"$gt": value}},
+            {sort_field: value, "_id": {"$gt": last_id}},
+        ]
+    }
+    return _merge_query(query, after)
+
+
+def parse_object_id(value: str) -> Any:
+    """`_id` given in a request, as an ObjectId when it looks like one."""
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+
+def after_id_query(query: Dict[str, Any], last_id: Any) -> Dict[str, Any]:
+    """Restrict `query` to documents stored after `last_id`."""
+    return _merge_query(query, {"_id": {"$gt": last_id}})
+
+
+def _merge_query(query: Dict[str, Any], extra: Dict[str, Any]) -> Dict[str, Any]:
+    if set(extra).intersection(query):
+        return {"$and": [query, extra]}
+    return {**query, **extra}
+
+
+def normalize_query(query: Any) -> Any:
+    """Canonical form of a filter: sorted keys and de-duplicated `$in` lists."""
+    if isinstance(query, dict):
+        normalized = {}
+        for key in sorted(query):
+            value = query[key]
+            if key == "$in" and isinstance(value, list):
+                normalized[key] = sorted(set(value), key=str)
+            else:
+                normalized[key] = normalize_query(value)
+        return normalized
+    if isinstance(query, list):
+        return [normalize_query(value) for value in query]
+    return query
+
+
+async def count_total(
+    collection: "AsyncIOMotorCollection[Any]", query: Dict[str, Any], mode: TotalMode
+) -> Tuple[Optional[int], Optional[str]]:
+    """Count the matches of `query` and tell how exact the number is: `eq`,
+    `gte` (there are at least that many) or `approx`."""
+    if mode == TotalMode.none:
+        return None, None
+    key = (collection.full_name, json_util.dumps(normalize_query(query)))
+    total = count_cache.get(key)
+    if total is not None:
+        return total, "eq"
+    if mode == TotalMode.estimate:
+        if not query:
+            return await collection.estimated_document_count(), "approx"
+        limit = settings.COUNT_ESTIMATE_LIMIT
+        total = await collection.count_documents(query, limit=limit)
+        if total >= limit:
+            return total, "gte"
+    else:
+        total = await collection.count_documents(query)
+    count_cache.set(key, total)
+    return total, "eq"
@@ -0,0 +1,45 @@
+import re
+import hmac
+from uuid import uuid4
+from typing import Any, Optional
+from fastapi import Request
+
+from cdiapi import settings
+from cdiapi.logs import get_logger
+
+log = get_logger(__name__)
+
+
+def profile_requested(request: Request) -> bool:
+    """`?profile=1` or `X-Profile: 1`, together with the `X-Profile-Token`
+    header matching `CDIAPI_PROFILE_TOKEN`. Profiling is off without a token."""
+    if not settings.PROFILE_TOKEN:
+        return False
+    flag = request.query_params.get("profile") or request.headers.get("x-profile")
+    if flag not in ("1", "true"):
+        return False
+    token = request.headers.get("x-profile-token", "")
+    return hmac.compare_digest(token.encode("utf-8"), settings.PROFILE_TOKEN.encode("utf-8"))
+
+
+def start_profile() -> Optional[Any]:
+    """Start a sampling profiler covering the current request only."""
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        log.warning("Profiling needs pyinstrument: pip install pyinstrument")
+        return None
+    profiler = Profiler(interval=settings.PROFILE_INTERVAL, async_mode="enabled")
+    profiler.start()
+    return profiler
+
+
+def save_profile(profiler: Any, trace_id: str) -> str:
+    """Stop `profiler` and store its HTML report, returns the file name."""
+    profiler.stop()
+    settings.PROFILE_PATH.mkdir(parents=True, exist_ok=True)
+    # The trace id may come from the client, keep it to a safe file name:
+    name = "%s.html" % (re.sub(r"[^\w-]", "", trace_id)[:64] or uuid4().hex)
+    with open(settings.PROFILE_PATH.joinpath(name), "w", encoding="utf-8") as fh:
+        fh.write(profiler.output_html())
+    return name
@@ -0,0 +1,230 @@
+import zlib
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Mapping, Optional, Type
+import orjson
+from bson import ObjectId
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from cdiapi import settings
+from cdiapi.compression import ENCODINGS, choose_encoding, compress as compress_body
+from cdiapi.compression import encoded_etag, identity_etag
+from cdiapi.data.projection import STORE_TIMESTAMP
+from cdiapi.timing import phase
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError("Type is not JSON serializable: %s" % type(obj).__name__)
+
+
+def dump_json(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+def dump_json_line(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def _as_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def strip_store_fields(items: Iterable[Dict[str, Any]]) -> Optional[datetime]:
+    """Remove the MongoDB `_id` and the store timestamp, which aren't part of
+    any response model, and return the most recent of those timestamps."""
+    latest: Optional[datetime] = None
+    for item in items:
+        item.pop("_id", None)
+        updated_at = item.pop(STORE_TIMESTAMP, None)
+        if isinstance(updated_at, datetime):
+            updated_at = _as_utc(updated_at)
+            if latest is None or updated_at > latest:
+                latest = updated_at
+    return latest
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class CachedBody:
+    """Encoded JSON body together with its validators. Compressed variants
+    are kept alongside, so that a cached body is compressed only once per
+    encoding."""
+
+    __slots__ = ("body", "etag", "last_modified", "variants")
+
+    def __init__(
+        self,
+        body: bytes,
+        etag: Optional[str] = None,
+        last_modified: Optional[datetime] = None,
+        variants: Optional[Dict[str, bytes]] = None,
+    ) -> None:
+        self.body = body
+        self.etag = etag or make_etag(body)
+        self.last_modified = last_modified
+        self.variants = variants or {}
+
+    def encoded(self, encoding: str) -> bytes:
+        variant = self.variants.get(encoding)
+        if variant is None:
+            with phase("compress"):
+                variant = compress_body(self.body, encoding)
+            self.variants[encoding] = variant
+        return variant
+
+    def precompress(self) -> "CachedBody":
+        """Compress the body in every encoding we offer, before it goes into
+        a cache shared by other processes."""
+        if len(self.body) >= settings.COMPRESSION_MIN_SIZE:
+            for encoding in ENCODINGS:
+                self.encoded(encoding)
+        return self
+
+
+def encode(model: Type[BaseModel], content: Any, exclude_unset: bool = False) -> bytes:
+    """Encode documents from our own store straight to JSON. Their shape is
+    fixed by the projection derived from `model`, which also documents the
+    endpoint. Setting `CDIAPI_VALIDATE_RESPONSES` runs them through the model
+    first, for debugging data problems."""
+    if settings.VALIDATE_RESPONSES:
+        with phase("validate"):
+            obj = model.model_validate(content)
+            content = obj.model_dump(mode="json", exclude_unset=exclude_unset)
+    with phase("encode"):
+        return dump_json(content)
+
+
+def is_not_modified(
+    request: Request, etag: str, last_modified: Optional[datetime] = None
+) -> bool:
+    """Check the conditional request headers, If-None-Match takes precedence.
+    Tags of compressed variants match the tag of the body they encode."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        tags = [identity_etag(tag.strip().removeprefix("W/")) for tag in if_none_match.split(",")]
+        return etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = _as_utc(parsedate_to_datetime(if_modified_since))
+        except (TypeError, ValueError):
+            return False
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def validator_headers(
+    etag: str,
+    last_modified: Optional[datetime] = None,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Dict[str, str]:
+    validators = dict(headers or {})
+    validators["ETag"] = etag
+    if last_modified is not None:
+        validators["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return validators
+
+
+def not_modified_response(
+    etag: str,
+    last_modified: Optional[datetime] = None,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    validators = validator_headers(etag, last_modified, headers)
+    return Response(status_code=304, headers=validators)
+
+
+def conditional_response(
+    request: Request, cached: CachedBody, headers: Optional[Mapping[str, str]] = None
+) -> Response:
+    """Send `cached`, or an empty 304 if the client already has this version.
+    Bodies of `COMPRESSION_MIN_SIZE` bytes or more are sent in the encoding
+    negotiated with the client, from the variants kept in `cached`."""
+    encoding = None
+    if len(cached.body) >= settings.COMPRESSION_MIN_SIZE:
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+    headers = dict(headers or {}, Vary="Accept-Encoding")
+    etag = cached.etag
+    if encoding is not None:
+        etag = encoded_etag(cached.etag, encoding)
+    if is_not_modified(request, cached.etag, cached.last_modified):
+        return not_modified_response(etag, cached.last_modified, headers)
+    validators = validator_headers(etag, cached.last_modified, headers)
+    if encoding is None:
+        return Response(cached.body, media_type="application/json", headers=validators)
+    validators["Content-Encoding"] = encoding
+    body = cached.encoded(encoding)
+    return Response(body, media_type="application/json", headers=validators)
+
+
+def batch_response(
+    keys: List[str], found: Mapping[str, CachedBody], headers: Optional[Mapping[str, str]] = None
+) -> Response:
+    """Join cached bodies into a `{"data": [...], "missing": [...]}` response
+    in the order of `keys`, without decoding them."""
+    bodies = [found[key].body for key in keys if key in found]
+    missing = [key for key in keys if key not in found]
+    body = b'{"data":[' + b",".join(bodies) + b'],"missing":' + dump_json(missing) + b"}"
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def render(
+    request: Request,
+    model: Type[BaseModel],
+    content: Any,
+    exclude_unset: bool = False,
+    last_modified: Optional[datetime] = None,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    body = encode(model, content, exclude_unset=exclude_unset)
+    cached = CachedBody(body, last_modified=last_modified)
+    return conditional_response(request, cached, headers=headers)
+
+
+async def _ndjson_chunks(
+    documents: AsyncIterable[Dict[str, Any]], batch_size: int, compress: bool
+) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(settings.GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    lines = []
+    async for doc in documents:
+        doc.pop(STORE_TIMESTAMP, None)
+        lines.append(dump_json_line(doc))
+        if len(lines) >= batch_size:
+            chunk = b"".join(lines)
+            lines = []
+            yield compressor.compress(chunk) if compressor else chunk
+    chunk = b"".join(lines)
+    if compressor is not None:
+        yield compressor.compress(chunk) + compressor.flush()
+    elif chunk:
+        yield chunk
+
+
+def ndjson_response(
+    documents: AsyncIterable[Dict[str, Any]],
+    batch_size: int,
+    filename: str,
+    compress: bool = False,
+) -> StreamingResponse:
+    """Stream documents as newline-delimited JSON, one batch per chunk, so
+    memory use doesn't grow with the size of the export. With `compress` the
+    stream is a gzip file, otherwise it is compressed on the way out if the
+    client accepts it."""
+    media_type = "application/x-ndjson"
+    if compress:
+        media_type = "application/gzip"
+        filename = filename + ".gz"
+    headers = {"Content-Disposition": 'attachment; filename="%s"' % filename}
+    chunks = _ndjson_chunks(documents, batch_size, compress)
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
@@ -1,18 +1,49 @@
-from typing import List, Optional, Union
-from fastapi import APIRouter, Path, Query, Response, HTTPException
-from fastapi.responses import RedirectResponse
+import asyncio
+from typing import Any, Dict, List, Optional, Union
+from fastapi import APIRouter, Depends, Path, Query, Request, Response, HTTPException
+from fastapi.responses import RedirectResponse, StreamingResponse
 
 from cdiapi import settings
 from cdiapi.logs import get_logger
-from cdiapi.data.common import ErrorResponse
+from cdiapi.data.common import ErrorResponse, BatchRequest, DataCatalogBatchResponse
 from cdiapi.data.common import DataCatalogResponse, DataCatalogSearchResponse
-import motor.motor_asyncio
+from cdiapi.data.common import DataCatalogSearchItem
+from cdiapi.data.projection import model_projection, store_projection
+from cdiapi.cache import catalog_cache
+from cdiapi.responses import CachedBody, conditional_response, encode, render
+from cdiapi.responses import batch_response, ndjson_response, strip_store_fields
+from cdiapi.pagination import TotalMode, count_total
+from cdiapi.pagination import check_cursor, keyset_query, keyset_sort, page_items, text_sort
+from cdiapi.pagination import after_id_query, parse_object_id
+from cdiapi.db import Store, get_store
+from cdiapi.facets import CATALOG_FACETS, catalog_facets, check_facets
 log = get_logger(__name__)
 router = APIRouter()
 
 
-client = motor.motor_asyncio.AsyncIOMotorClient("mongodb://localhost:27017")
-db = client.cdi
+
+def catalog_filters(
+    q: str = Query("", title="Query text"),
+    software: str = Query(None, title="Software identifier"),
+    owner_type: str = Query(None, title="Owner type"),
+    catalog_type: str = Query(None, title="Owner type"),
+    owner_country: List[str] = Query([], title="Country of the owner"),
+    coverage_country: List[str] = Query([], title="Country of the coverage"),
+) -> Dict[str, Any]:
+    """MongoDB filter built from the registry query parameters."""
+    query: Dict[str, Any] = {}
+    if q: query['$text'] = {'$search' : q}
+    if software: query['software.id'] = software
+    if owner_type: query['owner.type'] = owner_type
+    if catalog_type: query['catalog_type'] = catalog_type
+    if owner_country: query['owner.location.country.id'] = {'$in': owner_country}
+    if coverage_country: query['coverage.location.country.id'] = {'$in': coverage_country}
+    return query
+
+
+def _catalog_body(item: Dict[str, Any]) -> CachedBody:
+    last_modified = strip_store_fields([item])
+    return CachedBody(encode(DataCatalogResponse, item), last_modified=last_modified)
 
 
 @router.get(
@@ -26,23 +57,61 @@ db = client.cdi
     },
 )
 async def fetch_datacatalog(
-    response: Response,
+    request: Request,
     catalog_id: str = Path(
         description="UID of the data catalog to retrieve", examples=["cdi00000006"]
     ),
-) -> Union[RedirectResponse, DataCatalogResponse]:
+    store: Store = Depends(get_store),
+) -> Union[RedirectResponse, Response, DataCatalogResponse]:
     """Retrieve a single data catalog registry item by its UID. The record will be returned in
     full. If the catalog has been merged into a another catalog canonical entity, an HTTP redirect will
     be triggered.
 
     Intro: [data catalog records](https://commondata.io/docs/datacatalog).
     """
-    item = await db["catalogs"].find_one({'uid' : catalog_id})
-    if item is None:
+    # Resolved before the cache is read, a swapped generation empties it:
+    collection = await store.catalogs.collection()
+
+    async def load() -> Optional[CachedBody]:
+        projection = store_projection(model_projection(DataCatalogResponse))
+        item = await collection.find_one({'uid' : catalog_id}, projection)
+        return None if item is None else _catalog_body(item)
+
+    cached = await catalog_cache.get_or_load(catalog_id, load)
+    if cached is None:
         raise HTTPException(404, detail="No such data catalog!")
-    log.info(item['name'], action="catalog", catalog_id=catalog_id)
-    response.headers.update(settings.CACHE_HEADERS)
-    return item
+    log.info(catalog_id, action="catalog", catalog_id=catalog_id)
+    return conditional_response(request, cached, headers=settings.CACHE_HEADERS)
+
+
+@router.post(
+    "/registry/catalogs/batch",
+    tags=["Data catalogs registry"],
+    response_model=DataCatalogBatchResponse,
+    responses={
+        500: {"model": ErrorResponse, "description": "Server error"},
+    },
+)
+async def fetch_datacatalogs_batch(
+    batch: BatchRequest,
+    store: Store = Depends(get_store),
+) -> Union[Response, DataCatalogBatchResponse]:
+    """Retrieve many data catalog registry items by UID in one request. Records
+    are returned in the order of the request, UIDs that don't exist are listed
+    in `missing`.
+
+    Intro: [data catalog records](https://commondata.io/docs/datacatalog).
+    """
+    collection = await store.catalogs.collection()
+
+    async def load(missing: List[str]) -> Dict[str, CachedBody]:
+        projection = store_projection(model_projection(DataCatalogResponse))
+        items = await collection.find({'uid' : {'$in' : missing}}, projection).to_list(None)
+        return {item['uid']: _catalog_body(item) for item in items}
+
+    uids = list(dict.fromkeys(batch.ids))
+    found = await catalog_cache.get_or_load_many(uids, load)
+    return batch_response(uids, found)
 
 
 @router.get(
@@ -55,37 +124,82 @@ async def fetch_datacatalog(
     },
 )
 async def search_datacatalog(
-    response: Response,
-    q: str = Query("", title="Query text"),
-    limit: int = Query(10, title="Number of results to return", le=settings.MAX_PAGE),
+    request: Request,
+    limit: int = Query(10, title="Number of results to return", ge=1, le=settings.MAX_PAGE),
     offset: int = Query(
-        0, title="Start at result with given offset", le=settings.MAX_OFFSET
+        0, title="Start at result with given offset", ge=0, le=settings.MAX_OFFSET
     ),
-    software: str = Query(None, title="Software identifier"),
-    owner_type: str = Query(None, title="Owner type"),
-    catalog_type: str = Query(None, title="Owner type"),
-    owner_country: List[str] = Query([], title="Country of the owner"),
-    coverage_country: List[str] = Query([], title="Country of the coverage"),
-
-) -> Union[RedirectResponse, DataCatalogSearchResponse]:
-    """Retrieve a list of data catalog registry item.
+    cursor: str = Query(None, title="Continue after the page that returned this `next_cursor`, replaces offset"),
+    total: TotalMode = Query(TotalMode.exact, title="How to count matches: exact, estimate or none"),
+    facets: List[str] = Query([], title="Count the matching catalogs per value of these fields: %s" % ", ".join(CATALOG_FACETS)),
+    query: Dict[str, Any] = Depends(catalog_filters),
+    store: Store = Depends(get_store),
+) -> Union[RedirectResponse, Response, DataCatalogSearchResponse]:
+    """Retrieve a list of data catalog registry item. With `facets`, the
+    response also holds the number of matching catalogs per value of each
+    facet, most frequent first.
 
     Intro: [data catalog records](https://commondata.io/docs/datacatalog).
     """
-    query = {}
-    if q: query['$text'] = {'$search' : q}
-    if software: query['software.id'] = software
-    if owner_type: query['owner_type'] = owner_type
-    if catalog_type: query['catalog_type'] = catalog_type
-    if owner_country: query['owner.location.country'] = {'$in': owner_country}
-    if coverage_country: query['coverage.location.country'] = {'$in': coverage_country}
-    total = await db['catalogs'].count_documents(query)
-    items = await db["catalogs"].find(query, {'uid' : 1, 'name' : 1, 'link' : 1}).skip(offset).limit(limit).to_list(limit)
+    facets = check_facets(facets)
+    projection = model_projection(DataCatalogSearchItem)
+    check_cursor(query, cursor)
+    text = '$text' in query
+    collection = await store.catalogs.collection()
+    if cursor:
+        cursor_query = keyset_query(query, cursor, 'uid')
+        found = collection.find(cursor_query, projection).sort(keyset_sort('uid')).limit(limit + 1)
+    elif text:
+        found = collection.find(query, projection).sort(text_sort()).skip(offset).limit(limit + 1)
+    else:
+        found = collection.find(query, projection).sort(keyset_sort('uid')).skip(offset).limit(limit + 1)
+    (num_total, relation), items, facet_counts = await asyncio.gather(
+        count_total(collection, query, total),
+        found.to_list(limit + 1),
+        catalog_facets(collection, query, facets),
+    )
     if items is None or len(items) == 0:
         raise HTTPException(404, detail="No such data catalog!")
     log.info(str(query), action="catalogsearch", search_query=query)
-    response.headers.update(settings.CACHE_HEADERS)
-    meta = {'offset' : offset, 'limit' : limit, 'num' : len(items), 'total': total}
-    response = {'meta' : meta, 'data' : items} 
-    return response
+    # One more item than asked for was fetched, it tells if there is a next page:
+    items, next_cursor = page_items(items, limit, 'uid')
+    if text:
+        next_cursor = None
+    # No Last-Modified on pages: the newest item's date stays the same when
+    # an item is deleted, so pages are validated by ETag only.
+    strip_store_fields(items)
+    meta = {'offset' : None if cursor else offset, 'limit' : limit, 'num' : len(items), 'total': num_total, 'total_relation': relation, 'next_cursor': next_cursor}
+    response = {'meta' : meta, 'data' : items, 'facets' : facet_counts if facets else None}
+    return render(request, DataCatalogSearchResponse, response, headers=settings.CACHE_HEADERS)
+
 
+@router.get(
+    "/registry/export",
+    tags=["Data catalogs registry"],
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"application/x-ndjson": {}}, "description": "One data catalog per line"},
+        400: {"model": ErrorResponse, "description": "Invalid parameters"},
+        500: {"model": ErrorResponse, "description": "Server error"},
+    },
+)
+async def export_datacatalogs(
+    query: Dict[str, Any] = Depends(catalog_filters),
+    after: str = Query(None, title="Resume after the catalog with this `_id`, the last one received"),
+    batch_size: int = Query(settings.EXPORT_BATCH_SIZE, title="Catalogs fetched and sent per chunk", ge=1, le=settings.EXPORT_MAX_BATCH_SIZE),
+    gzip: bool = Query(False, title="Send the export as a gzip file"),
+    store: Store = Depends(get_store),
+) -> StreamingResponse:
+    """Bulk export of all registry items matching the search filters as
+    newline-delimited JSON, in `_id` order. Every line carries its `_id`: pass
+    the last one received as `after` to resume an interrupted download.
+
+    Intro: [data catalog records](https://commondata.io/docs/datacatalog).
+    """
+    if after:
+        query = after_id_query(query, parse_object_id(after))
+    log.info(str(query), action="catalogexport", search_query=query)
+    projection = model_projection(DataCatalogResponse)
+    collection = await store.catalogs.collection()
+    documents = collection.find(query, projection, batch_size=batch_size).sort(keyset_sort())
+    return ndjson_response(documents, batch_size, "catalogs.ndjson", compress=gzip)
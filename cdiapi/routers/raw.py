@@ -1,18 +1,116 @@
-from typing import List, Optional, Union
-from fastapi import APIRouter, Path, Query, Response, HTTPException
-from fastapi.responses import RedirectResponse
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+from fastapi import APIRouter, Depends, Path, Query, Request, Response, HTTPException
+from fastapi.responses import RedirectResponse, StreamingResponse
+from pydantic import BaseModel
 
 from cdiapi import settings
 from cdiapi.logs import get_logger
-from cdiapi.data.common import ErrorResponse
+from cdiapi.data.common import ErrorResponse, BatchRequest, SearchIndexBatchResponse
 from cdiapi.data.common import SearchIndexEntryResponse, SearchIndexSearchResponse
-import motor.motor_asyncio
+from cdiapi.data.common import EntryView, SearchIndexEntryPartial
+from cdiapi.data.common import SearchIndexPartialSearchResponse, SearchIndexSummarySearchResponse
+from cdiapi.data.common import SearchIndexPartialRefSearchResponse, SearchIndexRefSearchResponse
+from cdiapi.data.common import SearchIndexSummaryRefSearchResponse, SourceShape
+from cdiapi.data.search import SearchIndexEntryRef, SearchIndexEntrySummary
+from cdiapi.data.projection import field_projection, model_projection, store_projection
+from cdiapi.cache import entry_cache
+from cdiapi.responses import CachedBody, conditional_response, encode, render
+from cdiapi.responses import batch_response, ndjson_response, strip_store_fields
+from cdiapi.pagination import TotalMode, count_total
+from cdiapi.pagination import check_cursor, keyset_query, keyset_sort, page_items, text_sort
+from cdiapi.pagination import after_id_query, parse_object_id
+from cdiapi.db import Store, get_store
+from cdiapi.sources import source_registry
 log = get_logger(__name__)
 router = APIRouter()
 
 
-client = motor.motor_asyncio.AsyncIOMotorClient("mongodb://localhost:27017")
-db = client.cdisearch
+FIELDS_TITLE = "Return only these fields, e.g. 'dataset.title,dataset.url,source.uid'"
+VIEW_TITLE = "Response shape: 'full' entry or 'summary' with id, title, url and source uid"
+SOURCE_TITLE = "Source catalogs: 'full' in every entry or 'ref' with only the uid, and each catalog once in 'sources'"
+
+
+def entry_filters(
+    q: str = Query("", title="Query text"),
+    software: str = Query(None, title="Software identifier"),
+    owner_type: str = Query(None, title="Owner type"),
+    catalog_type: str = Query(None, title="Owner type"),
+    topics: List[str] = Query([], title="EU Data themes"),
+    geotopics: List[str] = Query([], title="Geo topics"),
+    countries: List[str] = Query([], title="Country of the owner"),
+    langs: List[str] = Query([], title="Spoken languages"),
+    tags: List[str] = Query([], title="Tags"),
+) -> Dict[str, Any]:
+    """MongoDB filter built from the search index query parameters."""
+    query: Dict[str, Any] = {}
+    if q: query['$text'] = {'$search' : q}
+    if software: query['source.software.id'] = software
+    if owner_type: query['source.owner_type'] = owner_type
+    if catalog_type: query['source.catalog_type'] = catalog_type
+    if countries: query['source.countries'] = {'$in': countries}
+    if langs: query['source.langs.id'] = {'$in': langs}
+    if tags: query['dataset.tags'] = {'$in': tags}
+    if topics: query['dataset.topics'] = {'$in': topics}
+    if geotopics: query['dataset.geotopics'] = {'$in': geotopics}
+    return query
+
+
+def entry_shape(
+    view: EntryView, fields: List[str], source: SourceShape = SourceShape.full
+) -> Tuple[Dict[str, int], Type[BaseModel], Type[BaseModel]]:
+    """MongoDB projection, entry model and page model for the requested
+    response shape."""
+    ref = source == SourceShape.ref
+    if fields:
+        try:
+            projection = field_projection(SearchIndexEntryResponse, ['id'] + fields)
+        except ValueError as exc:
+            raise HTTPException(400, detail=str(exc))
+        if ref:
+            projection = {k: v for k, v in projection.items() if k.split('.')[0] != 'source'}
+            projection['source.uid'] = 1
+            return store_projection(projection), SearchIndexEntryPartial, SearchIndexPartialRefSearchResponse
+        return store_projection(projection), SearchIndexEntryPartial, SearchIndexPartialSearchResponse
+    if view == EntryView.summary:
+        projection = store_projection(model_projection(SearchIndexEntrySummary))
+        page_model = SearchIndexSummaryRefSearchResponse if ref else SearchIndexSummarySearchResponse
+        return projection, SearchIndexEntrySummary, page_model
+    if ref:
+        projection = store_projection(model_projection(SearchIndexEntryRef))
+        return projection, SearchIndexEntryRef, SearchIndexRefSearchResponse
+    projection = store_projection(model_projection(SearchIndexEntryResponse))
+    return projection, SearchIndexEntryResponse, SearchIndexSearchResponse
+
+
+def _entry_body(item: Dict[str, Any]) -> CachedBody:
+    last_modified = strip_store_fields([item])
+    return CachedBody(encode(SearchIndexEntryResponse, item), last_modified=last_modified)
+
+
+async def fetch_entry_body(store: Store, entry_id: str) -> Optional[CachedBody]:
+    """Serialized full entry, served from the in-memory cache when possible."""
+    # Resolved before the cache is read, a swapped generation empties it:
+    collection = await store.entries.collection()
+
+    async def load() -> Optional[CachedBody]:
+        projection = store_projection(model_projection(SearchIndexEntryResponse))
+        item = await collection.find_one({'id' : entry_id}, projection)
+        return None if item is None else _entry_body(item)
+
+    return await entry_cache.get_or_load(entry_id, load)
+
+
+async def fetch_entry_bodies(store: Store, entry_ids: List[str]) -> Dict[str, CachedBody]:
+    """Serialized full entries by id, only the ones not cached are queried."""
+    collection = await store.entries.collection()
+
+    async def load(missing: List[str]) -> Dict[str, CachedBody]:
+        projection = store_projection(model_projection(SearchIndexEntryResponse))
+        items = await collection.find({'id' : {'$in' : missing}}, projection).to_list(None)
+        return {item['id']: _entry_body(item) for item in items}
+
+    return await entry_cache.get_or_load_many(entry_ids, load)
 
 
 @router.get(
@@ -25,21 +123,51 @@ db = client.cdisearch
     },
 )
 async def fetch_entry(    
-    response: Response,
+    request: Request,
     entry_id: str = Path(
         description="Search index single entry", examples=["c4a88574-7a2a-4048-bc9f-07de0559e7b7"]
     ),
-) -> Union[RedirectResponse, SearchIndexEntryResponse]:
+    fields: List[str] = Query([], title=FIELDS_TITLE),
+    view: EntryView = Query(EntryView.full, title=VIEW_TITLE),
+    store: Store = Depends(get_store),
+) -> Union[RedirectResponse, Response, SearchIndexEntryResponse]:
     """Retrieve a single dataset
     """
-    item = await db["fulldb"].find_one({'id' : entry_id})
+    if not fields and view == EntryView.full:
+        cached = await fetch_entry_body(store, entry_id)
+        if cached is None:
+            raise HTTPException(404, detail="No such entry!")
+        return conditional_response(request, cached, headers=settings.CACHE_HEADERS)
+    projection, entry_model, _ = entry_shape(view, fields)
+    collection = await store.entries.collection()
+    item = await collection.find_one({'id' : entry_id}, projection)
     if item is None:
         raise HTTPException(404, detail="No such entry!")
 #    log.info(item['name'], action="searchentry", entry_id=entry_id)
-    response.headers.update(settings.CACHE_HEADERS)
-    return item
+    last_modified = strip_store_fields([item])
+    return render(request, entry_model, item, exclude_unset=bool(fields), last_modified=last_modified, headers=settings.CACHE_HEADERS)
+
 
 
+@router.post(
+    "/raw/0.1/entries/batch",
+    tags=["Search index data access"],
+    response_model=SearchIndexBatchResponse,
+    responses={
+        500: {"model": ErrorResponse, "description": "Server error"},
+    },
+)
+async def fetch_entries_batch(
+    batch: BatchRequest,
+    store: Store = Depends(get_store),
+) -> Union[Response, SearchIndexBatchResponse]:
+    """Retrieve many datasets by id in one request. Entries are returned in the
+    order of the request, ids that don't exist are listed in `missing`.
+    """
+    ids = list(dict.fromkeys(batch.ids))
+    found = await fetch_entry_bodies(store, ids)
+    return batch_response(ids, found)
+
 
 @router.get(
     "/raw/0.1/search",
@@ -51,40 +179,81 @@ async def fetch_entry(
     },
 )
 async def search_entries(
-    response: Response,
-    q: str = Query("", title="Query text"),
-    limit: int = Query(10, title="Number of results to return", le=settings.MAX_PAGE),
+    request: Request,
+    limit: int = Query(10, title="Number of results to return", ge=1, le=settings.MAX_PAGE),
     offset: int = Query(
-        0, title="Start at result with given offset", le=settings.MAX_OFFSET
+        0, title="Start at result with given offset", ge=0, le=settings.MAX_OFFSET
     ),
-    software: str = Query(None, title="Software identifier"),
-    owner_type: str = Query(None, title="Owner type"),
-    catalog_type: str = Query(None, title="Owner type"),
-    topics: List[str] = Query([], title="EU Data themes"),
-    geotopics: List[str] = Query([], title="Geo topics"),
-    countries: List[str] = Query([], title="Country of the owner"),
-    langs: List[str] = Query([], title="Spoken languages"),
-    tags: List[str] = Query([], title="Tags"),
-) -> Union[RedirectResponse, SearchIndexSearchResponse]:
+    cursor: str = Query(None, title="Continue after the page that returned this `next_cursor`, replaces offset"),
+    total: TotalMode = Query(TotalMode.exact, title="How to count matches: exact, estimate or none"),
+    query: Dict[str, Any] = Depends(entry_filters),
+    fields: List[str] = Query([], title=FIELDS_TITLE),
+    view: EntryView = Query(EntryView.full, title=VIEW_TITLE),
+    source: SourceShape = Query(SourceShape.full, title=SOURCE_TITLE),
+    store: Store = Depends(get_store),
+) -> Union[RedirectResponse, Response, SearchIndexSearchResponse]:
     """Dataset search).
     """
-    query = {}
-    if q: query['$text'] = {'$search' : q}
-    if software: query['source.software.id'] = software
-    if owner_type: query['source.owner_type'] = owner_type
-    if catalog_type: query['source.catalog_type'] = catalog_type
-    if countries: query['source.countries'] = {'$in': countries}
-    if langs: query['source.langs.id'] = {'$in': langs}
-    if tags: query['dataset.tags'] = {'$in': tags}
-    if topics: query['dataset.topics'] = {'$in': topics}
-    if geotopics: query['dataset.geotopics'] = {'$in': geotopics}
-    total = await db['fulldb'].count_documents(query)
-    items = await db["fulldb"].find(query, {}).skip(offset).limit(limit).to_list(limit)
+    projection, _, page_model = entry_shape(view, fields, source)
+    check_cursor(query, cursor)
+    text = '$text' in query
+    collection = await store.entries.collection()
+    if cursor:
+        cursor_query = keyset_query(query, cursor)
+        found = collection.find(cursor_query, projection).sort(keyset_sort()).limit(limit + 1)
+    elif text:
+        found = collection.find(query, projection).sort(text_sort()).skip(offset).limit(limit + 1)
+    else:
+        found = collection.find(query, projection).sort(keyset_sort()).skip(offset).limit(limit + 1)
+    (num_total, relation), items = await asyncio.gather(
+        count_total(collection, query, total), found.to_list(limit + 1)
+    )
     if items is None or len(items) == 0:
         raise HTTPException(404, detail="Nothing found")
     log.info(str(query), action="catalogsearch", search_query=query)
-    response.headers.update(settings.CACHE_HEADERS)
-    meta = {'offset' : offset, 'limit' : limit, 'num' : len(items), 'total': total}
+    # One more item than asked for was fetched, it tells if there is a next page:
+    items, next_cursor = page_items(items, limit)
+    if text:
+        next_cursor = None
+    # No Last-Modified on pages: the newest item's date stays the same when
+    # an item is deleted, so pages are validated by ETag only.
+    strip_store_fields(items)
+    meta = {'offset' : None if cursor else offset, 'limit' : limit, 'num' : len(items), 'total': num_total, 'total_relation': relation, 'next_cursor': next_cursor}
     response = {'meta' : meta, 'data' : items} 
-    return response
+    if source == SourceShape.ref:
+        catalogs = await store.catalogs.collection()
+        uids = [item['source']['uid'] for item in items if 'uid' in item.get('source', {})]
+        response['sources'] = await source_registry.resolve(catalogs, uids)
+    return render(request, page_model, response, exclude_unset=bool(fields), headers=settings.CACHE_HEADERS)
 
+
+@router.get(
+    "/raw/0.1/export",
+    tags=["Search index data access"],
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"application/x-ndjson": {}}, "description": "One search index entry per line"},
+        400: {"model": ErrorResponse, "description": "Invalid parameters"},
+        500: {"model": ErrorResponse, "description": "Server error"},
+    },
+)
+async def export_entries(
+    query: Dict[str, Any] = Depends(entry_filters),
+    after: str = Query(None, title="Resume after the entry with this `_id`, the last one received"),
+    batch_size: int = Query(settings.EXPORT_BATCH_SIZE, title="Entries fetched and sent per chunk", ge=1, le=settings.EXPORT_MAX_BATCH_SIZE),
+    gzip: bool = Query(False, title="Send the export as a gzip file"),
+    fields: List[str] = Query([], title=FIELDS_TITLE),
+    view: EntryView = Query(EntryView.full, title=VIEW_TITLE),
+    store: Store = Depends(get_store),
+) -> StreamingResponse:
+    """Bulk export of all entries matching the search filters as newline-delimited
+    JSON, in `_id` order. Every line carries its `_id`: pass the last one received
+    as `after` to resume an interrupted download.
+    """
+    projection, _, _ = entry_shape(view, fields)
+    if after:
+        query = after_id_query(query, parse_object_id(after))
+    log.info(str(query), action="export", search_query=query)
+    collection = await store.entries.collection()
+    documents = collection.find(query, projection, batch_size=batch_size).sort(keyset_sort())
+    return ndjson_response(documents, batch_size, "entries.ndjson", compress=gzip)
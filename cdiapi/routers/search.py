@@ -1,27 +1,53 @@
-from typing import List, Optional, Union
-from fastapi import APIRouter, Path, Query, Response, HTTPException
+from typing import Any, Dict, List, Optional, Union
+from fastapi import APIRouter, Depends, Path, Query, Request, Response, HTTPException
 from fastapi.responses import RedirectResponse
-from fastapi.responses import JSONResponse
-import meilisearch
 
 from cdiapi import settings
 from cdiapi.logs import get_logger
-from cdiapi.data.common import ErrorResponse
+from cdiapi.data.common import ErrorResponse, EntryView
 from cdiapi.data.common import SearchIndexEntryResponse, SearchIndexSearchResponse
-import motor.motor_asyncio
+from cdiapi.data.search import SearchIndexEntrySummary
+from cdiapi.data.projection import field_projection, model_paths
+from cdiapi.db import Store, get_store
+from cdiapi.generations import live_index
+from cdiapi.cache import search_cache
+from cdiapi.meili import MeiliClient, get_meili
+from cdiapi.responses import CachedBody, conditional_response, dump_json, make_etag
+from cdiapi.routers.raw import FIELDS_TITLE, VIEW_TITLE, fetch_entry_body
+from cdiapi.timing import phase
 log = get_logger(__name__)
 router = APIRouter()
 
+FACETS_TITLE = (
+    "Facets to count: 'true' for all, 'false' for none, or a comma separated "
+    "list of: %s" % ", ".join(settings.DEFAULT_FACETS)
+)
+
 
-client = motor.motor_asyncio.AsyncIOMotorClient("mongodb://localhost:27017")
-db = client.cdisearch
+def search_facets(facets: List[str]) -> List[str]:
+    """Facet attributes selected by the `facets` parameter."""
+    names = [n.strip() for value in facets for n in value.split(",") if n.strip()]
+    if names in (["true"], ["all"]):
+        return settings.DEFAULT_FACETS
+    if names in ([], ["false"], ["none"]):
+        return []
+    unknown = [n for n in names if n not in settings.DEFAULT_FACETS]
+    if unknown:
+        raise HTTPException(400, detail="Unknown facets: %s" % ", ".join(unknown))
+    return list(dict.fromkeys(names))
 
-DEFAULT_URL = 'https://localhost:7090'
 
-class MeiliWrapper:
-    def __init__(self, url:str=DEFAULT_URL, key:str=None, index_name:str=None):        
-        self.client = meilisearch.Client(url, key)
-        self.m_index = self.client.index(index_name) if index_name is not None else None
+def search_attributes(view: EntryView, fields: List[str]) -> Optional[List[str]]:
+    """`attributesToRetrieve` for the requested response shape, `None` for
+    all of them. Sorted, they are part of the search cache key."""
+    if fields:
+        try:
+            return sorted(field_projection(SearchIndexEntryResponse, ['id'] + fields))
+        except ValueError as exc:
+            raise HTTPException(400, detail=str(exc))
+    if view == EntryView.summary:
+        return list(model_paths(SearchIndexEntrySummary))
+    return None
 
 
 @router.get(
@@ -34,19 +60,19 @@ class MeiliWrapper:
     },
 )
 async def fetch_entry(    
-    response: Response,
+    request: Request,
     entry_id: str = Path(
         description="Search index single entry", examples=["c4a88574-7a2a-4048-bc9f-07de0559e7b7"]
     ),
-) -> Union[RedirectResponse, SearchIndexEntryResponse]:
+    store: Store = Depends(get_store),
+) -> Union[RedirectResponse, Response, SearchIndexEntryResponse]:
     """Retrieve a single dataset
     """
-    item = await db["fulldb"].find_one({'id' : entry_id})
-    if item is None:
+    cached = await fetch_entry_body(store, entry_id)
+    if cached is None:
         raise HTTPException(404, detail="No such entry!")
 #    log.info(item['name'], action="searchentry", entry_id=entry_id)
-    response.headers.update(settings.CACHE_HEADERS)
-    return item
+    return conditional_response(request, cached, headers=settings.CACHE_HEADERS)
 
 
 
@@ -62,26 +88,69 @@ async def fetch_entry(
 
 
 async def search_entries(
-    response: Response,
+    request: Request,
     q: str = Query("", title="Query text, for example: 'Atlantic salmon'"),
     filters: List[str] = Query([], title="Filters by vacets value. Should be like \"source.catalog_type\"=\"Geoportal\" "),
-    limit: int = Query(1000, title="Number of results to return", le=settings.MAX_PAGE),
-    offset: int = Query(
-        0, title="Start at result with given offset", le=settings.MAX_OFFSET
+    limit: int = Query(20, title="Number of results to return, 0 to return only the facets", ge=0, le=settings.MAX_PAGE),
+    offset: Optional[int] = Query(
+        None, title="Start at result with given offset, replaces page", ge=0, le=settings.MAX_OFFSET
     ),
-    page: int = Query(
-        1, title="Page number"
+    page: Optional[int] = Query(
+        None, title="Page number, pages have `limit` results", ge=1
     ),
-    facets:bool = Query(True, title="Enable/Disable facets output"),
-    sort_by:str=Query(settings.DEFAULT_SORT, title="Sort by fields, default 'scores.feature_score:desc'. Use single field or list of fields divided by comma. Supported fields: 'scores.feature_score', 'dataset.title', 'source.uid'")    
-) -> Union[RedirectResponse, JSONResponse]:
+    facets: List[str] = Query(["true"], title=FACETS_TITLE),
+    fields: List[str] = Query([], title=FIELDS_TITLE),
+    view: EntryView = Query(EntryView.full, title=VIEW_TITLE),
+    crop_length: Optional[int] = Query(None, title="Crop the description to this many words, returned in `_formatted`", ge=1),
+    sort_by:str=Query(settings.DEFAULT_SORT, title="Sort by fields, default 'scores.feature_score:desc'. Use single field or list of fields divided by comma. Supported fields: 'scores.feature_score', 'dataset.title', 'source.uid'"),
+    meili: MeiliClient = Depends(get_meili),
+    store: Store = Depends(get_store),
+) -> Union[RedirectResponse, Response]:
     """Dataset search).
-    """    
-    wrapper = MeiliWrapper(settings.MEILI_URL, settings.MEILI_KEY, index_name=settings.MEILI_INDEX)
-    params = {'offset' : offset, 'limit' : limit, 'filter' : filters, 
-                'hitsPerPage' : 20, 'sort' : sort_by.split(','), 'page' : page}
-    if facets:
-        params['facets'] = settings.DEFAULT_FACETS
-    results = wrapper.m_index.search(q, params)
-    return JSONResponse(results)
+
+    Results are paged by `page` and `limit` (exact `totalHits` and
+    `totalPages`), or by `offset` and `limit` (cheaper, with
+    `estimatedTotalHits`), not both.
+    """
+    if offset is not None and page is not None:
+        raise HTTPException(400, detail="Use either page or offset")
+    q = " ".join(q.split())
+    params: Dict[str, Any] = {'filter' : filters, 'sort' : sort_by.split(',')}
+    if offset is not None:
+        params.update({'offset' : offset, 'limit' : limit})
+    else:
+        params.update({'page' : page or 1, 'hitsPerPage' : limit})
+    selected = search_facets(facets)
+    if selected:
+        params['facets'] = selected
+    attributes = search_attributes(view, fields)
+    if crop_length is not None:
+        params['attributesToCrop'] = settings.SEARCH_CROP_ATTRIBUTES
+        params['cropLength'] = crop_length
+        # Meilisearch only formats the attributes it retrieves:
+        if attributes is not None:
+            attributes += [
+                a for a in settings.SEARCH_CROP_ATTRIBUTES
+                if not any(a == s or a.startswith(s + ".") for s in attributes)
+            ]
+    if attributes is not None:
+        params['attributesToRetrieve'] = attributes
+
+    async def load() -> CachedBody:
+        results = await meili.search(q, params)
+        # The timing differs on every call, keep it out of the validator:
+        content = {k: v for k, v in results.items() if k != 'processingTimeMs'}
+        with phase("encode"):
+            cached = CachedBody(dump_json(results), etag=make_etag(dump_json(content)))
+        return cached.precompress()
+
+    async def epoch() -> str:
+        return await live_index(store.search, meili.index_name)
+
+    await search_cache.refresh_epoch(epoch)
+    # Filters are combined with AND and facets are counted independently,
+    # their order doesn't change the result:
+    key = dict(params, q=q, filter=sorted(filters), facets=sorted(params.get('facets', [])))
+    cached = await search_cache.get_or_load(key, load)
+    return conditional_response(request, cached)
 
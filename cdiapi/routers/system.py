@@ -0,0 +1,62 @@
+from typing import Any, Dict, Optional
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from cdiapi.logs import get_logger
+from cdiapi.cache import RESPONSE_CACHES
+from cdiapi.data.common import CacheStatsResponse, ReadinessResponse
+from cdiapi.metrics import render_metrics
+log = get_logger(__name__)
+router = APIRouter()
+
+
+@router.get(
+    "/healthz",
+    tags=["System information"],
+)
+async def healthz() -> Dict[str, str]:
+    """Liveness: the worker process answers requests."""
+    return {"status": "ok"}
+
+
+@router.get(
+    "/readyz",
+    tags=["System information"],
+    response_model=ReadinessResponse,
+    responses={503: {"model": ReadinessResponse, "description": "Still warming up"}},
+)
+async def readyz(request: Request) -> Any:
+    """Readiness: the worker has built its schemas, connected to MongoDB and
+    Meilisearch and loaded the registry snapshot. Otherwise 503, with the
+    steps that are pending or failed.
+    """
+    warmup = request.app.state.warmup
+    content = {"status": "ready" if warmup.ready else "starting", "checks": warmup.checks}
+    return JSONResponse(content, status_code=200 if warmup.ready else 503)
+
+
+@router.get(
+    "/system/caches",
+    tags=["System information"],
+    response_model=CacheStatsResponse,
+)
+async def cache_stats() -> Dict[str, Dict[str, Optional[int]]]:
+    """Size and hit/miss counters of the response caches of the worker
+    process that answers the request. The size of a shared cache is null.
+    """
+    return {cache.name: cache.stats() for cache in RESPONSE_CACHES}
+
+
+@router.get(
+    "/metrics",
+    tags=["System information"],
+    response_class=Response,
+    responses={200: {"content": {CONTENT_TYPE_LATEST: {}}}},
+)
+async def metrics() -> Response:
+    """Request latencies by route, MongoDB and Meilisearch call timings,
+    connection pool, in-flight request and cache counters in the Prometheus
+    text format, summed over all worker processes.
+    """
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -1,3 +1,4 @@
+import os
 import logging
 from pathlib import Path
 from typing import Any, Dict, List, Optional
@@ -5,7 +6,6 @@ from banal import as_bool
 from os import environ as env
 from normality import stringify
 from datetime import datetime
-from aiocron import Cron  # type: ignore
 
 
 def env_str(name: str, default: Optional[str] = None) -> Optional[str]:
@@ -75,27 +75,183 @@ MANIFEST_DEFAULT_PATH = Path(__file__).parent.parent / "manifests/default.yml"
 MANIFEST = env_str("CDIAPI_MANIFEST") or str(MANIFEST_DEFAULT_PATH)
 
 DATA_PATH = Path(env_str("CDIAPI_DATA_PATH") or "/tmp")
+
+# MongoDB holding the registry of data catalogs and the raw search index:
+MONGO_URI = env_str("CDIAPI_MONGO_URI") or "mongodb://localhost:27017"
+REGISTRY_DB = env_str("CDIAPI_REGISTRY_DB") or "cdi"
+SEARCH_DB = env_str("CDIAPI_SEARCH_DB") or "cdisearch"
+# Connections kept by each process, and timeouts in seconds:
+MONGO_MAX_POOL_SIZE = int(env_str("CDIAPI_MONGO_MAX_POOL_SIZE") or "100")
+MONGO_MIN_POOL_SIZE = int(env_str("CDIAPI_MONGO_MIN_POOL_SIZE") or "0")
+MONGO_SERVER_SELECTION_TIMEOUT = float(env_str("CDIAPI_MONGO_SERVER_SELECTION_TIMEOUT") or "5")
+MONGO_CONNECT_TIMEOUT = float(env_str("CDIAPI_MONGO_CONNECT_TIMEOUT") or "5")
+MONGO_SOCKET_TIMEOUT = float(env_str("CDIAPI_MONGO_SOCKET_TIMEOUT") or "30")
+# Where the API reads from in a replica set, "secondaryPreferred" or "nearest"
+# spread the reads over the secondaries:
+MONGO_READ_PREFERENCE = env_str("CDIAPI_MONGO_READ_PREFERENCE") or "primary"
+
+# Processes parsing and validating source files in `registry-update`:
+LOADER_WORKERS = int(env_str("CDIAPI_LOADER_WORKERS") or str(os.cpu_count() or 1))
+# Records per upsert batch written by `registry-update`:
+LOADER_BATCH_SIZE = int(env_str("CDIAPI_LOADER_BATCH_SIZE") or "1000")
+# `registry-update --rebuild` loads into a new collection generation and only
+# swaps it in if it has at most this share of invalid records and at least
+# this share of the records of the live generation:
+GENERATION_MAX_INVALID = float(env_str("CDIAPI_GENERATION_MAX_INVALID") or "0.05")
+GENERATION_MIN_RATIO = float(env_str("CDIAPI_GENERATION_MIN_RATIO") or "0.9")
+# Generations kept after a swap, the live one included, to allow a rollback:
+GENERATIONS_KEEP = int(env_str("CDIAPI_GENERATIONS_KEEP") or "2")
+# Seconds between checks of which generation is live:
+GENERATION_REFRESH = float(env_str("CDIAPI_GENERATION_REFRESH") or "10")
+# Seconds between retries of the warm-up steps that failed when a worker
+# started, /readyz answers 503 until all of them passed:
+WARMUP_RETRY = float(env_str("CDIAPI_WARMUP_RETRY") or "5")
 RESOURCES_PATH = Path(__file__).parent.joinpath("resources")
 
 PORT = int(env_str("CDIAPI_PORT") or env_str("PORT") or "8000")
+
+# `serve` runs a single process unless more workers are configured, 0 starts
+# one per CPU:
+WORKERS = int(env_str("CDIAPI_WORKERS") or "1")
+# Pending connections the listening socket queues up:
+BACKLOG = int(env_str("CDIAPI_BACKLOG") or "2048")
+# Seconds an idle keep-alive connection stays open:
+KEEPALIVE = int(env_str("CDIAPI_KEEPALIVE") or "5")
+# Restart a worker after this many requests, plus up to the jitter so they
+# don't all restart at once (0 disables):
+MAX_REQUESTS = int(env_str("CDIAPI_MAX_REQUESTS") or "10000")
+MAX_REQUESTS_JITTER = int(env_str("CDIAPI_MAX_REQUESTS_JITTER") or "1000")
+# Seconds a worker gets to finish its requests on restart or shutdown:
+GRACEFUL_TIMEOUT = int(env_str("CDIAPI_GRACEFUL_TIMEOUT") or "30")
+# Workers that don't report back for this many seconds are killed:
+WORKER_TIMEOUT = int(env_str("CDIAPI_WORKER_TIMEOUT") or "60")
+# Requests per second and burst size allowed per client IP, by route class
+# (search, export, batch and default), as `class=rate/burst`. Classes not
+# listed aren't limited, `off` disables the limits:
+RATE_LIMITS = env_str("CDIAPI_RATE_LIMITS", "default=50/100,search=10/30,batch=5/10,export=0.5/3")
+# Pages of more results than this count as several requests:
+RATE_LIMIT_PAGE_SIZE = int(env_str("CDIAPI_RATE_LIMIT_PAGE_SIZE") or "100")
+# Clients tracked per worker, or share the limits between workers in Redis:
+RATE_LIMIT_CLIENTS = int(env_str("CDIAPI_RATE_LIMIT_CLIENTS") or "100000")
+RATE_LIMIT_URL = env_str("CDIAPI_RATE_LIMIT_URL")
+# Requests answered at once by a worker, more get a 503 (0 disables):
+MAX_IN_FLIGHT = int(env_str("CDIAPI_MAX_IN_FLIGHT") or "256")
+# Target latencies in seconds of MongoDB commands and Meilisearch calls, on a
+# moving average. Above them, a growing share of searches, exports and
+# batches (at most SHED_MAX_RATE) gets a 503 (0 disables):
+SHED_MONGO_LATENCY = float(env_str("CDIAPI_SHED_MONGO_LATENCY") or "0.5")
+SHED_MEILI_LATENCY = float(env_str("CDIAPI_SHED_MEILI_LATENCY") or "1.0")
+SHED_MAX_RATE = float(env_str("CDIAPI_SHED_MAX_RATE") or "0.9")
+# Seconds after which a latency average without new calls is forgotten:
+SHED_WINDOW = float(env_str("CDIAPI_SHED_WINDOW") or "10")
+# Retry-After of 503 responses, in seconds:
+RETRY_AFTER = int(env_str("CDIAPI_RETRY_AFTER") or "1")
+# Proxies trusted to set X-Forwarded-For and X-Forwarded-Proto:
+FORWARDED_ALLOW_IPS = env_str("FORWARDED_ALLOW_IPS") or "127.0.0.1,::1"
 # How many results to return per page of search results max:
 MAX_PAGE = 500
 
 MAX_OFFSET = 100000
 
+# How many ids can be looked up by a single batch request:
+MAX_BATCH = 500
+
+# Documents fetched from MongoDB and written per chunk of a bulk export:
+EXPORT_BATCH_SIZE = int(env_str("CDIAPI_EXPORT_BATCH_SIZE") or "1000")
+EXPORT_MAX_BATCH_SIZE = 10000
+
+# Exact search totals are cached per normalized filter:
+COUNT_CACHE_SIZE = int(env_str("CDIAPI_COUNT_CACHE_SIZE") or "10000")
+COUNT_CACHE_TTL = int(env_str("CDIAPI_COUNT_CACHE_TTL") or "600")
+# Serialized single catalog and entry responses kept in memory by each worker:
+CATALOG_CACHE_SIZE = int(env_str("CDIAPI_CATALOG_CACHE_SIZE") or "10000")
+CATALOG_CACHE_TTL = int(env_str("CDIAPI_CATALOG_CACHE_TTL") or "3600")
+ENTRY_CACHE_SIZE = int(env_str("CDIAPI_ENTRY_CACHE_SIZE") or "20000")
+ENTRY_CACHE_TTL = int(env_str("CDIAPI_ENTRY_CACHE_TTL") or "3600")
+# Encoded /index/0.1/query responses, fresh for SEARCH_CACHE_TTL seconds and
+# then served for up to SEARCH_CACHE_STALE more while they are refreshed. A
+# redis:// URL shares them between workers, otherwise each worker keeps its
+# own. The cache is emptied when a full search sync swaps in a new index,
+# which is checked every SEARCH_CACHE_EPOCH_REFRESH seconds. Documents changed
+# by an incremental sync show up once the cached responses expire:
+SEARCH_CACHE_SIZE = int(env_str("CDIAPI_SEARCH_CACHE_SIZE") or "2000")
+SEARCH_CACHE_TTL = float(env_str("CDIAPI_SEARCH_CACHE_TTL") or "60")
+SEARCH_CACHE_STALE = float(env_str("CDIAPI_SEARCH_CACHE_STALE") or "300")
+SEARCH_CACHE_URL = env_str("CDIAPI_SEARCH_CACHE_URL")
+SEARCH_CACHE_EPOCH_REFRESH = float(env_str("CDIAPI_SEARCH_CACHE_EPOCH_REFRESH") or "10")
+# Values returned per facet of the registry search:
+FACET_SIZE = int(env_str("CDIAPI_FACET_SIZE") or "100")
+# Seconds between reloads of the source catalogs sent with `source=ref`:
+SOURCE_REGISTRY_REFRESH = float(env_str("CDIAPI_SOURCE_REGISTRY_REFRESH") or "300")
+# Seconds a catalog uid not found in the registry isn't looked up again:
+SOURCE_REGISTRY_MISSING_TTL = float(env_str("CDIAPI_SOURCE_REGISTRY_MISSING_TTL") or "60")
+# With total=estimate, stop counting filtered results at this number:
+COUNT_ESTIMATE_LIMIT = int(env_str("CDIAPI_COUNT_ESTIMATE_LIMIT") or "10000")
+
 # Meilisearch settings:
-MEILI_URL = env_str("CDIAPI_MEILISEARCH_URL", "http://ms15.dateno.io:7090")
+MEILI_URL = env_str("CDIAPI_MEILISEARCH_URL") or "http://ms15.dateno.io:7090"
 MEILI_KEY = env_str("CDIAPI_MEILISEARCH_KEY", '')
-MEILI_INDEX = env_str("CDIAPI_MEILISEARCH_INDEX", 'fulldb')
+MEILI_INDEX = env_str("CDIAPI_MEILISEARCH_INDEX") or 'fulldb'
+# Seconds to wait for a single Meilisearch call:
+MEILI_TIMEOUT = float(env_str("CDIAPI_MEILISEARCH_TIMEOUT") or "10")
+# Keep-alive connections held open to Meilisearch by each worker:
+MEILI_MAX_CONNECTIONS = int(env_str("CDIAPI_MEILISEARCH_MAX_CONNECTIONS") or "32")
+# Searches allowed in flight at once, further calls wait for a free slot:
+MEILI_MAX_CONCURRENCY = int(env_str("CDIAPI_MEILISEARCH_MAX_CONCURRENCY") or "64")
 
 DEFAULT_FACETS = ["dataset.datatypes","dataset.formats","dataset.geotopics","dataset.license_id","dataset.topics","source.catalog_type","source.countries.name","source.langs.name","source.macroregions.name","source.name","source.owner_type","source.software.name","source.subregions.name"]
 DEFAULT_SORT = "scores.feature_score:desc"
+# `search-sync` pushes entries to Meilisearch in batches of at most this many
+# documents or bytes, with up to SEARCH_SYNC_MAX_TASKS batches enqueued at a
+# time. Following changes, they are pushed every SEARCH_SYNC_INTERVAL seconds:
+SEARCH_SYNC_BATCH_SIZE = int(env_str("CDIAPI_SEARCH_SYNC_BATCH_SIZE") or "5000")
+SEARCH_SYNC_BATCH_BYTES = int(env_str("CDIAPI_SEARCH_SYNC_BATCH_BYTES") or "20000000")
+SEARCH_SYNC_MAX_TASKS = int(env_str("CDIAPI_SEARCH_SYNC_MAX_TASKS") or "4")
+SEARCH_SYNC_TASK_TIMEOUT = float(env_str("CDIAPI_SEARCH_SYNC_TASK_TIMEOUT") or "3600")
+SEARCH_SYNC_INTERVAL = float(env_str("CDIAPI_SEARCH_SYNC_INTERVAL") or "5")
+# Polling by store timestamp reads again the entries stamped this many seconds
+# before the newest one seen, a loader batch may commit after later ones:
+SEARCH_SYNC_LAG = float(env_str("CDIAPI_SEARCH_SYNC_LAG") or "60")
+# Attributes cropped to `crop_length` words in search results:
+SEARCH_CROP_ATTRIBUTES = ["dataset.description"]
 
 DEFAULT_SORT_BY = {'feature_score' : "scores.feature_score:desc"}
 
+# Validate documents against the response models before sending them,
+# otherwise they are encoded as stored:
+VALIDATE_RESPONSES = as_bool(env_str("CDIAPI_VALIDATE_RESPONSES", "false"))
+
+# Response encodings offered to clients, in order of preference. `br` and
+# `zstd` are used only if the `brotli` and `zstandard` packages are installed:
+COMPRESSION_ENCODINGS = env_str("CDIAPI_COMPRESSION_ENCODINGS") or "zstd,br,gzip"
+# Smaller responses are sent uncompressed:
+COMPRESSION_MIN_SIZE = int(env_str("CDIAPI_COMPRESSION_MIN_SIZE") or "1024")
+# Compression levels, well below the maximum since most bodies are compressed
+# once per request:
+GZIP_LEVEL = int(env_str("CDIAPI_GZIP_LEVEL") or "5")
+BROTLI_LEVEL = int(env_str("CDIAPI_BROTLI_LEVEL") or "4")
+ZSTD_LEVEL = int(env_str("CDIAPI_ZSTD_LEVEL") or "3")
+
+# Report the time spent on each phase of a request in a Server-Timing header:
+SERVER_TIMING = as_bool(env_str("CDIAPI_SERVER_TIMING", "true"))
+# Requests with `?profile=1` and this token in `X-Profile-Token` are profiled,
+# the reports are stored in PROFILE_PATH:
+PROFILE_TOKEN = env_str("CDIAPI_PROFILE_TOKEN")
+PROFILE_PATH = DATA_PATH.joinpath("profiles")
+# Seconds between profiler samples:
+PROFILE_INTERVAL = float(env_str("CDIAPI_PROFILE_INTERVAL") or "0.001")
+
 # Log output can be formatted as JSON:
 LOG_JSON = as_bool(env_str("CDI_LOG_JSON", "true"))
 LOG_LEVEL = logging.DEBUG if DEBUG else logging.INFO
+# Records waiting for the log writer thread, more are dropped:
+LOG_QUEUE_SIZE = int(env_str("CDIAPI_LOG_QUEUE_SIZE") or "10000")
+# Records written to the log stream at once:
+LOG_BATCH_SIZE = int(env_str("CDIAPI_LOG_BATCH_SIZE") or "256")
+# Share of successful requests that are logged. Failed requests and requests
+# slower than LOG_SLOW_REQUEST seconds are always logged:
+LOG_SAMPLE_RATE = float(env_str("CDIAPI_LOG_SAMPLE_RATE") or "1.0")
+LOG_SLOW_REQUEST = float(env_str("CDIAPI_LOG_SLOW_REQUEST") or "1.0")
 
 # Used to pad out first_seen, last_seen on static collections
 RUN_TIME = datetime.utcnow().isoformat()[:19]
@@ -0,0 +1,116 @@
+import time
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from cdiapi import settings
+from cdiapi.cache import TTLCache
+from cdiapi.logs import get_logger
+
+log = get_logger(__name__)
+
+# Catalog fields the source block of a search entry is made of:
+CATALOG_PROJECTION = {
+    "_id": 0,
+    "uid": 1,
+    "name": 1,
+    "link": 1,
+    "catalog_type": 1,
+    "langs": 1,
+    "owner.name": 1,
+    "owner.type": 1,
+    "software": 1,
+    "coverage.location": 1,
+}
+# Unknown catalog uids remembered at most:
+MISSING_MAXSIZE = 10000
+
+
+def _unique(items: Iterable[Any]) -> List[Any]:
+    seen: Dict[Any, Any] = {}
+    for item in items:
+        if item is not None and item.get("id") not in seen:
+            seen[item.get("id")] = item
+    return list(seen.values())
+
+
+def source_record(catalog: Dict[str, Any]) -> Dict[str, Any]:
+    """The `source` block of the search entries of a registry catalog, in
+    the shape of `SearchIndexSourceRecord`."""
+    owner = catalog.get("owner") or {}
+    locations = [item["location"] for item in catalog.get("coverage") or [] if item.get("location")]
+    return {
+        "uid": catalog["uid"],
+        "name": catalog.get("name"),
+        "url": catalog.get("link"),
+        "catalog_type": catalog.get("catalog_type"),
+        "langs": catalog.get("langs") or [],
+        "owner_name": owner.get("name"),
+        "owner_type": owner.get("type"),
+        "software": catalog.get("software"),
+        "countries": _unique(loc.get("country") for loc in locations),
+        "macroregions": _unique(loc.get("macroregion") for loc in locations),
+        "subregions": _unique(loc.get("subregion") for loc in locations),
+    }
+
+
+class SourceRegistry:
+    """In-memory snapshot of the source records of all registry catalogs,
+    used to send each catalog once per page of entries. The first request
+    waits for the snapshot, it is then reloaded in the background every
+    `SOURCE_REGISTRY_REFRESH` seconds while the previous one is served.
+    Catalogs added in the meantime are looked up when they are first asked
+    for, uids that aren't found are not looked up again for
+    `SOURCE_REGISTRY_MISSING_TTL` seconds."""
+
+    def __init__(self) -> None:
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.loaded = False
+        self.expires = 0.0
+        self.lock = asyncio.Lock()
+        self.reload: Optional["asyncio.Task[None]"] = None
+        self.missing = TTLCache(MISSING_MAXSIZE, settings.SOURCE_REGISTRY_MISSING_TTL)
+
+    def expire(self) -> None:
+        self.expires = 0.0
+        self.missing.clear()
+
+    async def _load(self, collection: "AsyncIOMotorCollection[Any]") -> None:
+        records: Dict[str, Dict[str, Any]] = {}
+        async for catalog in collection.find({}, CATALOG_PROJECTION):
+            records[catalog["uid"]] = source_record(catalog)
+        self.records = records
+        self.loaded = True
+        self.expires = time.monotonic() + settings.SOURCE_REGISTRY_REFRESH
+        self.missing.clear()
+        log.info("Loaded %d source catalogs" % len(records), action="sources")
+
+    async def _reload(self, collection: "AsyncIOMotorCollection[Any]") -> None:
+        try:
+            await self._load(collection)
+        except Exception as exc:
+            log.warning("Cannot reload the source catalogs: %s" % exc, action="sources")
+
+    async def resolve(
+        self, collection: "AsyncIOMotorCollection[Any]", uids: Iterable[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Source records of the catalogs `uids`, unknown ones are left out."""
+        if not self.loaded:
+            async with self.lock:
+                if not self.loaded:
+                    await self._load(collection)
+        elif time.monotonic() >= self.expires and (self.reload is None or self.reload.done()):
+            self.reload = asyncio.ensure_future(self._reload(collection))
+        uids = list(dict.fromkeys(uids))
+        missing = [uid for uid in uids if uid not in self.records and not self.missing.get(uid)]
+        if missing:
+            query = {"uid": {"$in": missing}}
+            async for catalog in collection.find(query, CATALOG_PROJECTION):
+                self.records[catalog["uid"]] = source_record(catalog)
+            for uid in missing:
+                if uid not in self.records:
+                    self.missing.set(uid, True)
+        return {uid: self.records[uid] for uid in uids if uid in self.records}
+
+
+source_registry = SourceRegistry()
@@ -0,0 +1,384 @@
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple, cast
+import orjson
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from cdiapi import settings
+from cdiapi.db import create_client
+from cdiapi.logs import get_logger
+from cdiapi.loader import HASH_FIELD
+from cdiapi.meili import MeiliClient
+from cdiapi.data.projection import STORE_TIMESTAMP
+from cdiapi.generations import live_generation, set_live_index
+
+log = get_logger(__name__)
+
+# Progress of the sync per Meilisearch index, in the search database:
+SEARCH_SYNC = "search_sync"
+# Attributes an index created from scratch can be filtered and sorted on:
+SORTABLE_ATTRIBUTES = ["scores.feature_score", "dataset.title", "source.uid"]
+# Change stream events after which the collection has to be synced in full:
+RESYNC_EVENTS = ("drop", "rename", "dropDatabase", "invalidate")
+
+
+class Resync(Exception):
+    """The live generation of the entries changed, start over with a full
+    sync."""
+
+
+def meili_document(doc: Dict[str, Any]) -> bytes:
+    """Encode a stored entry as a Meilisearch document."""
+    doc.pop("_id", None)
+    doc.pop(HASH_FIELD, None)
+    doc.pop(STORE_TIMESTAMP, None)
+    return orjson.dumps(doc, default=str)
+
+
+class Batch:
+    """Encoded documents for one `add_documents` call."""
+
+    def __init__(self) -> None:
+        self.docs: List[bytes] = []
+        self.size = 0
+
+    def add(self, doc: bytes) -> None:
+        self.docs.append(doc)
+        self.size += len(doc) + 1
+
+    def full(self) -> bool:
+        return (
+            len(self.docs) >= settings.SEARCH_SYNC_BATCH_SIZE
+            or self.size >= settings.SEARCH_SYNC_BATCH_BYTES
+        )
+
+    def body(self) -> bytes:
+        return b"[" + b",".join(self.docs) + b"]"
+
+
+class Checkpoint:
+    """Sync progress, saved once the tasks before it have succeeded so that
+    an interrupted sync resumes without losing changes."""
+
+    def __init__(self, db: "AsyncIOMotorDatabase[Any]", index: str) -> None:
+        self.collection = db[SEARCH_SYNC]
+        self.index = index
+
+    async def load(self) -> Dict[str, Any]:
+        return await self.collection.find_one({"_id": self.index}) or {}
+
+    async def save(self, **fields: Any) -> None:
+        fields["synced_at"] = datetime.utcnow()
+        await self.collection.update_one({"_id": self.index}, {"$set": fields}, upsert=True)
+
+    async def reset(self) -> None:
+        await self.collection.delete_one({"_id": self.index})
+
+
+class TaskQueue:
+    """Meilisearch tasks that were enqueued but haven't finished, at most
+    `SEARCH_SYNC_MAX_TASKS`. Meilisearch runs the tasks of an index in order,
+    so the checkpoint of each is saved once it and those before it succeeded."""
+
+    def __init__(self, meili: MeiliClient, checkpoint: Checkpoint) -> None:
+        self.meili = meili
+        self.checkpoint = checkpoint
+        self.tasks: Deque[Tuple[int, Dict[str, Any]]] = deque()
+
+    async def add(self, uid: int, progress: Dict[str, Any]) -> None:
+        self.tasks.append((uid, progress))
+        while len(self.tasks) >= settings.SEARCH_SYNC_MAX_TASKS:
+            await self.wait_oldest()
+
+    async def wait_oldest(self) -> None:
+        uid, progress = self.tasks.popleft()
+        await self.meili.wait_for_task(uid)
+        if progress:
+            await self.checkpoint.save(**progress)
+
+    async def drain(self) -> None:
+        while self.tasks:
+            await self.wait_oldest()
+
+
+async def _shadow_index(meili: MeiliClient, shadow: str) -> None:
+    """Create the index a full sync loads into, with the settings of the live
+    index if there is one."""
+    if await meili.get_index(shadow) is not None:
+        return
+    await meili.wait_for_task(await meili.create_index(shadow))
+    if await meili.get_index() is not None:
+        index_settings = await meili.get_settings()
+    else:
+        index_settings = {
+            "filterableAttributes": settings.DEFAULT_FACETS,
+            "sortableAttributes": SORTABLE_ATTRIBUTES,
+        }
+    await meili.wait_for_task(await meili.update_settings(shadow, index_settings))
+
+
+async def full_sync(
+    collection: "AsyncIOMotorCollection[Any]",
+    meili: MeiliClient,
+    checkpoint: Checkpoint,
+    state: Dict[str, Any],
+    use_changes: bool,
+) -> None:
+    """Load every entry into a new Meilisearch index and swap it with the
+    live one, which then holds exactly the entries of `collection`. Resumes
+    an interrupted load of the same collection."""
+    resume = state.get("full") or {}
+    if resume.get("collection") != collection.name:
+        if resume.get("shadow") and await meili.get_index(resume["shadow"]) is not None:
+            # Left over from an interrupted load of an older generation:
+            await meili.wait_for_task(await meili.delete_index(resume["shadow"]))
+        resume = {
+            "collection": collection.name,
+            "shadow": "%s_%s" % (meili.index_name, datetime.utcnow().strftime("%Y%m%d%H%M%S")),
+            "last_id": None,
+            # Changes made during the load are picked up afterwards:
+            "started_at": datetime.utcnow(),
+            "resume_token": await _resume_token(collection) if use_changes else None,
+        }
+        await checkpoint.save(full=resume)
+    shadow = resume["shadow"]
+    log.info("Loading %s into %s" % (collection.name, shadow), action="searchsync")
+    await _shadow_index(meili, shadow)
+
+    tasks = TaskQueue(meili, checkpoint)
+    query: Dict[str, Any] = {}
+    if resume.get("last_id") is not None:
+        query["_id"] = {"$gt": resume["last_id"]}
+    documents = collection.find(query, batch_size=settings.SEARCH_SYNC_BATCH_SIZE).sort("_id", 1)
+    batch = Batch()
+    pushed = 0
+    last_id: Optional[ObjectId] = None
+    async for doc in documents:
+        last_id = doc["_id"]
+        batch.add(meili_document(doc))
+        if batch.full():
+            uid = await meili.add_documents(batch.body(), index=shadow)
+            pushed += len(batch.docs)
+            await tasks.add(uid, {"full": dict(resume, last_id=last_id)})
+            batch = Batch()
+    if batch.docs:
+        uid = await meili.add_documents(batch.body(), index=shadow)
+        pushed += len(batch.docs)
+        await tasks.add(uid, {"full": dict(resume, last_id=last_id)})
+    await tasks.drain()
+
+    if await meili.get_index() is None:
+        await meili.wait_for_task(await meili.create_index(meili.index_name))
+    await meili.wait_for_task(await meili.swap_indexes(meili.index_name, shadow))
+    # Tells the API workers to empty their search caches:
+    db = cast("AsyncIOMotorDatabase[Any]", collection.database)
+    await set_live_index(db, meili.index_name, shadow)
+    await meili.wait_for_task(await meili.delete_index(shadow))
+    await checkpoint.save(
+        full=None,
+        collection=collection.name,
+        watermark=resume["started_at"],
+        resume_token=resume["resume_token"],
+    )
+    log.info("Swapped %s into %s" % (shadow, meili.index_name), action="searchsync", pushed=pushed)
+
+
+async def _resume_token(collection: "AsyncIOMotorCollection[Any]") -> Optional[Dict[str, Any]]:
+    """Current position of the change stream, `None` without replica set."""
+    try:
+        async with collection.watch() as stream:
+            token: Optional[Dict[str, Any]] = stream.resume_token
+            return token
+    except (OperationFailure, NotImplementedError):
+        return None
+
+
+class Changes:
+    """Entries changed since the last push, by id: the encoded document, or
+    `None` if it was deleted."""
+
+    def __init__(self) -> None:
+        self.docs: Dict[str, Optional[bytes]] = {}
+        self.size = 0
+
+    def upsert(self, key: str, doc: bytes) -> None:
+        self.docs[key] = doc
+        self.size += len(doc)
+
+    def delete(self, key: str) -> None:
+        self.docs[key] = None
+
+    def full(self) -> bool:
+        return (
+            len(self.docs) >= settings.SEARCH_SYNC_BATCH_SIZE
+            or self.size >= settings.SEARCH_SYNC_BATCH_BYTES
+        )
+
+    async def push(self, meili: MeiliClient, tasks: TaskQueue, progress: Dict[str, Any]) -> int:
+        upserts = [doc for doc in self.docs.values() if doc is not None]
+        deletes = [key for key, doc in self.docs.items() if doc is None]
+        if upserts:
+            uid = await meili.add_documents(b"[" + b",".join(upserts) + b"]")
+            await tasks.add(uid, {} if deletes else progress)
+        if deletes:
+            await tasks.add(await meili.delete_documents(deletes), progress)
+        if upserts or deletes:
+            log.info(
+                "Pushed changes", action="searchsync", upserts=len(upserts), deletes=len(deletes)
+            )
+        return len(self.docs)
+
+
+async def _check_generation(collection: "AsyncIOMotorCollection[Any]") -> None:
+    # Motor's type stubs don't declare `database`:
+    db = cast("AsyncIOMotorDatabase[Any]", collection.database)
+    if await live_generation(db, "fulldb") != collection.name:
+        log.info("The live entries changed from %s" % collection.name, action="searchsync")
+        raise Resync()
+
+
+async def follow_changes(
+    collection: "AsyncIOMotorCollection[Any]",
+    meili: MeiliClient,
+    checkpoint: Checkpoint,
+    state: Dict[str, Any],
+    follow: bool,
+) -> None:
+    """Push the entries changed since the checkpoint, from the change stream
+    of `collection`. Deletes are only seen with pre-images enabled on the
+    collection (`changeStreamPreAndPostImages`)."""
+    tasks = TaskQueue(meili, checkpoint)
+    changes = Changes()
+    async with collection.watch(
+        full_document="updateLookup",
+        full_document_before_change="whenAvailable",
+        resume_after=state.get("resume_token"),
+    ) as stream:
+        loop = asyncio.get_running_loop()
+        flushed = loop.time()
+        while True:
+            event = await stream.try_next()
+            if event is not None:
+                kind = event["operationType"]
+                if kind in RESYNC_EVENTS:
+                    raise Resync()
+                if kind in ("insert", "update", "replace"):
+                    doc = event.get("fullDocument")
+                    if doc is not None:
+                        changes.upsert(doc["id"], meili_document(doc))
+                elif kind == "delete":
+                    before = event.get("fullDocumentBeforeChange")
+                    if before is not None:
+                        changes.delete(before["id"])
+                    else:
+                        log.warning("Delete without pre-image: %s" % event["documentKey"], action="searchsync")
+            idle = event is None
+            if changes.full() or (changes.docs and (idle or loop.time() - flushed > settings.SEARCH_SYNC_INTERVAL)):
+                await changes.push(meili, tasks, {"resume_token": stream.resume_token})
+                changes = Changes()
+                flushed = loop.time()
+            if idle:
+                await tasks.drain()
+                await checkpoint.save(resume_token=stream.resume_token)
+                if not follow:
+                    return
+                await _check_generation(collection)
+                await asyncio.sleep(settings.SEARCH_SYNC_INTERVAL)
+
+
+async def poll_changes(
+    collection: "AsyncIOMotorCollection[Any]",
+    meili: MeiliClient,
+    checkpoint: Checkpoint,
+    state: Dict[str, Any],
+    follow: bool,
+) -> None:
+    """Push the entries written since the checkpoint, found by their store
+    timestamp. Loader batches are stamped before they are written and may
+    commit after later ones, so every poll reads again the entries stamped
+    up to `SEARCH_SYNC_LAG` seconds before the newest one seen. Those already
+    pushed in this version are skipped, pushing an entry twice (e.g. after a
+    restart) only replaces it with itself. Deleted entries aren't seen, they
+    are removed by the next full sync, e.g. after `registry-update --rebuild`."""
+    tasks = TaskQueue(meili, checkpoint)
+    watermark: Optional[datetime] = state.get("watermark")
+    lag = timedelta(seconds=settings.SEARCH_SYNC_LAG)
+    # Content hash and store timestamp of the entries pushed in the window:
+    pushed: Dict[ObjectId, Tuple[Optional[str], Optional[datetime]]] = {}
+    while True:
+        query: Dict[str, Any] = {}
+        if watermark is not None:
+            since = watermark - lag
+            query = {STORE_TIMESTAMP: {"$gte": since}}
+            pushed = {key: seen for key, seen in pushed.items() if seen[1] and seen[1] >= since}
+        sort = [(STORE_TIMESTAMP, 1), ("_id", 1)]
+        documents = collection.find(query, batch_size=settings.SEARCH_SYNC_BATCH_SIZE).sort(sort)
+        changes = Changes()
+        async for doc in documents:
+            updated_at = doc.get(STORE_TIMESTAMP)
+            if updated_at is not None and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+            version = (doc.get(HASH_FIELD), updated_at)
+            if pushed.get(doc["_id"]) == version:
+                continue
+            pushed[doc["_id"]] = version
+            changes.upsert(doc["id"], meili_document(doc))
+            if changes.full():
+                await changes.push(meili, tasks, {"watermark": watermark})
+                changes = Changes()
+        await changes.push(meili, tasks, {"watermark": watermark})
+        await tasks.drain()
+        if not follow:
+            return
+        await _check_generation(collection)
+        await asyncio.sleep(settings.SEARCH_SYNC_INTERVAL)
+
+
+async def _supports_changes(collection: "AsyncIOMotorCollection[Any]") -> bool:
+    return await _resume_token(collection) is not None
+
+
+async def sync_search(
+    full: bool = False,
+    follow: bool = False,
+    mode: str = "auto",
+    client: Optional["AsyncIOMotorClient[Any]"] = None,
+    meili: Optional[MeiliClient] = None,
+) -> None:
+    """Bring the Meilisearch index in line with the live entries in MongoDB:
+    a full load the first time, after a rebuild or with `full`, then the
+    changes since the checkpoint, by change stream or (`mode="poll"`) by
+    store timestamp. With `follow`, keep pushing changes until interrupted."""
+    own_client = client is None
+    client = client or create_client(read_preference="primary")
+    meili = meili or MeiliClient.from_settings()
+    db = client[settings.SEARCH_DB]
+    checkpoint = Checkpoint(db, meili.index_name)
+    try:
+        if full:
+            await checkpoint.reset()
+        while True:
+            collection = db[await live_generation(db, "fulldb")]
+            use_changes = mode == "changes"
+            if mode == "auto":
+                use_changes = await _supports_changes(collection)
+            state = await checkpoint.load()
+            if state.get("full") or state.get("collection") != collection.name:
+                await full_sync(collection, meili, checkpoint, state, use_changes)
+                state = await checkpoint.load()
+            try:
+                if use_changes:
+                    await follow_changes(collection, meili, checkpoint, state, follow)
+                else:
+                    await poll_changes(collection, meili, checkpoint, state, follow)
+                return
+            except Resync:
+                continue
+    finally:
+        await meili.close()
+        if own_client:
+            client.close()
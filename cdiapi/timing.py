@@ -0,0 +1,44 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+
+class Timings:
+    """Time spent per phase of a single request, reported in the
+    `Server-Timing` response header. Phases may overlap, e.g. a count and a
+    find run concurrently."""
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+        # MongoDB commands are reported from Motor's executor threads:
+        self.lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def header(self) -> str:
+        return ", ".join(
+            "%s;dur=%.1f" % (name, seconds * 1000) for name, seconds in self.phases.items()
+        )
+
+
+current_timings: ContextVar[Optional[Timings]] = ContextVar("current_timings", default=None)
+
+
+def record(name: str, seconds: float) -> None:
+    """Add `seconds` to phase `name` of the request being answered, if any."""
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
@@ -0,0 +1,110 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+from cdiapi import settings
+from cdiapi.logs import get_logger
+from cdiapi.cache import search_cache
+from cdiapi.data.projection import model_paths
+from cdiapi.generations import live_index
+from cdiapi.sources import source_registry
+
+log = get_logger(__name__)
+
+
+def prepare(app: FastAPI) -> None:
+    """Build the middleware stack, the OpenAPI schema and the projections of
+    the response models, which would otherwise be built on the first
+    requests. Run in the server process before the workers fork, they then
+    share the result."""
+    if app.middleware_stack is None:
+        app.middleware_stack = app.build_middleware_stack()
+    app.openapi()
+    for route in app.routes:
+        model = getattr(route, "response_model", None) if isinstance(route, APIRoute) else None
+        if isinstance(model, type) and issubclass(model, BaseModel):
+            model_paths(model)
+
+
+async def _schema(app: FastAPI) -> None:
+    prepare(app)
+
+
+async def _mongodb(app: FastAPI) -> None:
+    store = app.state.store
+    await store.client.admin.command("ping")
+    await store.catalogs.collection()
+    await store.entries.collection()
+
+
+async def _meilisearch(app: FastAPI) -> None:
+    # Opens the connection and sets the epoch of the search cache:
+    meili = app.state.meili
+    await meili.get_index()
+    epoch = await live_index(app.state.store.search, meili.index_name)
+
+    async def fetch() -> str:
+        return epoch
+
+    await search_cache.refresh_epoch(fetch)
+
+
+async def _registry(app: FastAPI) -> None:
+    catalogs = await app.state.store.catalogs.collection()
+    await source_registry.resolve(catalogs, [])
+
+
+STEPS: List[Tuple[str, Callable[[FastAPI], Awaitable[None]]]] = [
+    ("schema", _schema),
+    ("mongodb", _mongodb),
+    ("meilisearch", _meilisearch),
+    ("registry", _registry),
+]
+
+
+class WarmUp:
+    """Get a worker ready for traffic in the background: build the schemas,
+    open the MongoDB and Meilisearch connections and load the registry
+    snapshot. Failed steps are retried every `WARMUP_RETRY` seconds, the
+    worker is ready once all of them passed."""
+
+    def __init__(self, app: FastAPI) -> None:
+        self.app = app
+        self.checks: Dict[str, str] = {name: "pending" for name, _ in STEPS}
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    @property
+    def ready(self) -> bool:
+        return all(status == "ok" for status in self.checks.values())
+
+    def start(self) -> None:
+        self.task = asyncio.ensure_future(self.run())
+
+    async def _step(self, name: str, step: Callable[[FastAPI], Awaitable[None]]) -> None:
+        try:
+            await step(self.app)
+            self.checks[name] = "ok"
+        except Exception as exc:
+            self.checks[name] = "%s: %s" % (type(exc).__name__, exc)
+            log.warning("Warm-up step %s failed: %s" % (name, exc), action="warmup")
+
+    async def run(self) -> None:
+        while True:
+            # The steps are independent, one slow backend doesn't hold up the
+            # others:
+            pending = [self._step(name, step) for name, step in STEPS if self.checks[name] != "ok"]
+            await asyncio.gather(*pending)
+            if self.ready:
+                log.info("Ready to serve", action="warmup")
+                return
+            await asyncio.sleep(settings.WARMUP_RETRY)
+
+    async def stop(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
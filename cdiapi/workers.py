@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, Optional
+from fastapi import FastAPI
+from gunicorn.app.base import BaseApplication  # type: ignore
+from uvicorn.workers import UvicornWorker
+
+from cdiapi import settings
+
+
+class Worker(UvicornWorker):
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "server_header": False}
+
+
+class ServerApplication(BaseApplication):  # type: ignore
+    """Gunicorn master running the API in `workers` Uvicorn worker processes.
+
+    The app is created in the master before the workers fork, connections to
+    MongoDB and Meilisearch are opened in each worker's lifespan. A SIGHUP
+    starts fresh workers and then shuts the old ones down gracefully."""
+
+    def __init__(self, options: Dict[str, Any]) -> None:
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self) -> FastAPI:
+        from cdiapi.app import create_app
+        from cdiapi.warmup import prepare
+
+        app = create_app()
+        prepare(app)
+        return app
+
+
+class MetricsDirError(Exception):
+    """The directory set in `PROMETHEUS_MULTIPROC_DIR` holds other files."""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+def metrics_dir() -> Optional[str]:
+    """Set up an empty directory for the metrics of all workers. This has to
+    happen before `prometheus_client` is imported, i.e. before the app.
+
+    A directory set in `PROMETHEUS_MULTIPROC_DIR` is only cleared of the
+    metric files of a previous run, it must not hold anything else. Without
+    it, a temporary directory is created, its path is returned so that it
+    can be removed once the server stopped."""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path is None:
+        path = tempfile.mkdtemp(prefix="cdiapi-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+        return path
+    os.makedirs(path, exist_ok=True)
+    names = os.listdir(path)
+    others = [
+        name
+        for name in names
+        if not name.endswith(".db") or not os.path.isfile(os.path.join(path, name))
+    ]
+    if others:
+        raise MetricsDirError(
+            "PROMETHEUS_MULTIPROC_DIR=%s holds files that aren't metrics: %s"
+            % (path, ", ".join(sorted(others)[:5]))
+        )
+    for name in names:
+        os.remove(os.path.join(path, name))
+    return None
+
+
+def child_exit(server: Any, worker: Any) -> None:
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)  # type: ignore[no-untyped-call]
+
+
+def server_options(host: str, port: int, workers: int) -> Dict[str, Any]:
+    return {
+        "bind": "%s:%d" % (host, port),
+        "workers": workers or os.cpu_count() or 1,
+        "worker_class": "cdiapi.workers.Worker",
+        "backlog": settings.BACKLOG,
+        "keepalive": settings.KEEPALIVE,
+        "max_requests": settings.MAX_REQUESTS,
+        "max_requests_jitter": settings.MAX_REQUESTS_JITTER,
+        "graceful_timeout": settings.GRACEFUL_TIMEOUT,
+        "timeout": settings.WORKER_TIMEOUT,
+        "preload_app": True,
+        "forwarded_allow_ips": settings.FORWARDED_ALLOW_IPS,
+        "child_exit": child_exit,
+    }
+
+
+def run_server(host: str, port: int, workers: int) -> None:
+    """Serve with `workers` processes, one per CPU if it is 0."""
+    created = metrics_dir()
+    try:
+        ServerApplication(server_options(host, port, workers)).run()
+    finally:
+        if created is not None:
+            shutil.rmtree(created, ignore_errors=True)
@@ -1,3 +1,3 @@
 #!/bin/sh
-#nohup hypercorn -b 127.0.0.1:8099 cdiapi.app:app&
-hypercorn -b 127.0.0.1:8199 cdiapi.app:app > logs/api-int.log 2>&1 &
\ No newline at end of file
+#nohup hypercorn -b 127.0.0.1:8099 "cdiapi.app:create_app()"&
+CDIAPI_DEBUG=false python -m cdiapi.cli serve --host 127.0.0.1 --port 8199 --workers 0 > logs/api-int.log 2>&1 &
\ No newline at end of file
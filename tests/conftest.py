@@ -0,0 +1,162 @@
+import os
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+import httpx
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# Read by cdiapi.settings when it is first imported:
+os.environ.setdefault("CDIAPI_RATE_LIMITS", "off")
+os.environ.setdefault("CDIAPI_SEARCH_CACHE_TTL", "0")
+
+from cdiapi.app import create_app  # noqa: E402
+from cdiapi.db import Store, get_store  # noqa: E402
+from cdiapi.meili import MeiliClient, get_meili  # noqa: E402
+from cdiapi.cache import catalog_cache, entry_cache  # noqa: E402
+from cdiapi.pagination import count_cache  # noqa: E402
+from benchmarks.bench_serialization import make_catalog, make_entry  # noqa: E402
+
+
+class StubMeili:
+    """In-memory Meilisearch answering the calls of `search-sync` and of the
+    search endpoint, its tasks succeed at once."""
+
+    def __init__(self) -> None:
+        self.indexes: Dict[str, Dict[str, Any]] = {}
+        self.tasks: Dict[int, Dict[str, Any]] = {}
+        # Ids of the documents of each `add_documents` call:
+        self.added: List[List[str]] = []
+        # Bodies of the searches, and the status and message to fail them with:
+        self.searches: List[Dict[str, Any]] = []
+        self.error: Optional[Tuple[int, str]] = None
+        routes = [
+            Route("/indexes", self.create_index, methods=["POST"]),
+            Route("/indexes/{uid}", self.index, methods=["GET", "DELETE"]),
+            Route("/indexes/{uid}/settings", self.settings, methods=["GET", "PATCH"]),
+            Route("/indexes/{uid}/documents", self.add_documents, methods=["POST"]),
+            Route("/indexes/{uid}/search", self.search, methods=["POST"]),
+            Route("/swap-indexes", self.swap_indexes, methods=["POST"]),
+            Route("/tasks/{uid}", self.task),
+        ]
+        self.app = Starlette(routes=routes)
+
+    def client(self) -> MeiliClient:
+        meili = MeiliClient("http://meili", None, "fulldb")
+        transport = httpx.ASGITransport(app=self.app)
+        meili.http = httpx.AsyncClient(transport=transport, base_url="http://meili")
+        return meili
+
+    def docs(self, index: str = "fulldb") -> Dict[str, Any]:
+        docs: Dict[str, Any] = self.indexes[index]["docs"]
+        return docs
+
+    def _task(self, run: Callable[[], Any]) -> Response:
+        uid = len(self.tasks)
+        run()
+        self.tasks[uid] = {"uid": uid, "status": "succeeded"}
+        return JSONResponse({"taskUid": uid}, status_code=202)
+
+    async def create_index(self, request: Request) -> Response:
+        uid = (await request.json())["uid"]
+        return self._task(lambda: self.indexes.setdefault(uid, {"docs": {}, "settings": {}}))
+
+    async def index(self, request: Request) -> Response:
+        uid = request.path_params["uid"]
+        if request.method == "DELETE":
+            return self._task(lambda: self.indexes.pop(uid))
+        if uid not in self.indexes:
+            return JSONResponse({"message": "Index not found"}, status_code=404)
+        return JSONResponse({"uid": uid, "updatedAt": "2026-01-01T00:00:00Z"})
+
+    async def settings(self, request: Request) -> Response:
+        index = self.indexes[request.path_params["uid"]]
+        if request.method == "GET":
+            return JSONResponse(index["settings"])
+        body = await request.json()
+        return self._task(lambda: index["settings"].update(body))
+
+    async def add_documents(self, request: Request) -> Response:
+        docs = orjson.loads(await request.body())
+        index = self.indexes[request.path_params["uid"]]
+        self.added.append([doc["id"] for doc in docs])
+        return self._task(lambda: index["docs"].update({doc["id"]: doc for doc in docs}))
+
+    async def search(self, request: Request) -> Response:
+        body = await request.json()
+        self.searches.append(body)
+        if self.error is not None:
+            status, message = self.error
+            return JSONResponse({"message": message}, status_code=status)
+        hits = list(self.docs(request.path_params["uid"]).values())
+        result: Dict[str, Any] = {"query": body["q"], "processingTimeMs": len(self.searches)}
+        if "page" in body:
+            size = body["hitsPerPage"]
+            start = (body["page"] - 1) * size
+            result.update(page=body["page"], hitsPerPage=size, totalHits=len(hits))
+        else:
+            start, size = body["offset"], body["limit"]
+            result.update(offset=start, limit=size, estimatedTotalHits=len(hits))
+        result["hits"] = hits[start:start + size]
+        if "facets" in body:
+            result["facetDistribution"] = {name: {} for name in body["facets"]}
+        return JSONResponse(result)
+
+    async def swap_indexes(self, request: Request) -> Response:
+        first, second = (await request.json())[0]["indexes"]
+
+        def swap() -> None:
+            self.indexes[first], self.indexes[second] = self.indexes[second], self.indexes[first]
+
+        return self._task(swap)
+
+    async def task(self, request: Request) -> Response:
+        return JSONResponse(self.tasks[int(request.path_params["uid"])])
+
+
+@pytest.fixture
+def meili() -> StubMeili:
+    return StubMeili()
+
+
+@pytest.fixture
+def mongo() -> AsyncMongoMockClient:
+    return AsyncMongoMockClient()
+
+
+@pytest.fixture
+def store(mongo: AsyncMongoMockClient) -> Store:
+    return Store(mongo)
+
+
+@pytest.fixture
+def client(store: Store, meili: StubMeili) -> Iterator[TestClient]:
+    """The app, answering from an in-memory MongoDB filled by `seed` and the
+    stub Meilisearch."""
+    for cache in (catalog_cache, entry_cache, count_cache):
+        cache.clear()
+    app = create_app()
+    app.dependency_overrides[get_store] = lambda: store
+    meili_client = meili.client()
+    app.dependency_overrides[get_meili] = lambda: meili_client
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def seed(store: Store) -> Callable[..., Awaitable[None]]:
+    """Insert `entries` search entries and `catalogs` registry catalogs."""
+
+    async def seed(entries: int = 0, catalogs: int = 0) -> None:
+        if entries:
+            collection = await store.entries.collection()
+            await collection.insert_many([make_entry(num) for num in range(entries)])
+        if catalogs:
+            collection = await store.catalogs.collection()
+            await collection.insert_many([make_catalog(num) for num in range(catalogs)])
+
+    return seed
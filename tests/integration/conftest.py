@@ -0,0 +1,22 @@
+from typing import Any, AsyncIterator
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+from cdiapi import settings
+
+
+@pytest.fixture
+async def mongo_client() -> AsyncIterator["AsyncIOMotorClient[Any]"]:
+    """Client of the MongoDB at `CDIAPI_MONGO_URI`, skips the test if there
+    is none."""
+    client: "AsyncIOMotorClient[Any]" = AsyncIOMotorClient(
+        settings.MONGO_URI, serverSelectionTimeoutMS=2000
+    )
+    try:
+        await client.admin.command("ping")
+    except PyMongoError as exc:
+        client.close()
+        pytest.skip("No MongoDB at %s: %s" % (settings.MONGO_URI, exc))
+    yield client
+    client.close()
@@ -0,0 +1,6 @@
+from cdiapi.indexes import check_indexes
+
+
+async def test_no_query_scans_a_collection(mongo_client):
+    failures = await check_indexes(mongo_client, "cdiapi_test_indexcheck")
+    assert failures == []
@@ -0,0 +1,38 @@
+import pytest
+
+from cdiapi import settings
+from cdiapi.cache import entry_cache
+
+
+@pytest.mark.parametrize(
+    "url, key, prefix",
+    [("/raw/0.1/entries/batch", "id", "cdi00000002-"), ("/registry/catalogs/batch", "uid", "cdi0000000")],
+)
+async def test_batch(client, seed, url, key, prefix):
+    await seed(entries=5, catalogs=5)
+    ids = [prefix + "3", "nope", prefix + "1", prefix + "3", "gone"]
+    response = client.post(url, json={"ids": ids})
+    assert response.status_code == 200
+    body = response.json()
+    # In the order asked for, duplicates once:
+    assert [item[key] for item in body["data"]] == [prefix + "3", prefix + "1"]
+    assert body["missing"] == ["nope", "gone"]
+    assert "_id" not in body["data"][0]
+
+
+async def test_batch_matches_single_entries(client, seed):
+    await seed(entries=3)
+    single = client.get("/raw/0.1/entry/cdi00000002-2").json()
+    entry_cache.clear()
+    batch = client.post("/raw/0.1/entries/batch", json={"ids": ["cdi00000002-2"]}).json()
+    assert batch["data"] == [single]
+
+
+def test_batch_empty(client):
+    response = client.post("/raw/0.1/entries/batch", json={"ids": []})
+    assert response.json() == {"data": [], "missing": []}
+
+
+def test_batch_too_large(client):
+    ids = ["x%d" % num for num in range(settings.MAX_BATCH + 1)]
+    assert client.post("/registry/catalogs/batch", json={"ids": ids}).status_code == 422
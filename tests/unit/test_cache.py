@@ -0,0 +1,106 @@
+import asyncio
+
+from cdiapi.cache import ResponseCache, TTLCache
+
+
+def test_ttl_cache_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("cdiapi.cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(10, 5)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    now[0] += 6
+    assert cache.get("a") is None
+    assert cache.get("a", "default") == "default"
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(2, 60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+async def test_single_flight():
+    cache = ResponseCache("test", 10, 60)
+    calls = []
+    release = asyncio.Event()
+
+    async def load():
+        calls.append(1)
+        await release.wait()
+        return b"body"
+
+    waiters = [asyncio.ensure_future(cache.get_or_load("key", load)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    assert await asyncio.gather(*waiters) == [b"body"] * 5
+    assert len(calls) == 1
+    assert await cache.get_or_load("key", load) == b"body"
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "coalesced": 4}
+
+
+async def test_single_flight_error_reaches_all_waiters():
+    cache = ResponseCache("test", 10, 60)
+    release = asyncio.Event()
+
+    async def load():
+        await release.wait()
+        raise RuntimeError("store down")
+
+    waiters = [asyncio.ensure_future(cache.get_or_load("key", load)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.pending == {}
+    assert len(cache.entries) == 0
+
+
+async def test_cancelled_loader_hands_over_to_a_waiter():
+    cache = ResponseCache("test", 10, 60)
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return b"body"
+
+    first = asyncio.ensure_future(cache.get_or_load("key", load))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(cache.get_or_load("key", load))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == b"body"
+    assert len(calls) == 2
+
+
+async def test_not_found_is_not_cached():
+    cache = ResponseCache("test", 10, 60)
+
+    async def load():
+        return None
+
+    assert await cache.get_or_load("key", load) is None
+    assert len(cache.entries) == 0
+
+
+async def test_get_or_load_many():
+    cache = ResponseCache("test", 10, 60)
+    cache.entries.set("a", b"A")
+    asked = []
+
+    async def load(keys):
+        asked.append(keys)
+        return {key: key.upper().encode() for key in keys if key != "missing"}
+
+    found = await cache.get_or_load_many(["a", "b", "missing"], load)
+    assert found == {"a": b"A", "b": b"B"}
+    assert asked == [["b", "missing"]]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
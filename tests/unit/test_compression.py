@@ -0,0 +1,230 @@
+import gzip
+import zlib
+import orjson
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from cdiapi import compression, responses, settings
+from cdiapi.compression import (
+    AVAILABLE,
+    CompressionMiddleware,
+    StreamCompressor,
+    choose_encoding,
+    compress,
+    encoded_etag,
+    identity_etag,
+)
+from cdiapi.responses import CachedBody
+
+ENCODINGS = [name for name, available in AVAILABLE.items() if available]
+BODY = orjson.dumps([{"n": num, "text": "water quality data " * 5} for num in range(50)])
+
+
+def decompress(data, encoding):
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br":
+        return compression.brotli.decompress(data)
+    return compression.zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        (None, None),
+        ("", None),
+        ("identity", None),
+        ("gzip", "gzip"),
+        ("gzip, br", "br"),
+        ("gzip, br, zstd", "zstd"),
+        ("br;q=0.2, gzip;q=0.8", "gzip"),
+        ("br;q=0, gzip", "gzip"),
+        ("GZIP ; q=1", "gzip"),
+        ("gzip;q=bad", None),
+        ("*;q=0.5", "zstd"),
+        ("zstd;q=0, *", "br"),
+    ],
+)
+def test_choose_encoding(monkeypatch, accept_encoding, expected):
+    monkeypatch.setattr(compression, "ENCODINGS", ["zstd", "br", "gzip"])
+    assert choose_encoding(accept_encoding) == expected
+
+
+def test_choose_encoding_offers_nothing(monkeypatch):
+    monkeypatch.setattr(compression, "ENCODINGS", [])
+    assert choose_encoding("gzip") is None
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_compress(encoding):
+    compressed = compress(BODY, encoding)
+    assert len(compressed) < len(BODY)
+    assert decompress(compressed, encoding) == BODY
+
+
+def test_compress_unknown_encoding():
+    with pytest.raises(ValueError):
+        compress(BODY, "lzma")
+    with pytest.raises(ValueError):
+        StreamCompressor("lzma")
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_stream_compressor(encoding):
+    compressor = StreamCompressor(encoding)
+    chunks = [compressor.compress(BODY[:100]), compressor.compress(BODY[100:])]
+    chunks.append(compressor.finish())
+    assert decompress(b"".join(chunks), encoding) == BODY
+
+
+def test_stream_compressor_flushes_every_chunk():
+    compressor = StreamCompressor("gzip")
+    decompressor = zlib.decompressobj(31)
+    # Each chunk decodes as soon as it is received:
+    assert decompressor.decompress(compressor.compress(b'{"n":1}\n')) == b'{"n":1}\n'
+    assert decompressor.decompress(compressor.compress(b'{"n":2}\n')) == b'{"n":2}\n'
+    assert decompressor.decompress(compressor.finish()) == b""
+    assert decompressor.eof
+
+
+def test_encoded_etag():
+    assert encoded_etag('"abc"', "gzip") == '"abc-gzip"'
+    for encoding in AVAILABLE:
+        assert identity_etag(encoded_etag('"abc"', encoding)) == '"abc"'
+    assert identity_etag('"abc"') == '"abc"'
+    assert identity_etag('"abc-other"') == '"abc-other"'
+
+
+def test_cached_body_compresses_each_encoding_once(monkeypatch):
+    calls = []
+
+    def compress_body(body, encoding):
+        calls.append(encoding)
+        return compress(body, encoding)
+
+    monkeypatch.setattr(responses, "compress_body", compress_body)
+    cached = CachedBody(BODY)
+    assert cached.encoded("gzip") == cached.encoded("gzip")
+    assert calls == ["gzip"]
+    assert gzip.decompress(cached.variants["gzip"]) == BODY
+
+
+def test_precompress(monkeypatch):
+    monkeypatch.setattr(compression, "ENCODINGS", ["gzip"])
+    monkeypatch.setattr(responses, "ENCODINGS", ["gzip"])
+    assert list(CachedBody(BODY).precompress().variants) == ["gzip"]
+    # Bodies under the minimum size are sent as they are:
+    assert CachedBody(b"[]").precompress().variants == {}
+
+
+async def chunks():
+    for num in range(5):
+        yield b'{"n":%d}\n' % num * 50
+
+
+def make_client():
+    async def large(request):
+        return Response(BODY, media_type="application/json", headers={"ETag": '"abc"'})
+
+    async def weak(request):
+        return Response(BODY, media_type="application/json", headers={"ETag": 'W/"abc"'})
+
+    async def small(request):
+        return Response(b"[]", media_type="application/json")
+
+    async def stream(request):
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    async def archive(request):
+        return Response(BODY, media_type="application/gzip")
+
+    async def encoded(request):
+        headers = {"Content-Encoding": "gzip"}
+        return Response(gzip.compress(BODY), media_type="application/json", headers=headers)
+
+    routes = [
+        Route("/large", large),
+        Route("/weak", weak),
+        Route("/small", small),
+        Route("/stream", stream),
+        Route("/archive", archive),
+        Route("/encoded", encoded),
+    ]
+    app = Starlette(routes=routes)
+    app.add_middleware(CompressionMiddleware)
+    return TestClient(app)
+
+
+@pytest.fixture
+def gzip_only(monkeypatch):
+    monkeypatch.setattr(compression, "ENCODINGS", ["gzip"])
+
+
+def test_middleware_compresses(gzip_only):
+    with make_client() as client:
+        with client.stream("GET", "/large", headers={"Accept-Encoding": "gzip"}) as response:
+            raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-length"] == str(len(raw))
+    assert response.headers["etag"] == '"abc-gzip"'
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(raw) == BODY
+
+
+def test_middleware_identity(gzip_only):
+    with make_client() as client:
+        response = client.get("/large", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert response.headers["etag"] == '"abc"'
+        # The response still varies with the header:
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.content == BODY
+
+        response = client.get("/weak", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["etag"] == 'W/"abc"'
+
+
+@pytest.mark.parametrize("path", ["/small", "/archive", "/encoded"])
+def test_middleware_passthrough(gzip_only, path):
+    with make_client() as client:
+        with client.stream("GET", path, headers={"Accept-Encoding": "gzip"}) as response:
+            raw = b"".join(response.iter_raw())
+    if path == "/encoded":
+        assert gzip.decompress(raw) == BODY
+    else:
+        assert "content-encoding" not in response.headers
+        assert raw == (b"[]" if path == "/small" else BODY)
+    if path == "/small":
+        assert response.headers["vary"] == "Accept-Encoding"
+    else:
+        assert "vary" not in response.headers
+
+
+def test_middleware_streams(gzip_only):
+    with make_client() as client:
+        with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+            raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert gzip.decompress(raw).count(b"\n") == 250
+
+
+async def test_encoded_variant_not_modified(client, seed, monkeypatch):
+    monkeypatch.setattr(compression, "ENCODINGS", ["gzip"])
+    monkeypatch.setattr(settings, "COMPRESSION_MIN_SIZE", 0)
+    await seed(entries=1)
+    headers = {"Accept-Encoding": "gzip"}
+    response = client.get("/raw/0.1/entry/cdi00000002-0", headers=headers)
+    assert response.headers["content-encoding"] == "gzip"
+    etag = response.headers["etag"]
+    assert etag.endswith('-gzip"')
+    # Either tag matches the body, whatever encoding the client asks for:
+    for tag in (etag, identity_etag(etag)):
+        for encoding in ("gzip", "identity"):
+            headers = {"Accept-Encoding": encoding, "If-None-Match": tag}
+            response = client.get("/raw/0.1/entry/cdi00000002-0", headers=headers)
+            assert response.status_code == 304
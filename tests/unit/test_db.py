@@ -0,0 +1,54 @@
+from cdiapi import settings
+from cdiapi.cache import catalog_cache, entry_cache
+from cdiapi.db import create_client
+from cdiapi.generations import swap_generation
+from cdiapi.sources import source_registry
+from benchmarks.bench_serialization import make_catalog, make_entry
+
+
+def test_create_client(monkeypatch):
+    monkeypatch.setattr(settings, "MONGO_URI", "mongodb://db.invalid:27017")
+    monkeypatch.setattr(settings, "MONGO_MAX_POOL_SIZE", 7)
+    monkeypatch.setattr(settings, "MONGO_READ_PREFERENCE", "secondaryPreferred")
+    client = create_client()
+    try:
+        assert client.options.pool_options.max_pool_size == 7
+        assert client.read_preference.mongos_mode == "secondaryPreferred"
+    finally:
+        client.close()
+    # Loaders read their own writes:
+    client = create_client(read_preference="primary")
+    try:
+        assert client.read_preference.mongos_mode == "primary"
+    finally:
+        client.close()
+
+
+async def test_entry_swap_clears_the_cache(client, store, seed):
+    await seed(entries=3)
+    assert client.get("/raw/0.1/entry/cdi00000002-1").json()["int_id"] == "1"
+    assert len(entry_cache.entries) == 1
+    shadow = "fulldb_20260101000000"
+    await store.search[shadow].insert_one(dict(make_entry(1), int_id="one"))
+    await swap_generation(store.search, "fulldb", shadow)
+    # Cached until the pointer is re-read:
+    assert client.get("/raw/0.1/entry/cdi00000002-1").json()["int_id"] == "1"
+    store.entries.expires = 0
+    assert client.get("/raw/0.1/entry/cdi00000002-1").json()["int_id"] == "one"
+    assert client.get("/raw/0.1/entry/cdi00000002-2").status_code == 404
+
+
+async def test_catalog_swap_clears_the_caches(client, store, seed):
+    await seed(catalogs=3)
+    assert client.get("/registry/catalog/cdi00000001").status_code == 200
+    assert len(catalog_cache.entries) == 1
+    source_registry.expires = float("inf")
+    shadow = "catalogs_20260101000000"
+    await store.registry[shadow].insert_one(make_catalog(1))
+    await swap_generation(store.registry, "catalogs", shadow)
+    store.catalogs.expires = 0
+    response = client.post("/registry/catalogs/batch", json={"ids": ["cdi00000001", "cdi00000002"]})
+    assert response.json()["missing"] == ["cdi00000002"]
+    assert len(catalog_cache.entries) == 1
+    # Source catalogs are reloaded from the new generation on next use:
+    assert source_registry.expires == 0
@@ -0,0 +1,59 @@
+import gzip
+import orjson
+import pytest
+
+from cdiapi.responses import _ndjson_chunks
+
+
+def lines(response):
+    assert response.status_code == 200
+    return [orjson.loads(line) for line in response.content.splitlines()]
+
+
+async def documents(count):
+    for num in range(count):
+        yield {"n": num, "updated_at": None}
+
+
+async def test_chunks():
+    chunks = [chunk async for chunk in _ndjson_chunks(documents(5), 2, False)]
+    assert chunks == [b'{"n":0}\n{"n":1}\n', b'{"n":2}\n{"n":3}\n', b'{"n":4}\n']
+    chunks = [chunk async for chunk in _ndjson_chunks(documents(4), 2, False)]
+    assert len(chunks) == 2
+    chunks = [chunk async for chunk in _ndjson_chunks(documents(5), 2, True)]
+    assert gzip.decompress(b"".join(chunks)).count(b"\n") == 5
+
+
+@pytest.mark.parametrize(
+    "url, key, count",
+    [("/raw/0.1/export", "id", 12), ("/registry/export", "uid", 7)],
+)
+async def test_export_and_resume(client, seed, url, key, count):
+    await seed(entries=12, catalogs=7)
+    response = client.get(url, params={"batch_size": 5})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported = lines(response)
+    assert len(exported) == count
+    ids = [item["_id"] for item in exported]
+    assert ids == sorted(ids)
+    # An interrupted download resumes after the last line received:
+    rest = lines(client.get(url, params={"after": ids[4]}))
+    assert rest == exported[5:]
+    assert lines(client.get(url, params={"after": ids[-1]})) == []
+
+
+async def test_export_filters_and_fields(client, seed):
+    await seed(entries=5)
+    params = {"software": "ckan", "fields": "dataset.title"}
+    exported = lines(client.get("/raw/0.1/export", params=params))
+    assert len(exported) == 5
+    assert set(exported[0]) == {"_id", "id", "dataset"}
+    assert lines(client.get("/raw/0.1/export", params={"software": "dkan"})) == []
+
+
+async def test_export_gzip(client, seed):
+    await seed(catalogs=3)
+    response = client.get("/registry/export", params={"gzip": True}, headers={"Accept-Encoding": "identity"})
+    assert response.headers["content-type"] == "application/gzip"
+    assert response.headers["content-disposition"] == 'attachment; filename="catalogs.ndjson.gz"'
+    assert len(gzip.decompress(response.content).splitlines()) == 3
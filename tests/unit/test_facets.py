@@ -0,0 +1,78 @@
+import pytest
+
+from cdiapi.facets import CATALOG_SUMMARY, catalog_facets, count_facets, refresh_summary
+from benchmarks.bench_serialization import make_catalog
+
+
+def country(code):
+    return {"location": {"country": {"id": code, "name": code.lower()}}}
+
+
+def catalog(num, software, coverage):
+    doc = make_catalog(num)
+    doc["software"] = {"id": software, "name": software.upper()}
+    doc["coverage"] = [country(code) for code in coverage]
+    return doc
+
+
+@pytest.fixture
+async def catalogs(store):
+    collection = await store.catalogs.collection()
+    await collection.insert_many(
+        [
+            catalog(1, "ckan", ["AE", "AE"]),
+            catalog(2, "ckan", ["AE", "FR"]),
+            catalog(3, "dkan", ["FR"]),
+        ]
+    )
+    return collection
+
+
+async def test_count_facets(catalogs):
+    facets = await count_facets(catalogs, {}, ["software", "coverage_country"])
+    assert facets["software"] == [
+        {"value": "ckan", "name": "CKAN", "count": 2},
+        {"value": "dkan", "name": "DKAN", "count": 1},
+    ]
+    # A catalog covering a country twice is counted once:
+    assert [(f["value"], f["count"]) for f in facets["coverage_country"]] == [("AE", 2), ("FR", 2)]
+    facets = await count_facets(catalogs, {"software.id": "dkan"}, ["coverage_country"], limit=1)
+    assert facets == {"coverage_country": [{"value": "FR", "name": "fr", "count": 1}]}
+
+
+async def test_unfiltered_counts_come_from_the_summary(catalogs):
+    await refresh_summary(catalogs.database, catalogs.name)
+    summaries = catalogs.database[CATALOG_SUMMARY]
+    await summaries.update_one({"_id": catalogs.name}, {"$set": {"facets.software": [{"value": "x"}]}})
+    assert await catalog_facets(catalogs, {}, ["software"]) == {"software": [{"value": "x"}]}
+    # Filtered counts, and facets missing from the summary, are counted:
+    facets = await catalog_facets(catalogs, {"software.id": "ckan"}, ["software"])
+    assert facets["software"][0]["count"] == 2
+    await summaries.delete_many({})
+    facets = await catalog_facets(catalogs, {}, ["software"])
+    assert facets["software"][0]["count"] == 2
+
+
+async def test_refresh_summary_drops_old_generations(catalogs):
+    db = catalogs.database
+    await db[CATALOG_SUMMARY].insert_one({"_id": "catalogs_20200101000000", "facets": {}})
+    await refresh_summary(db, catalogs.name)
+    assert [doc["_id"] async for doc in db[CATALOG_SUMMARY].find()] == [catalogs.name]
+
+
+async def test_search_facets(client, catalogs):
+    params = {"facets": ["software", "owner_type"], "total": "none"}
+    response = client.get("/registry/search/catalogs/", params=params)
+    assert response.status_code == 200
+    facets = response.json()["facets"]
+    assert set(facets) == {"software", "owner_type"}
+    assert facets["owner_type"] == [{"value": "Central government", "name": None, "count": 3}]
+    params["software"] = "dkan"
+    facets = client.get("/registry/search/catalogs/", params=params).json()["facets"]
+    assert facets["software"] == [{"value": "dkan", "name": "DKAN", "count": 1}]
+    assert client.get("/registry/search/catalogs/").json()["facets"] is None
+
+
+def test_unknown_facet(client):
+    response = client.get("/registry/search/catalogs/", params={"facets": "nope"})
+    assert response.status_code == 400
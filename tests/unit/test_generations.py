@@ -0,0 +1,88 @@
+import pytest
+
+from cdiapi import settings
+from cdiapi.generations import (
+    GENERATIONS,
+    GenerationPointer,
+    check_generation,
+    clear_generations,
+    list_generations,
+    live_generation,
+    swap_generation,
+)
+
+
+@pytest.fixture
+def db(mongo):
+    return mongo["test"]
+
+
+async def fill(db, name, count):
+    if count:
+        await db[name].insert_many([{"n": num} for num in range(count)])
+
+
+async def test_live_generation_defaults_to_the_name(db):
+    assert await live_generation(db, "fulldb") == "fulldb"
+
+
+@pytest.mark.parametrize(
+    "shadow, invalid, ok",
+    [
+        (100, 0, True),
+        (0, 0, False),
+        # More than GENERATION_MAX_INVALID of the records were invalid:
+        (100, 6, False),
+        # Shrunk below GENERATION_MIN_RATIO of the live generation:
+        (80, 0, False),
+        (90, 4, True),
+    ],
+)
+async def test_check_generation(db, monkeypatch, shadow, invalid, ok):
+    monkeypatch.setattr(settings, "GENERATION_MAX_INVALID", 0.05)
+    monkeypatch.setattr(settings, "GENERATION_MIN_RATIO", 0.9)
+    await fill(db, "fulldb", 100)
+    await fill(db, "fulldb_20260101000000", shadow)
+    assert await check_generation(db, "fulldb", "fulldb_20260101000000", invalid) is ok
+
+
+async def test_swap_keeps_recent_generations(db, monkeypatch):
+    monkeypatch.setattr(settings, "GENERATIONS_KEEP", 2)
+    await fill(db, "fulldb", 1)
+    await fill(db, "other", 1)
+    names = ["fulldb_2026010%d000000" % day for day in range(1, 4)]
+    for name in names:
+        await fill(db, name, 1)
+        await swap_generation(db, "fulldb", name)
+        assert await live_generation(db, "fulldb") == name
+    # The live generation and the one before it, for a rollback:
+    assert await list_generations(db, "fulldb") == names[1:]
+    pointer = await db[GENERATIONS].find_one({"_id": "fulldb"})
+    assert pointer["history"] == names[:2]
+    assert "other" in await db.list_collection_names()
+
+
+async def test_clear_generations(db):
+    await fill(db, "fulldb", 1)
+    await fill(db, "fulldb_20260101000000", 1)
+    await swap_generation(db, "fulldb", "fulldb_20260101000000")
+    await clear_generations(db, "fulldb")
+    assert await list_generations(db, "fulldb") == []
+    assert await live_generation(db, "fulldb") == "fulldb"
+
+
+async def test_pointer_refresh(db, monkeypatch):
+    monkeypatch.setattr(settings, "GENERATION_REFRESH", 3600)
+    swaps = []
+    pointer = GenerationPointer(db, "fulldb", on_swap=lambda: swaps.append(pointer.current))
+    assert (await pointer.collection()).name == "fulldb"
+    await fill(db, "fulldb_20260101000000", 1)
+    await swap_generation(db, "fulldb", "fulldb_20260101000000")
+    # Re-read once GENERATION_REFRESH has passed:
+    assert (await pointer.collection()).name == "fulldb"
+    pointer.expires = 0
+    assert (await pointer.collection()).name == "fulldb_20260101000000"
+    assert swaps == ["fulldb_20260101000000"]
+    pointer.expires = 0
+    await pointer.collection()
+    assert len(swaps) == 1
@@ -0,0 +1,100 @@
+import pytest
+
+from cdiapi import settings
+from cdiapi.indexes import CATALOG_FILTERS, ENTRY_FILTERS, INDEXES
+from cdiapi.indexes import _pipelines, _queries, _winning_plans, count_pipeline, filter_combinations
+from cdiapi.pagination import text_sort
+from cdiapi.routers.catalog import catalog_filters
+from cdiapi.routers.raw import entry_filters
+
+
+def _fields(query):
+    fields = set()
+    for key, value in query.items():
+        if key in ("$and", "$or"):
+            for part in value:
+                fields |= _fields(part)
+        else:
+            fields.add(key)
+    return fields
+
+
+@pytest.mark.parametrize(
+    "filters, indexed, params",
+    [(entry_filters, ENTRY_FILTERS, 9), (catalog_filters, CATALOG_FILTERS, 6)],
+)
+def test_filter_combinations(filters, indexed, params):
+    queries = list(filter_combinations(filters))
+    assert len(queries) == 2**params
+    assert queries[0] == {}
+    assert len(queries[-1]) == params
+    # Every filter has an index, or is the text search:
+    assert set().union(*map(set, queries)) == set(indexed) | {"$text"}
+    assert len({repr(sorted(query.items())) for query in queries}) == len(queries)
+
+
+def test_filter_indexes_are_in_the_spec():
+    for key, fields in [
+        ((settings.SEARCH_DB, "fulldb"), ENTRY_FILTERS),
+        ((settings.REGISTRY_DB, "catalogs"), CATALOG_FILTERS),
+    ]:
+        prefixes = {next(iter(model.document["key"])) for model in INDEXES[key]}
+        assert set(fields) <= prefixes
+
+
+def test_catalog_queries():
+    queries = list(_queries(catalog_filters, "uid", "uid"))
+    assert queries[:2] == [({"uid": "x"}, None), ({"uid": {"$in": ["x", "y"]}}, None)]
+    # An offset page, a cursor page and an export per filter combination, text
+    # searches have no cursor page:
+    assert len(queries) == 2 + 3 * 2**5 + 2 * 2**5
+    page, cursor_page, export = queries[2:5]
+    assert page == ({}, [("uid", 1), ("_id", 1)])
+    assert set(cursor_page[0]["$or"][0]) == {"uid"}
+    assert cursor_page[1] == [("uid", 1), ("_id", 1)]
+    assert set(export[0]) == {"_id"}
+    assert export[1] == [("_id", 1)]
+    for query, sort in queries:
+        assert _fields(query) <= set(CATALOG_FILTERS) | {"uid", "_id", "$text"}
+
+
+def test_entry_queries_sort_by_id():
+    for query, sort in _queries(entry_filters, "id", None):
+        assert sort in (None, [("_id", 1)], text_sort())
+
+
+@pytest.mark.parametrize("filters, key_field, sort_field", [(entry_filters, "id", None), (catalog_filters, "uid", "uid")])
+def test_text_queries_sort_by_score(filters, key_field, sort_field):
+    text = [(query, sort) for query, sort in _queries(filters, key_field, sort_field) if "$text" in query]
+    pages = [query for query, sort in text if sort == text_sort()]
+    assert len(pages) == len(text) / 2
+    # Only exports of text searches resume after an `_id`:
+    assert not any("_id" in _fields(query) for query in pages)
+
+
+def test_count_pipeline():
+    query = {"software.id": "ckan"}
+    group = {"$group": {"_id": 1, "n": {"$sum": 1}}}
+    assert count_pipeline(query) == [{"$match": query}, group]
+    assert count_pipeline(query, 10) == [{"$match": query}, {"$limit": 10}, group]
+
+
+def test_pipelines():
+    pipelines = list(_pipelines(catalog_filters, True))
+    # Exact count, estimated count and facets of each filtered search:
+    assert len(pipelines) == 3 * (2**6 - 1)
+    assert all(pipeline[0]["$match"] for pipeline in pipelines)
+    assert sum("$facet" in pipeline[-1] for pipeline in pipelines) == 2**6 - 1
+    pipelines = list(_pipelines(entry_filters, False))
+    assert len(pipelines) == 2 * (2**9 - 1)
+
+
+def test_winning_plans():
+    explain = {
+        "stages": [
+            {"$cursor": {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}, "rejectedPlans": []}}},
+            {"$group": {}},
+        ]
+    }
+    assert list(_winning_plans(explain)) == [{"stage": "COLLSCAN"}]
+
@@ -0,0 +1,203 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from cdiapi import limits, settings
+from cdiapi.app import request_middleware
+from cdiapi.limits import (
+    LatencyTracker,
+    Limiter,
+    MemoryLimitBackend,
+    current_route,
+    parse_rates,
+    request_cost,
+    route_class,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(limits.time, "monotonic", clock)
+    monkeypatch.setattr("cdiapi.cache.time.monotonic", clock)
+    return clock
+
+
+def test_parse_rates():
+    assert parse_rates("search=10/30, export=0.5") == {"search": (10.0, 30.0), "export": (0.5, 0.5)}
+    assert parse_rates("off") == {}
+    assert parse_rates(None) == {}
+
+
+def test_route_class():
+    assert route_class("/raw/0.1/export") == ("export", "mongo")
+    assert route_class("/index/0.1/query") == ("search", "meili")
+    assert route_class("/raw/0.1/entry/abc") == ("default", "mongo")
+
+
+@pytest.mark.parametrize(
+    "params, expected",
+    [
+        ({}, 1.0),
+        ({"limit": "10"}, 1.0),
+        ({"limit": "250"}, 2.5),
+        ({"limit": "500"}, 5.0),
+        ({"limit": "100000"}, 5.0),
+        # Facets only, no results are fetched:
+        ({"limit": "0"}, 1.0),
+        # Requests that don't say how much they fetch are charged the most:
+        ({"limit": "-1"}, 5.0),
+        ({"limit": "many"}, 5.0),
+    ],
+)
+def test_request_cost(monkeypatch, params, expected):
+    monkeypatch.setattr(settings, "RATE_LIMIT_PAGE_SIZE", 100)
+    monkeypatch.setattr(settings, "MAX_PAGE", 500)
+    assert request_cost(params) == expected
+
+
+async def test_token_bucket(clock):
+    backend = MemoryLimitBackend(10, 60)
+    # A full bucket allows a burst:
+    for _ in range(3):
+        assert await backend.take("client", 1.0, 3.0, 1.0) == 0
+    assert await backend.take("client", 1.0, 3.0, 1.0) == pytest.approx(1.0)
+    assert await backend.take("other", 1.0, 3.0, 1.0) == 0
+    clock.now += 0.5
+    assert await backend.take("client", 1.0, 3.0, 1.0) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert await backend.take("client", 1.0, 3.0, 1.0) == 0
+    # Refills up to the burst only:
+    clock.now += 100
+    assert await backend.take("client", 1.0, 3.0, 3.0) == 0
+    assert await backend.take("client", 1.0, 3.0, 2.0) == pytest.approx(2.0)
+
+
+@pytest.fixture
+def limiter(monkeypatch, clock):
+    monkeypatch.setattr(settings, "RATE_LIMITS", "search=1/2")
+    monkeypatch.setattr(settings, "MAX_IN_FLIGHT", 0)
+    return Limiter()
+
+
+async def test_rate_limit(limiter, clock):
+    assert await limiter.admit("/raw/0.1/search", {}, "1.2.3.4") is None
+    assert await limiter.admit("/raw/0.1/search", {}, "1.2.3.4") is None
+    rejection = await limiter.admit("/raw/0.1/search", {}, "1.2.3.4")
+    assert rejection.status == 429
+    assert rejection.retry_after == pytest.approx(1.0)
+    assert await limiter.admit("/raw/0.1/search", {}, "5.6.7.8") is None
+    # Other route classes aren't limited:
+    assert await limiter.admit("/raw/0.1/entry/abc", {}, "1.2.3.4") is None
+    assert limiter.in_flight == 4
+    # A page bigger than the bucket costs the whole bucket:
+    clock.now += 10
+    assert await limiter.admit("/raw/0.1/search", {"limit": "500"}, "1.2.3.4") is None
+    assert (await limiter.admit("/raw/0.1/search", {}, "1.2.3.4")).reason == "rate"
+
+
+async def test_rate_limit_backend_down(limiter):
+    class Down:
+        async def take(self, key, rate, burst, cost):
+            raise ConnectionError("Redis is down")
+
+    limiter.backend = Down()
+    for _ in range(5):
+        assert await limiter.admit("/raw/0.1/search", {}, "1.2.3.4") is None
+
+
+async def test_in_flight_cap(limiter, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_IN_FLIGHT", 2)
+    assert await limiter.admit("/raw/0.1/entry/a", {}, "ip") is None
+    assert await limiter.admit("/raw/0.1/entry/b", {}, "ip") is None
+    assert (await limiter.admit("/raw/0.1/entry/c", {}, "ip")).reason == "in_flight"
+    # Health checks always pass:
+    assert await limiter.admit("/healthz", {}, "ip") is None
+    release = limiter.releaser()
+    release()
+    release()
+    assert limiter.in_flight == 2
+
+
+async def test_shedding(limiter, monkeypatch):
+    monkeypatch.setattr(limits.random, "random", lambda: 0.5)
+    limiter.targets["mongo"] = 0.1
+    limiter.latency.observe("mongo", 0.12)
+    assert limiter.shed_probability("mongo") == pytest.approx(0.2)
+    assert await limiter.admit("/raw/0.1/entries/batch", {}, "ip") is None
+    limiter.latency.averages["mongo"] = (1.0, limits.time.monotonic())
+    assert limiter.shed_probability("mongo") == settings.SHED_MAX_RATE
+    assert (await limiter.admit("/raw/0.1/entries/batch", {}, "ip")).reason == "shed"
+    # Single reads aren't shed:
+    assert await limiter.admit("/raw/0.1/entry/abc", {}, "ip") is None
+
+
+def test_latency_leaves_exports_out(clock):
+    tracker = LatencyTracker()
+    token = current_route.set("export")
+    try:
+        tracker.observe("mongo", 5.0)
+    finally:
+        current_route.reset(token)
+    assert tracker.average("mongo") == 0.0
+    tracker.observe("mongo", 0.2)
+    assert tracker.average("mongo") == pytest.approx(0.2)
+    # Forgotten once not updated:
+    clock.now += settings.SHED_WINDOW + 1
+    assert tracker.average("mongo") == 0.0
+
+
+def make_client(seen):
+    async def lines():
+        for num in range(3):
+            # Commands made while exporting, slow cursor batches:
+            limits.limiter.latency.observe("mongo", 60.0)
+            seen.append(limits.limiter.in_flight)
+            yield b'{"n":%d}\n' % num
+
+    async def export(request):
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    async def entry(request):
+        seen.append(limits.limiter.in_flight)
+        return JSONResponse({})
+
+    async def fail(request):
+        raise RuntimeError("boom")
+
+    routes = [
+        Route("/raw/0.1/export", export),
+        Route("/raw/0.1/entry/abc", entry),
+        Route("/raw/0.1/entry/fail", fail),
+    ]
+    app = Starlette(routes=routes)
+    app.add_middleware(BaseHTTPMiddleware, dispatch=request_middleware)
+    return TestClient(app, raise_server_exceptions=False)
+
+
+def test_release_after_the_body(monkeypatch):
+    monkeypatch.setattr(limits.limiter.latency, "averages", {})
+    seen = []
+    in_flight = limits.limiter.in_flight
+    with make_client(seen) as client:
+        response = client.get("/raw/0.1/export")
+        assert response.text.count("\n") == 3
+        # The slot is held while the body streams:
+        assert seen == [in_flight + 1] * 3
+        assert limits.limiter.in_flight == in_flight
+        assert limits.limiter.latency.average("mongo") == 0.0
+
+        assert client.get("/raw/0.1/entry/abc").status_code == 200
+        assert client.get("/raw/0.1/entry/fail").status_code == 500
+        assert limits.limiter.in_flight == in_flight
@@ -0,0 +1,70 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from click.testing import CliRunner
+
+from cdiapi import settings
+from cdiapi.cli import cli
+from cdiapi.loader import ManifestError, load_collection, read_manifest
+
+
+def parse_numbers(chunk):
+    if chunk == "bad":
+        raise ValueError("Broken chunk")
+    time.sleep(0.05)
+    records = [(str(num), "hash%d" % num, b'{"id": "%d"}' % num) for num in chunk]
+    return records, []
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """Keys of the records passed to `write_records`."""
+    keys = []
+
+    async def write_records(collection, key_field, records, force, stats):
+        await asyncio.sleep(0.01)
+        keys.extend(key for key, _, _ in records)
+        stats.written += len(records)
+
+    monkeypatch.setattr("cdiapi.loader.write_records", write_records)
+    return keys
+
+
+async def test_load_collection(written):
+    with ThreadPoolExecutor(2) as pool:
+        chunks = iter([[1, 2], [3], [4, 5]])
+        stats = await load_collection("items", chunks, parse_numbers, None, "id", pool)
+    assert stats.valid == 5
+    assert stats.written == 5
+    assert sorted(written) == ["1", "2", "3", "4", "5"]
+
+
+async def test_failed_chunk_cancels_the_others(written, monkeypatch):
+    monkeypatch.setattr(settings, "LOADER_WORKERS", 4)
+    with ThreadPoolExecutor(4) as pool:
+        chunks = iter([[1], [2], "bad", [3], [4], [5]])
+        with pytest.raises(ValueError):
+            await load_collection("items", chunks, parse_numbers, None, "id", pool)
+        # Nothing is left running in the background:
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+
+def test_missing_manifest(tmp_path, monkeypatch):
+    missing = str(tmp_path / "missing.yml")
+    monkeypatch.setattr(settings, "MANIFEST", missing)
+    with pytest.raises(ManifestError):
+        read_manifest()
+    result = CliRunner().invoke(cli, ["registry-update"])
+    assert result.exit_code == 1
+    assert "Manifest not found: %s" % missing in result.output
+
+
+def test_invalid_manifest(tmp_path, monkeypatch):
+    path = tmp_path / "manifest.yml"
+    path.write_text("- just\n- a list\n")
+    monkeypatch.setattr(settings, "MANIFEST", str(path))
+    with pytest.raises(ManifestError):
+        read_manifest()
+    path.write_text("catalogs:\n  - path: catalogs\n")
+    assert read_manifest() == {"catalogs": [{"path": "catalogs"}]}
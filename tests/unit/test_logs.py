@@ -0,0 +1,94 @@
+import io
+import logging
+import pytest
+
+from cdiapi import settings
+from cdiapi.app import log_request
+from cdiapi.logs import _STOP, LogWriter, QueueHandler
+
+
+def make_record(msg, level=logging.INFO, args=None):
+    return logging.LogRecord("test", level, __file__, 0, msg, args, None)
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(settings, "LOG_QUEUE_SIZE", 3)
+    writer = LogWriter(logging.Formatter("%(levelname)s %(message)s"), io.StringIO(), io.StringIO())
+    yield writer
+    writer.stop()
+
+
+def test_levels_go_to_their_streams(writer):
+    writer.write([make_record("one"), make_record("two", logging.ERROR), make_record("three", logging.WARNING)])
+    assert writer.out.getvalue() == "INFO one\nWARNING three\n"
+    assert writer.err.getvalue() == "ERROR two\n"
+
+
+def test_full_queue_drops_records(writer):
+    handler = QueueHandler(writer)
+    for num in range(5):
+        handler.emit(make_record("record %d" % num))
+    assert writer.dropped == 2
+    writer.write([writer.queue.get_nowait() for _ in range(3)])
+    lines = writer.out.getvalue().splitlines()
+    assert lines[0] == "WARNING Log queue full, dropped 2 records"
+    assert lines[1:] == ["INFO record 0", "INFO record 1", "INFO record 2"]
+    assert writer.dropped == 0
+
+
+def test_arguments_are_formatted_when_queued(writer):
+    names = ["a"]
+    QueueHandler(writer).emit(make_record("names %s", args=(names,)))
+    names.append("b")
+    writer.write([writer.queue.get_nowait()])
+    assert writer.out.getvalue() == "INFO names ['a']\n"
+
+
+def test_thread_writes_until_stopped(writer):
+    writer.start()
+    handler = QueueHandler(writer)
+    handler.emit(make_record("first"))
+    handler.emit(make_record("second"))
+    writer.stop()
+    assert writer.out.getvalue() == "INFO first\nINFO second\n"
+    assert writer.thread is None
+
+
+def test_restart_after_fork(writer):
+    writer.start()
+    parent, parent_queue = writer.thread, writer.queue
+    # What the child of a fork runs, the thread of the parent isn't copied:
+    writer.restart()
+    assert writer.thread is not parent and writer.thread.is_alive()
+    QueueHandler(writer).emit(make_record("child"))
+    writer.stop()
+    assert writer.out.getvalue() == "INFO child\n"
+    parent_queue.put(_STOP)
+    parent.join(5)
+
+
+def test_stopped_writer_stays_stopped(writer):
+    writer.start()
+    writer.stop()
+    writer.restart()
+    assert writer.thread is None
+
+
+@pytest.mark.parametrize(
+    "status, took, path, rejected, logged",
+    [
+        (500, 0.01, "/raw/0.1/search", False, True),
+        (404, 0.01, "/readyz", False, True),
+        (200, 10.0, "/raw/0.1/search", False, True),
+        (200, 0.01, "/raw/0.1/search", False, False),
+        (200, 0.01, "/healthz", False, False),
+        (429, 0.01, "/raw/0.1/search", True, False),
+    ],
+)
+def test_log_request(monkeypatch, status, took, path, rejected, logged):
+    monkeypatch.setattr(settings, "LOG_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(settings, "LOG_SLOW_REQUEST", 1.0)
+    assert log_request(status, took, path, rejected) is logged
+    monkeypatch.setattr(settings, "LOG_SAMPLE_RATE", 1.0)
+    assert log_request(status, took, path, rejected) is (logged or path != "/healthz")
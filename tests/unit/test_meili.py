@@ -0,0 +1,86 @@
+import asyncio
+import httpx
+import pytest
+
+from cdiapi.meili import ApiError, MeiliClient, TransportError, get_meili
+
+
+def mock_client(handler, **kwargs):
+    meili = MeiliClient("http://meili", None, "fulldb", **kwargs)
+    transport = httpx.MockTransport(handler)
+    meili.http = httpx.AsyncClient(transport=transport, base_url="http://meili")
+    return meili
+
+
+def failing(exc):
+    async def handler(request):
+        raise exc
+
+    return mock_client(handler)
+
+
+@pytest.fixture
+def docs(meili):
+    meili.indexes["fulldb"] = {"docs": {"a": {"id": "a"}, "b": {"id": "b"}}, "settings": {}}
+
+
+async def test_search(meili, docs):
+    result = await meili.client().search("water", {"page": 1, "hitsPerPage": 1})
+    assert result["hits"] == [{"id": "a"}]
+    assert meili.searches == [{"page": 1, "hitsPerPage": 1, "q": "water"}]
+
+
+async def test_api_error(meili, docs):
+    meili.error = (400, "Invalid filter")
+    with pytest.raises(ApiError) as info:
+        await meili.client().search("", {"page": 1, "hitsPerPage": 1})
+    assert info.value.status_code == 400
+    assert "Invalid filter" in info.value.message
+
+
+@pytest.mark.parametrize(
+    "exc, message",
+    [(httpx.ReadTimeout("slow"), "timed out"), (httpx.ConnectError("refused"), "unavailable")],
+)
+async def test_transport_errors(exc, message):
+    with pytest.raises(TransportError, match=message):
+        await failing(exc).search("", {})
+
+
+async def test_searches_in_flight_are_capped():
+    release = asyncio.Event()
+
+    async def handler(request):
+        await release.wait()
+        return httpx.Response(200, json={"hits": []})
+
+    meili = mock_client(handler, timeout=0.05, max_concurrency=1)
+    first = asyncio.ensure_future(meili.search("", {}, timeout=5))
+    await asyncio.sleep(0.01)
+    # Waiting for a slot counts against the timeout:
+    with pytest.raises(TransportError, match="concurrent"):
+        await meili.search("", {})
+    release.set()
+    assert await first == {"hits": []}
+    assert await meili.search("", {}) == {"hits": []}
+
+
+def test_query(client, meili, docs):
+    response = client.get("/index/0.1/query", params={"q": "water"})
+    assert response.status_code == 200
+    assert [hit["id"] for hit in response.json()["hits"]] == ["a", "b"]
+
+
+def test_query_error(client, meili, docs):
+    meili.error = (400, "Invalid filter")
+    response = client.get("/index/0.1/query", params={"filters": "bad"})
+    assert response.status_code == 400
+    assert "Invalid filter" in response.json()["detail"]
+
+
+def test_query_backend_unavailable(client):
+    unavailable = failing(httpx.ConnectError("refused"))
+    client.app.dependency_overrides[get_meili] = lambda: unavailable
+    response = client.get("/index/0.1/query", params={"q": "water"})
+    assert response.status_code == 500
+    assert "unavailable" in response.json()["detail"]
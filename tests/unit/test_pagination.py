@@ -0,0 +1,145 @@
+import base64
+from datetime import datetime
+import pytest
+from bson import ObjectId, json_util
+from fastapi import HTTPException
+
+from cdiapi import settings
+from cdiapi.pagination import TotalMode, count_cache, count_total, decode_cursor, encode_cursor
+from cdiapi.pagination import keyset_query, normalize_query, page_items
+
+
+def make_cursor(value, last_id):
+    raw = json_util.dumps([value, last_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+@pytest.mark.parametrize("value", ["cdi00000002", 12, 1.5, datetime(2026, 1, 1), None])
+def test_cursor_round_trip(value):
+    item = {"_id": ObjectId(), "source": {"uid": value}}
+    cursor = encode_cursor(item, "source.uid")
+    assert decode_cursor(cursor) == (value, item["_id"])
+
+
+def test_cursor_without_sort_field():
+    item = {"_id": ObjectId(), "uid": "cdi00000002"}
+    assert decode_cursor(encode_cursor(item)) == (None, item["_id"])
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "garbage",
+        make_cursor({"$ne": None}, ObjectId()),
+        make_cursor(["a", "b"], ObjectId()),
+        make_cursor("cdi00000002", {"$gt": ""}),
+        make_cursor("cdi00000002", "5f0c0ffee0c0ffee0c0ffee0"),
+    ],
+)
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as error:
+        keyset_query({}, cursor, "uid")
+    assert error.value.status_code == 400
+
+
+def test_keyset_query():
+    last_id = ObjectId()
+    cursor = make_cursor("cdi00000002", last_id)
+    assert keyset_query({"software.id": "ckan"}, cursor, "uid") == {
+        "software.id": "ckan",
+        "$or": [
+            {"uid": {"$gt": "cdi00000002"}},
+            {"uid": "cdi00000002", "_id": {"$gt": last_id}},
+        ],
+    }
+    assert keyset_query({"_id": {"$ne": None}}, cursor) == {
+        "$and": [{"_id": {"$ne": None}}, {"_id": {"$gt": last_id}}]
+    }
+
+
+def test_page_items():
+    items = [{"_id": ObjectId(), "uid": "cdi%08d" % num} for num in range(3)]
+    assert page_items(items, 3, "uid") == (items, None)
+    page, cursor = page_items(items, 2, "uid")
+    assert page == items[:2]
+    assert decode_cursor(cursor) == ("cdi00000001", items[1]["_id"])
+
+
+def follow(client, url, params):
+    """uids or ids of all pages of a paged search, following `next_cursor`."""
+    found, pages = [], 0
+    while True:
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        body = response.json()
+        # An offset only applies to the first page, cursor pages have none:
+        assert body["meta"]["offset"] == (None if "cursor" in params else 0)
+        found += [item.get("uid", item.get("id")) for item in body["data"]]
+        pages += 1
+        if body["meta"]["next_cursor"] is None:
+            return found, pages
+        params = {**params, "cursor": body["meta"]["next_cursor"]}
+
+
+async def test_last_page_of_exactly_limit_items(client, seed):
+    await seed(entries=20, catalogs=10)
+    found, pages = follow(client, "/raw/0.1/search", {"limit": 10, "total": "none"})
+    assert pages == 2
+    assert len(set(found)) == 20
+    found, pages = follow(client, "/registry/search/catalogs/", {"limit": 5, "total": "none"})
+    assert pages == 2
+    assert found == sorted(found)
+
+
+@pytest.mark.parametrize("url", ["/raw/0.1/search", "/registry/search/catalogs/"])
+async def test_text_search_has_no_cursor(client, seed, url):
+    await seed(entries=3, catalogs=3)
+    cursor = client.get(url, params={"limit": 1}).json()["meta"]["next_cursor"]
+    response = client.get(url, params={"q": "water", "cursor": cursor})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("params", [{"limit": 0}, {"limit": -1}, {"offset": -1}])
+def test_page_bounds(client, params):
+    assert client.get("/raw/0.1/search", params=params).status_code == 422
+    assert client.get("/registry/search/catalogs/", params=params).status_code == 422
+
+
+@pytest.fixture
+async def entries(store, seed):
+    count_cache.clear()
+    await seed(entries=30)
+    return await store.entries.collection()
+
+
+async def test_count_exact(entries):
+    query = {"source.uid": "cdi00000002"}
+    assert await count_total(entries, query, TotalMode.exact) == (30, "eq")
+    await entries.delete_many({"int_id": "0"})
+    # Served from the count cache until it expires:
+    assert await count_total(entries, query, TotalMode.exact) == (30, "eq")
+    count_cache.clear()
+    assert await count_total(entries, query, TotalMode.exact) == (29, "eq")
+
+
+async def test_count_estimate(entries, monkeypatch):
+    assert await count_total(entries, {}, TotalMode.estimate) == (30, "approx")
+    query = {"dataset.formats": "CSV"}
+    monkeypatch.setattr(settings, "COUNT_ESTIMATE_LIMIT", 10)
+    assert await count_total(entries, query, TotalMode.estimate) == (10, "gte")
+    monkeypatch.setattr(settings, "COUNT_ESTIMATE_LIMIT", 100)
+    assert await count_total(entries, query, TotalMode.estimate) == (30, "eq")
+    # Counted exactly, cached for the exact mode too:
+    await entries.delete_many({"int_id": "0"})
+    assert await count_total(entries, query, TotalMode.exact) == (30, "eq")
+
+
+async def test_count_none(entries):
+    assert await count_total(entries, {}, TotalMode.none) == (None, None)
+
+
+def test_count_cache_key_is_normalized():
+    assert normalize_query({"b": {"$in": ["y", "x", "y"]}, "a": 1}) == {
+        "a": 1,
+        "b": {"$in": ["x", "y"]},
+    }
@@ -0,0 +1,63 @@
+import pytest
+
+from cdiapi.data.common import SearchIndexEntryResponse
+from cdiapi.data.projection import field_projection, model_paths
+from cdiapi.data.search import SearchIndexEntrySummary
+
+
+def test_field_projection():
+    projection = field_projection(SearchIndexEntryResponse, ["id", "dataset.title,source"])
+    assert projection == {"id": 1, "dataset.title": 1, "source": 1}
+    # A field inside a selected object is covered by it:
+    assert field_projection(SearchIndexEntryResponse, ["source", "source.uid"]) == {"source": 1}
+
+
+@pytest.mark.parametrize("fields", [["nope"], ["dataset.nope"], ["id,dataset.title.x"]])
+def test_field_projection_unknown(fields):
+    with pytest.raises(ValueError):
+        field_projection(SearchIndexEntryResponse, fields)
+
+
+def test_summary_paths():
+    assert set(model_paths(SearchIndexEntrySummary)) >= {"id", "dataset.title", "dataset.url"}
+
+
+async def test_entry_fields(client, seed):
+    await seed(entries=3)
+    response = client.get("/raw/0.1/entry/cdi00000002-1", params={"fields": "dataset.title"})
+    assert response.status_code == 200
+    assert response.json() == {"id": "cdi00000002-1", "dataset": {"title": "Open Field Vegetable Crops 1"}}
+
+
+async def test_entry_summary(client, seed):
+    await seed(entries=3)
+    response = client.get("/raw/0.1/entry/cdi00000002-1", params={"view": "summary"})
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {"id", "source", "dataset"}
+    assert set(body["dataset"]) == {"title", "url"}
+
+
+async def test_search_fields(client, seed):
+    await seed(entries=3)
+    response = client.get("/raw/0.1/search", params={"fields": ["dataset.title", "source.uid"]})
+    assert response.status_code == 200
+    for item in response.json()["data"]:
+        assert set(item) == {"id", "dataset", "source"}
+        assert set(item["dataset"]) == {"title"}
+        assert set(item["source"]) == {"uid"}
+
+
+async def test_search_summary(client, seed):
+    await seed(entries=3)
+    response = client.get("/raw/0.1/search", params={"view": "summary"})
+    assert response.status_code == 200
+    assert all(set(item["dataset"]) == {"title", "url"} for item in response.json()["data"])
+
+
+@pytest.mark.parametrize("url", ["/raw/0.1/entry/cdi00000002-1", "/raw/0.1/search"])
+async def test_unknown_field(client, seed, url):
+    await seed(entries=3)
+    response = client.get(url, params={"fields": "dataset.nope"})
+    assert response.status_code == 400
+    assert "dataset.nope" in response.json()["detail"]
@@ -0,0 +1,177 @@
+from datetime import datetime, timezone
+from typing import Optional
+import orjson
+import pytest
+from bson import ObjectId
+from pydantic import BaseModel, ValidationError
+from starlette.requests import Request
+
+from cdiapi import settings
+from cdiapi.responses import CachedBody, conditional_response, encode, is_not_modified
+
+
+def make_request(headers):
+    raw = [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw})
+
+
+LAST_MODIFIED = datetime(2026, 1, 1, 12, 0, 0, 500, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def cached():
+    return CachedBody(b'{"data":[]}', last_modified=LAST_MODIFIED)
+
+
+def test_etag_is_stable(cached):
+    assert cached.etag == CachedBody(b'{"data":[]}').etag
+    assert cached.etag != CachedBody(b'{"data":[1]}').etag
+    assert cached.etag.startswith('"') and cached.etag.endswith('"')
+
+
+@pytest.mark.parametrize(
+    "if_none_match, expected",
+    [
+        ("*", True),
+        ('"other", %s', True),
+        ("W/%s", True),
+        ('"other"', False),
+    ],
+)
+def test_if_none_match(cached, if_none_match, expected):
+    header = if_none_match.replace("%s", cached.etag)
+    assert is_not_modified(make_request({"If-None-Match": header}), cached.etag) is expected
+
+
+def test_if_none_match_with_encoded_etag(cached):
+    header = cached.etag[:-1] + '-gzip"'
+    assert is_not_modified(make_request({"If-None-Match": header}), cached.etag)
+
+
+def test_if_modified_since(cached):
+    request = make_request({"If-Modified-Since": "Thu, 01 Jan 2026 12:00:00 GMT"})
+    assert is_not_modified(request, cached.etag, LAST_MODIFIED)
+    request = make_request({"If-Modified-Since": "Thu, 01 Jan 2026 11:59:59 GMT"})
+    assert not is_not_modified(request, cached.etag, LAST_MODIFIED)
+    request = make_request({"If-Modified-Since": "yesterday"})
+    assert not is_not_modified(request, cached.etag, LAST_MODIFIED)
+    # If-None-Match takes precedence:
+    request = make_request(
+        {"If-None-Match": '"other"', "If-Modified-Since": "Thu, 01 Jan 2026 12:00:00 GMT"}
+    )
+    assert not is_not_modified(request, cached.etag, LAST_MODIFIED)
+
+
+def test_conditional_response(cached):
+    response = conditional_response(make_request({}), cached, {"Cache-Control": "max-age=60"})
+    assert response.status_code == 200
+    assert response.body == cached.body
+    assert response.headers["etag"] == cached.etag
+    assert response.headers["last-modified"] == "Thu, 01 Jan 2026 12:00:00 GMT"
+    assert response.headers["cache-control"] == "max-age=60"
+
+    response = conditional_response(make_request({"If-None-Match": cached.etag}), cached)
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == cached.etag
+
+
+class Item(BaseModel):
+    id: str
+    title: Optional[str] = None
+
+
+def test_encode_trusts_the_store(monkeypatch):
+    monkeypatch.setattr(settings, "VALIDATE_RESPONSES", False)
+    oid = ObjectId()
+    body = encode(Item, {"id": 1, "extra": oid})
+    assert orjson.loads(body) == {"id": 1, "extra": str(oid)}
+
+
+def test_encode_validates(monkeypatch):
+    monkeypatch.setattr(settings, "VALIDATE_RESPONSES", True)
+    assert orjson.loads(encode(Item, {"id": "a", "extra": 1})) == {"id": "a", "title": None}
+    assert orjson.loads(encode(Item, {"id": "a"}, exclude_unset=True)) == {"id": "a"}
+    with pytest.raises(ValidationError):
+        encode(Item, {"id": 1})
+
+
+def defaults_added(validated, trusted):
+    """Whether `validated` is `trusted` with only defaults added."""
+    if isinstance(trusted, dict):
+        return all(defaults_added(validated.get(key), value) for key, value in trusted.items())
+    if isinstance(trusted, list):
+        return len(validated) == len(trusted) and all(map(defaults_added, validated, trusted))
+    return validated == trusted
+
+
+@pytest.mark.parametrize(
+    "url, params",
+    [
+        ("/raw/0.1/entry/cdi00000002-1", {"view": "summary"}),
+        ("/raw/0.1/search", {}),
+        ("/raw/0.1/search", {"fields": "dataset.title"}),
+        ("/registry/search/catalogs/", {}),
+    ],
+)
+async def test_validated_responses_match(client, seed, monkeypatch, url, params):
+    await seed(entries=3, catalogs=3)
+    trusted = client.get(url, params=params).json()
+    monkeypatch.setattr(settings, "VALIDATE_RESPONSES", True)
+    validated = client.get(url, params=params).json()
+    assert defaults_added(validated, trusted)
+    if params.get("fields"):
+        # Partial entries echo only the projected fields:
+        assert validated == trusted
+
+
+async def test_invalid_document(client, store, seed, monkeypatch):
+    await seed(entries=3)
+    collection = await store.entries.collection()
+    await collection.update_one({"id": "cdi00000002-1"}, {"$unset": {"dataset.url": ""}})
+    params = {"view": "summary"}
+    assert client.get("/raw/0.1/entry/cdi00000002-1", params=params).status_code == 200
+    monkeypatch.setattr(settings, "VALIDATE_RESPONSES", True)
+    assert client.get("/raw/0.1/entry/cdi00000002-1", params=params).status_code == 500
+
+
+async def test_entry_not_modified(client, seed):
+    await seed(entries=3)
+    response = client.get("/raw/0.1/entry/cdi00000002-1")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    response = client.get("/raw/0.1/entry/cdi00000002-1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    response = client.get("/raw/0.1/entry/cdi00000002-2", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "url, removed",
+    [
+        ("/raw/0.1/search", {"id": "cdi00000002-1"}),
+        ("/registry/search/catalogs/", {"uid": "cdi00000001"}),
+    ],
+)
+async def test_page_modified_by_delete(client, seed, store, url, removed):
+    await seed(entries=3, catalogs=3)
+    for pointer in (store.entries, store.catalogs):
+        collection = await pointer.collection()
+        await collection.update_many({}, {"$set": {"updated_at": LAST_MODIFIED}})
+    response = client.get("/raw/0.1/entry/cdi00000002-1")
+    assert "last-modified" in response.headers
+    response = client.get(url)
+    assert response.status_code == 200
+    # The newest item is unchanged by a delete, so pages carry no date:
+    assert "last-modified" not in response.headers
+    headers = {
+        "If-None-Match": response.headers["etag"],
+        "If-Modified-Since": "Thu, 01 Jan 2026 12:00:00 GMT",
+    }
+    assert client.get(url, headers=headers).status_code == 304
+    collection = await (store.entries if "raw" in url else store.catalogs).collection()
+    await collection.delete_one(removed)
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["meta"]["num"] == 2
@@ -0,0 +1,73 @@
+import pytest
+
+from cdiapi import settings
+
+
+@pytest.fixture
+def search(client, meili):
+    meili.indexes["fulldb"] = {"docs": {"a": {"id": "a"}, "b": {"id": "b"}}, "settings": {}}
+
+    def search(**params):
+        response = client.get("/index/0.1/query", params=params)
+        assert response.status_code == 200, response.text
+        return meili.searches[-1]
+
+    return search
+
+
+def test_paging(search):
+    body = search()
+    assert (body["page"], body["hitsPerPage"]) == (1, 20)
+    assert "offset" not in body and "limit" not in body
+    body = search(page=3, limit=5)
+    assert (body["page"], body["hitsPerPage"]) == (3, 5)
+    body = search(offset=40, limit=5)
+    assert (body["offset"], body["limit"]) == (40, 5)
+    assert "page" not in body and "hitsPerPage" not in body
+
+
+def test_page_and_offset(client):
+    assert client.get("/index/0.1/query", params={"page": 2, "offset": 10}).status_code == 400
+
+
+def test_facets(search, client):
+    assert search()["facets"] == settings.DEFAULT_FACETS
+    assert "facets" not in search(facets="false")
+    assert search(facets="source.name,dataset.formats,source.name")["facets"] == ["source.name", "dataset.formats"]
+    # Only the facets, no hits:
+    body = search(limit=0, facets="source.name")
+    assert body["hitsPerPage"] == 0
+    assert client.get("/index/0.1/query", params={"facets": "dataset.title"}).status_code == 400
+
+
+def test_attributes(search, client):
+    assert "attributesToRetrieve" not in search()
+    assert set(search(view="summary")["attributesToRetrieve"]) >= {"id", "dataset.title", "dataset.url"}
+    assert search(fields="id,dataset.title")["attributesToRetrieve"] == ["dataset.title", "id"]
+    assert client.get("/index/0.1/query", params={"fields": "nope"}).status_code == 400
+
+
+def test_crop(search):
+    body = search(crop_length=10)
+    assert body["attributesToCrop"] == settings.SEARCH_CROP_ATTRIBUTES
+    assert body["cropLength"] == 10
+    assert "attributesToRetrieve" not in body
+    # Meilisearch formats only the attributes it retrieves:
+    body = search(crop_length=10, view="summary")
+    assert set(settings.SEARCH_CROP_ATTRIBUTES) <= set(body["attributesToRetrieve"])
+    body = search(crop_length=10, fields="dataset.title")
+    assert set(body["attributesToRetrieve"]) == {"id", "dataset.title", *settings.SEARCH_CROP_ATTRIBUTES}
+    # Already retrieved with the whole object:
+    body = search(crop_length=10, fields="dataset")
+    assert set(body["attributesToRetrieve"]) == {"id", "dataset"}
+
+
+def test_response(client, meili, search):
+    response = client.get("/index/0.1/query", params={"q": " salmon  atlantic ", "offset": 1, "limit": 5})
+    body = response.json()
+    assert meili.searches[-1]["q"] == "salmon atlantic"
+    assert [hit["id"] for hit in body["hits"]] == ["b"]
+    # The timing differs between identical searches, it isn't part of the ETag:
+    again = client.get("/index/0.1/query", params={"q": "salmon atlantic", "offset": 1, "limit": 5})
+    assert again.json()["processingTimeMs"] != body["processingTimeMs"]
+    assert again.headers["etag"] == response.headers["etag"]
@@ -0,0 +1,217 @@
+import sys
+import types
+import asyncio
+import pytest
+
+from cdiapi import settings
+from cdiapi.cache import MemoryBackend, RedisBackend, SearchCache
+from cdiapi.responses import CachedBody
+
+
+class FakeRedis:
+    """The part of `redis.asyncio.Redis` the cache backend uses."""
+
+    def __init__(self) -> None:
+        self.data = {}
+        self.expiry = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        assert isinstance(value, bytes)
+        self.data[key] = value
+        self.expiry[key] = ex
+
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    redis = FakeRedis()
+    module = types.ModuleType("redis")
+    module.asyncio = types.SimpleNamespace(from_url=lambda url: redis)
+    monkeypatch.setitem(sys.modules, "redis", module)
+    return redis
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache(request, fake_redis):
+    cache = SearchCache("test", 100, ttl=60, stale=300)
+    if request.param == "redis":
+        cache.backend = RedisBackend("redis://localhost", 360)
+    return cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("cdiapi.cache.time.time", lambda: now[0])
+    return now
+
+
+class Loader:
+    def __init__(self, *bodies):
+        self.bodies = list(bodies)
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return CachedBody(self.bodies[min(self.calls, len(self.bodies)) - 1])
+
+
+async def test_fresh_hit(cache, clock):
+    load = Loader(b'{"hits":1}')
+    first = await cache.get_or_load({"q": "water"}, load)
+    clock[0] += 59
+    second = await cache.get_or_load({"q": "water"}, load)
+    assert second.body == first.body == b'{"hits":1}'
+    assert second.etag == first.etag
+    assert load.calls == 1
+    assert (cache.misses, cache.hits) == (1, 1)
+    await cache.get_or_load({"q": "land"}, load)
+    assert load.calls == 2
+
+
+async def test_stale_while_revalidate(cache, clock):
+    load = Loader(b'{"v":1}', b'{"v":2}')
+    await cache.get_or_load({"q": "water"}, load)
+    clock[0] += 61
+    load.release.clear()
+    # Stale entries are served at once, a single background search refreshes
+    # them:
+    stale = await asyncio.gather(*[cache.get_or_load({"q": "water"}, load) for _ in range(3)])
+    assert [value.body for value in stale] == [b'{"v":1}'] * 3
+    assert cache.stale_hits == 3
+    assert len(cache.refreshing) == 1
+    load.release.set()
+    await asyncio.gather(*cache.refreshing.values())
+    assert load.calls == 2
+    fresh = await cache.get_or_load({"q": "water"}, load)
+    assert fresh.body == b'{"v":2}'
+    assert cache.hits == 1
+
+
+async def test_failed_refresh_keeps_the_stale_entry(cache, clock):
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        raise RuntimeError("meili down")
+
+    await cache.get_or_load({"q": "water"}, Loader(b'{"v":1}'))
+    clock[0] += 61
+    assert (await cache.get_or_load({"q": "water"}, failing)).body == b'{"v":1}'
+    await asyncio.gather(*cache.refreshing.values())
+    assert calls == [1]
+    assert (await cache.get_or_load({"q": "water"}, failing)).body == b'{"v":1}'
+
+
+async def test_coalesced_misses(cache):
+    load = Loader(b'{"hits":1}')
+    load.release.clear()
+    waiters = [asyncio.ensure_future(cache.get_or_load({"q": "water"}, load)) for _ in range(5)]
+    await asyncio.sleep(0.01)
+    load.release.set()
+    values = await asyncio.gather(*waiters)
+    assert load.calls == 1
+    assert {value.body for value in values} == {b'{"hits":1}'}
+    assert (cache.misses, cache.coalesced) == (1, 4)
+
+
+async def test_errors_reach_all_waiters_and_are_not_cached(cache):
+    release = asyncio.Event()
+
+    async def failing():
+        await release.wait()
+        raise RuntimeError("meili down")
+
+    waiters = [asyncio.ensure_future(cache.get_or_load({"q": "x"}, failing)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.pending == {}
+    load = Loader(b"{}")
+    await cache.get_or_load({"q": "x"}, load)
+    assert load.calls == 1
+
+
+async def test_epoch_change_clears_the_cache(monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_CACHE_EPOCH_REFRESH", 0)
+    cache = SearchCache("test", 100, ttl=60, stale=300)
+    epochs = iter(["2026-01-01", "2026-01-01", "2026-01-02"])
+
+    async def fetch():
+        return next(epochs)
+
+    load = Loader(b'{"v":1}', b'{"v":2}')
+    await cache.refresh_epoch(fetch)
+    await cache.get_or_load({"q": "water"}, load)
+    await cache.refresh_epoch(fetch)
+    assert (await cache.get_or_load({"q": "water"}, load)).body == b'{"v":1}'
+    await cache.refresh_epoch(fetch)
+    assert cache.epoch == "2026-01-02"
+    assert cache.stats()["size"] == 0
+    assert (await cache.get_or_load({"q": "water"}, load)).body == b'{"v":2}'
+    assert load.calls == 2
+
+
+async def test_unreadable_epoch_keeps_the_cache(monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_CACHE_EPOCH_REFRESH", 0)
+    cache = SearchCache("test", 100, ttl=60, stale=300)
+    cache.epoch = "2026-01-01"
+
+    async def fetch():
+        raise RuntimeError("meili down")
+
+    await cache.refresh_epoch(fetch)
+    assert cache.epoch == "2026-01-01"
+
+
+@pytest.mark.parametrize(
+    "variants",
+    [{}, {"gzip": b"\x1f\x8b\n\x00gz"}, {"gzip": b"\x1f\x8b\ngz", "br": b"\nbr\n", "zstd": b""}],
+)
+async def test_variant_framing(cache, clock, variants):
+    # Bodies and variants may hold newlines, only the header line is split:
+    value = CachedBody(b'{"text":"a\nb"}', variants=dict(variants))
+    await cache._set("key", value)
+    fresh, cached = await cache._get("key")
+    assert fresh == clock[0] + 60
+    assert cached.body == value.body
+    assert cached.etag == value.etag
+    assert cached.variants == variants
+
+
+async def test_redis_entries_expire_after_the_stale_period(fake_redis, clock):
+    cache = SearchCache("test", 100, ttl=60, stale=300)
+    cache.backend = RedisBackend("redis://localhost", 60 + 300)
+    await cache.get_or_load({"q": "water"}, Loader(b"{}"))
+    [key] = fake_redis.data
+    assert key.startswith("cdiapi:search:")
+    assert fake_redis.expiry[key] == 360
+
+
+async def test_backend_failure_is_a_miss(cache):
+    async def broken(key):
+        raise ConnectionError("redis down")
+
+    cache.backend.get = broken
+    load = Loader(b"{}")
+    await cache.get_or_load({"q": "water"}, load)
+    await cache.get_or_load({"q": "water"}, load)
+    assert load.calls == 2
+
+
+async def test_disabled_cache():
+    cache = SearchCache("test", 100, ttl=0, stale=0)
+    load = Loader(b"{}")
+    await cache.get_or_load({"q": "water"}, load)
+    await cache.get_or_load({"q": "water"}, load)
+    assert load.calls == 2
+    assert isinstance(cache.backend, MemoryBackend)
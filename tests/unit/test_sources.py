@@ -0,0 +1,141 @@
+import asyncio
+import pytest
+
+from cdiapi.routers import raw
+from cdiapi.sources import SourceRegistry, source_record
+from benchmarks.bench_serialization import make_catalog, make_entry
+
+
+class CountingCollection:
+    """Catalogs collection counting the queries made to it."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return self.collection.find(query, projection)
+
+
+@pytest.fixture
+async def catalogs(mongo):
+    collection = mongo.cdi.catalogs
+    await collection.insert_many([make_catalog(num) for num in range(3)])
+    return CountingCollection(collection)
+
+
+def uid(num):
+    return make_catalog(num)["uid"]
+
+
+def test_source_record():
+    record = source_record(make_catalog(1))
+    assert record["uid"] == uid(1)
+    assert record["url"] == make_catalog(1)["link"]
+    assert set(record) >= {"owner_name", "countries", "macroregions", "subregions"}
+
+
+async def test_first_resolve_loads_the_snapshot(catalogs):
+    registry = SourceRegistry()
+    found = await registry.resolve(catalogs, [uid(0), uid(2), uid(0)])
+    assert list(found) == [uid(0), uid(2)]
+    assert catalogs.queries == [{}]
+    assert len(registry.records) == 3
+    await registry.resolve(catalogs, [uid(1)])
+    assert catalogs.queries == [{}]
+
+
+async def test_late_catalogs_are_looked_up(catalogs):
+    registry = SourceRegistry()
+    await registry.resolve(catalogs, [])
+    await catalogs.collection.insert_one(make_catalog(5))
+    found = await registry.resolve(catalogs, [uid(0), uid(5)])
+    assert list(found) == [uid(0), uid(5)]
+    assert catalogs.queries == [{}, {"uid": {"$in": [uid(5)]}}]
+    await registry.resolve(catalogs, [uid(5)])
+    assert len(catalogs.queries) == 2
+
+
+async def test_unknown_uids_are_cached(catalogs, monkeypatch):
+    registry = SourceRegistry()
+    assert await registry.resolve(catalogs, ["unknown"]) == {}
+    assert await registry.resolve(catalogs, ["unknown"]) == {}
+    assert catalogs.queries == [{}, {"uid": {"$in": ["unknown"]}}]
+    # Looked up again once they expire:
+    monkeypatch.setattr(registry.missing, "ttl", 0)
+    registry.missing.set("unknown", True)
+    await asyncio.sleep(0.001)
+    await registry.resolve(catalogs, ["unknown"])
+    assert len(catalogs.queries) == 3
+
+
+async def test_expired_snapshot_is_reloaded_in_the_background(catalogs):
+    registry = SourceRegistry()
+    await registry.resolve(catalogs, ["unknown"])
+    await catalogs.collection.delete_one({"uid": uid(0)})
+    registry.expire()
+    # The stale snapshot is served while it is reloaded:
+    found = await registry.resolve(catalogs, [uid(0)])
+    assert list(found) == [uid(0)]
+    reload = registry.reload
+    assert reload is not None
+    await registry.resolve(catalogs, [uid(1)])
+    assert registry.reload is reload
+    await reload
+    assert uid(0) not in registry.records
+    assert registry.expires > 0
+    # The reload forgets the unknown uids:
+    await registry.resolve(catalogs, ["unknown"])
+    assert catalogs.queries[-1] == {"uid": {"$in": ["unknown"]}}
+
+
+async def test_failed_reload_keeps_the_snapshot(catalogs, monkeypatch):
+    registry = SourceRegistry()
+    await registry.resolve(catalogs, [])
+    registry.expire()
+
+    def find(query, projection=None):
+        raise RuntimeError("MongoDB is down")
+
+    monkeypatch.setattr(catalogs, "find", find)
+    found = await registry.resolve(catalogs, [uid(1)])
+    await registry.reload
+    assert list(found) == [uid(1)]
+    assert len(registry.records) == 3
+    assert registry.expires == 0
+
+
+@pytest.fixture
+async def ref_search(client, store, seed, monkeypatch):
+    monkeypatch.setattr(raw, "source_registry", SourceRegistry())
+    await seed(entries=3, catalogs=3)
+    entries = await store.entries.collection()
+    orphan = make_entry(9)
+    orphan["source"]["uid"] = "cdi99999999"
+    await entries.insert_one(orphan)
+
+    def search(**params):
+        response = client.get("/raw/0.1/search", params=dict(params, source="ref"))
+        assert response.status_code == 200
+        return response.json()
+
+    return search
+
+
+async def test_search_lists_each_source_once(ref_search):
+    body = ref_search()
+    assert [item["source"] for item in body["data"]] == [{"uid": uid(2)}] * 3 + [{"uid": "cdi99999999"}]
+    # Catalogs missing from the registry are left out:
+    assert list(body["sources"]) == [uid(2)]
+    assert body["sources"][uid(2)] == source_record(make_catalog(2))
+
+
+async def test_search_sources_of_the_page(ref_search):
+    assert ref_search(limit=1, offset=3)["sources"] == {}
+    body = ref_search(view="summary", limit=1)
+    assert set(body["data"][0]) == {"id", "source", "dataset"}
+    assert list(body["sources"]) == [uid(2)]
+    body = ref_search(fields="dataset.title", limit=1)
+    assert body["data"][0] == {"id": "cdi00000002-0", "source": {"uid": uid(2)}, "dataset": {"title": "Open Field Vegetable Crops 0"}}
+    assert list(body["sources"]) == [uid(2)]
@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+
+from cdiapi import settings
+from cdiapi.generations import live_index
+from cdiapi.sync import SEARCH_SYNC, Checkpoint, poll_changes, sync_search
+from benchmarks.bench_serialization import make_entry
+
+T0 = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+async def entries(mongo):
+    collection = mongo[settings.SEARCH_DB].fulldb
+    docs = [dict(make_entry(num), updated_at=T0, _hash="h%d" % num) for num in range(10)]
+    await collection.insert_many(docs)
+    return collection
+
+
+def entry(num, updated_at, version="v2"):
+    return dict(make_entry(num), updated_at=updated_at, _hash="%s-%d" % (version, num))
+
+
+async def test_full_sync_then_poll(mongo, meili, entries):
+    await sync_search(mode="poll", client=mongo, meili=meili.client())
+    assert len(meili.docs()) == 10
+    assert "_hash" not in meili.docs()["cdi00000002-3"]
+    state = await mongo[settings.SEARCH_DB][SEARCH_SYNC].find_one({"_id": "fulldb"})
+    assert state["collection"] == "fulldb"
+    assert state["full"] is None
+    # The search caches start over once per swapped index:
+    epoch = await live_index(mongo[settings.SEARCH_DB], "fulldb")
+    assert epoch.startswith("fulldb_")
+
+    later = state["watermark"] + timedelta(seconds=5)
+    changed = entry(3, later)
+    changed["dataset"]["title"] = "Changed"
+    await entries.replace_one({"id": "cdi00000002-3"}, changed)
+    await entries.insert_one(entry(99, later))
+    meili.added.clear()
+    await sync_search(mode="poll", client=mongo, meili=meili.client())
+    assert meili.added == [["cdi00000002-3", "cdi00000002-99"]]
+    assert meili.docs()["cdi00000002-3"]["dataset"]["title"] == "Changed"
+    assert len(meili.docs()) == 11
+    assert await live_index(mongo[settings.SEARCH_DB], "fulldb") == epoch
+
+
+async def test_late_commit_within_the_lag_is_pushed(mongo, meili, entries, monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_SYNC_LAG", 60)
+    db = mongo[settings.SEARCH_DB]
+    checkpoint = Checkpoint(db, "fulldb")
+    meili.indexes["fulldb"] = {"docs": {}, "settings": {}}
+    watermark = T0 + timedelta(minutes=10)
+    await entries.insert_one(entry(20, watermark))
+    # The initial entries, stamped `T0`, are out of the window:
+    state = {"watermark": T0 + timedelta(minutes=5)}
+    await poll_changes(entries, meili.client(), checkpoint, state, follow=False)
+    assert meili.added == [["cdi00000002-20"]]
+
+    # A batch stamped before the newest entry seen commits after the poll:
+    await entries.insert_one(entry(21, watermark - timedelta(seconds=30)))
+    await entries.insert_one(entry(22, watermark - timedelta(seconds=90)))
+    state = await checkpoint.load()
+    assert state["watermark"] == watermark
+    meili.added.clear()
+    await poll_changes(entries, meili.client(), checkpoint, state, follow=False)
+    # Re-read from the checkpoint, the entries in the window are pushed again:
+    assert meili.added == [["cdi00000002-21", "cdi00000002-20"]]
+    assert "cdi00000002-22" not in meili.docs()
+
+
+async def test_following_pushes_each_version_once(mongo, meili, entries, monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_SYNC_INTERVAL", 0.01)
+    checkpoint = Checkpoint(mongo[settings.SEARCH_DB], "fulldb")
+    meili.indexes["fulldb"] = {"docs": {}, "settings": {}}
+    state = {"watermark": T0}
+    task = asyncio.ensure_future(poll_changes(entries, meili.client(), checkpoint, state, True))
+    try:
+        await asyncio.sleep(0.1)
+        assert meili.added == [["cdi00000002-%d" % num for num in range(10)]]
+        await entries.insert_one(entry(30, T0 - timedelta(seconds=1)))
+        await entries.replace_one({"id": "cdi00000002-4"}, entry(4, T0))
+        await asyncio.sleep(0.1)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    # The window is read on every poll, unchanged entries aren't pushed again:
+    assert meili.added[1:] == [["cdi00000002-30", "cdi00000002-4"]]
+    assert meili.docs()["cdi00000002-4"]["int_id"] == "4"
@@ -0,0 +1,89 @@
+import pytest
+from starlette.requests import Request
+
+from cdiapi import app as app_module, settings
+from cdiapi.profiling import profile_requested, save_profile
+from cdiapi.timing import Timings, current_timings, phase
+
+
+def make_request(query=b"", headers=None):
+    raw = [(name.encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": query, "headers": raw})
+
+
+def phases(response):
+    return {part.split(";")[0] for part in response.headers["server-timing"].split(", ")}
+
+
+def test_timings_header():
+    timings = Timings()
+    token = current_timings.set(timings)
+    try:
+        with phase("encode"):
+            pass
+        timings.add("mongo", 0.0125)
+        timings.add("mongo", 0.0125)
+    finally:
+        current_timings.reset(token)
+    assert timings.header().startswith("encode;dur=")
+    assert timings.header().endswith("mongo;dur=25.0")
+    # Outside of a request nothing is recorded:
+    with phase("encode"):
+        pass
+
+
+async def test_server_timing(client, seed, meili):
+    await seed(entries=3)
+    meili.indexes["fulldb"] = {"docs": {}, "settings": {}}
+    assert phases(client.get("/raw/0.1/search")) >= {"encode", "total"}
+    assert phases(client.get("/index/0.1/query")) >= {"meili-search", "encode", "total"}
+
+
+def test_server_timing_off(client, monkeypatch):
+    monkeypatch.setattr(settings, "SERVER_TIMING", False)
+    assert "server-timing" not in client.get("/healthz").headers
+
+
+@pytest.mark.parametrize(
+    "token, query, headers, expected",
+    [
+        (None, b"profile=1", {"x-profile-token": "secret"}, False),
+        ("secret", b"profile=1", {"x-profile-token": "secret"}, True),
+        ("secret", b"", {"x-profile": "true", "x-profile-token": "secret"}, True),
+        ("secret", b"profile=0", {"x-profile-token": "secret"}, False),
+        ("secret", b"profile=1", {"x-profile-token": "wrong"}, False),
+        ("secret", b"profile=1", {}, False),
+    ],
+)
+def test_profile_requested(monkeypatch, token, query, headers, expected):
+    monkeypatch.setattr(settings, "PROFILE_TOKEN", token)
+    assert profile_requested(make_request(query, headers)) is expected
+
+
+class FakeProfiler:
+    stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def output_html(self):
+        return "<html></html>"
+
+
+def test_save_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILE_PATH", tmp_path / "profiles")
+    profiler = FakeProfiler()
+    # The trace id comes from the client:
+    assert save_profile(profiler, "../../etc/passwd") == "etcpasswd.html"
+    assert profiler.stopped
+    assert (tmp_path / "profiles" / "etcpasswd.html").read_text() == "<html></html>"
+
+
+def test_profiling_needs_the_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(app_module, "start_profile", FakeProfiler)
+    monkeypatch.setattr(app_module, "save_profile", lambda profiler, trace_id: trace_id + ".html")
+    headers = {"x-trace-id": "abc"}
+    assert "x-profile" not in client.get("/healthz?profile=1", headers=headers).headers
+    headers["x-profile-token"] = "secret"
+    assert client.get("/healthz?profile=1", headers=headers).headers["x-profile"] == "abc.html"
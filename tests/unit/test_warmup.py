@@ -0,0 +1,76 @@
+import asyncio
+
+from cdiapi import settings, warmup as warmup_module
+from cdiapi.app import create_app
+from cdiapi.cache import search_cache
+from cdiapi.generations import set_live_index
+from cdiapi.warmup import WarmUp
+
+
+def test_healthz(client):
+    assert client.get("/healthz").json() == {"status": "ok"}
+
+
+def test_readyz(client):
+    warmup = client.app.state.warmup = WarmUp(client.app)
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json() == {"status": "starting", "checks": warmup.checks}
+    warmup.checks.update(schema="ok", mongodb="ok", registry="ok", meilisearch="ConnectError: refused")
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["checks"]["meilisearch"] == "ConnectError: refused"
+    warmup.checks["meilisearch"] = "ok"
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+
+async def test_steps(store, meili, monkeypatch):
+    monkeypatch.setattr(search_cache, "epoch", "")
+    monkeypatch.setattr(search_cache, "epoch_checked", 0.0)
+    meili.indexes["fulldb"] = {"docs": {}, "settings": {}}
+    shadow = "fulldb_20260101000000"
+    await set_live_index(store.search, "fulldb", shadow)
+    app = create_app()
+    app.state.store = store
+    app.state.meili = meili.client()
+    warmup = WarmUp(app)
+    await asyncio.wait_for(warmup.run(), 5)
+    assert warmup.ready
+    assert set(warmup.checks) == {"schema", "mongodb", "meilisearch", "registry"}
+    assert search_cache.epoch == shadow
+
+
+async def test_failed_steps_are_retried(monkeypatch):
+    monkeypatch.setattr(settings, "WARMUP_RETRY", 0)
+    calls = {"ok": 0, "flaky": 0}
+
+    async def ok(app):
+        calls["ok"] += 1
+
+    async def flaky(app):
+        calls["flaky"] += 1
+        if calls["flaky"] < 3:
+            raise ConnectionError("refused")
+
+    monkeypatch.setattr(warmup_module, "STEPS", [("ok", ok), ("flaky", flaky)])
+    warmup = WarmUp(create_app())
+    warmup.start()
+    await asyncio.wait_for(warmup.task, 5)
+    assert warmup.ready
+    # Passed steps aren't run again:
+    assert calls == {"ok": 1, "flaky": 3}
+
+
+async def test_stop(monkeypatch):
+    async def hang(app):
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(warmup_module, "STEPS", [("hang", hang)])
+    warmup = WarmUp(create_app())
+    warmup.start()
+    await asyncio.sleep(0)
+    await warmup.stop()
+    assert warmup.task.cancelled()
+    assert warmup.checks == {"hang": "pending"}
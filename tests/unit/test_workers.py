@@ -0,0 +1,34 @@
+import os
+import pytest
+
+from cdiapi.workers import MetricsDirError, metrics_dir
+
+
+def test_temporary_metrics_dir(monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    path = metrics_dir()
+    try:
+        assert path is not None
+        assert os.environ["PROMETHEUS_MULTIPROC_DIR"] == path
+        assert os.listdir(path) == []
+    finally:
+        os.rmdir(path)
+
+
+def test_metrics_dir_removes_stale_metrics(tmp_path, monkeypatch):
+    path = tmp_path / "metrics"
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(path))
+    assert metrics_dir() is None
+    assert path.is_dir()
+    (path / "counter_123.db").write_bytes(b"x")
+    assert metrics_dir() is None
+    assert list(path.iterdir()) == []
+
+
+def test_metrics_dir_keeps_other_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    (tmp_path / "counter_123.db").write_bytes(b"x")
+    (tmp_path / "notes.txt").write_text("keep me")
+    with pytest.raises(MetricsDirError):
+        metrics_dir()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["counter_123.db", "notes.txt"]